@@ -21,6 +21,7 @@ using presto-admin
 import logging
 import json
 import shutil
+import sys
 import tarfile
 
 import requests
@@ -69,7 +70,8 @@ def logs():
 
     print 'Downloading logs from all the nodes...'
     execute(file_get, REMOTE_PRESTO_LOG_DIR,
-            downloaded_logs_location, roles=env.roles)
+            downloaded_logs_location, roles=env.roles,
+            on_result=report_progress('Downloaded logs from'))
 
     copy_admin_log(downloaded_logs_location)
 
@@ -77,6 +79,18 @@ def logs():
     print 'logs archive created: ' + OUTPUT_FILENAME_FOR_LOGS
 
 
+def report_progress(message):
+    """
+    Returns an execute() result callback that prints message followed by
+    the host as each host finishes
+    """
+    def on_result(host, result):
+        if not isinstance(result, BaseException):
+            print message + ' ' + host
+            sys.stdout.flush()
+    return on_result
+
+
 def copy_admin_log(log_folder):
     shutil.copy(os.path.join(PRESTOADMIN_LOG_DIR, PRESTOADMIN_LOG_NAME),
                 log_folder)
@@ -185,7 +199,8 @@ def system_info():
 
     _LOGGER.debug('Gathered connector information in file: ' + conn_file_name)
 
-    execute(get_system_info, downloaded_sys_info_loc, roles=env.roles)
+    execute(get_system_info, downloaded_sys_info_loc, roles=env.roles,
+            on_result=report_progress('Gathered system information from'))
 
     make_tarfile(OUTPUT_FILENAME_FOR_SYS_INFO, downloaded_sys_info_loc)
     print 'System info archive created: ' + OUTPUT_FILENAME_FOR_SYS_INFO
@@ -15,19 +15,26 @@
 """
 Module for various configuration management tasks using presto-admin
 """
+import base64
+import difflib
 import logging
 import os
-from StringIO import StringIO
-from contextlib import closing
+import re
+from fabric.context_managers import settings
 from fabric.contrib import files
-from fabric.decorators import task, serial
+from fabric.decorators import task, runs_once
 from fabric.operations import get
 from fabric.operations import put
 from fabric.state import env
+from fabric.tasks import execute
 from fabric.utils import abort, warn
 import prestoadmin.deploy
+from prestoadmin.presto_conf import PRESTO_FILES
 from prestoadmin.topology import requires_topology
 from prestoadmin.util import constants
+from prestoadmin.util import remote_digests
+from prestoadmin.util.remote_batch import RemoteBatch
+from prestoadmin.util.fabricapi import get_host_list
 from prestoadmin.util.filesystem import ensure_parent_directories_exist
 
 
@@ -38,12 +45,17 @@ NODE_PROPERTIES = "node.properties"
 
 ALL_CONFIG = [CONFIG_PROPERTIES, LOG_PROPERTIES, JVM_CONFIG, NODE_PROPERTIES]
 
+# The files printed by show, by the config_type argument
+CONFIG_TYPES = {'node': NODE_PROPERTIES, 'jvm': JVM_CONFIG,
+                'config': CONFIG_PROPERTIES, 'log': LOG_PROPERTIES}
+
 _LOGGER = logging.getLogger(__name__)
 
-__all__ = ['deploy', 'show']
+__all__ = ['deploy', 'diff', 'show']
 
 
 @task
+@runs_once
 @requires_topology
 def deploy(rolename=None):
     """
@@ -58,20 +70,199 @@ def deploy(rolename=None):
     If no rolename is specified, then configuration for all roles will be
     deployed
 
+    Only the files that differ from the ones on a host are written to it,
+    and the files that were changed, left unchanged and found on the host
+    without a local copy are listed for each host. The latter are left
+    alone.
+
     Parameters:
         rolename - [coordinator|workers]
     """
     if rolename is None:
         _LOGGER.info("Running configuration deploy")
-        prestoadmin.deploy.coordinator()
-        prestoadmin.deploy.workers()
+        roles = prestoadmin.deploy.ROLES
+    elif rolename.lower() in prestoadmin.deploy.ROLES:
+        roles = [rolename.lower()]
+    else:
+        abort("Invalid Argument. Possible values: coordinator, workers")
+        return
+    # The configuration is parsed and rendered once here, and then written
+    # to all of the hosts at the same time
+    hosts = get_host_list()
+    rendered = prestoadmin.deploy.render(hosts, roles)
+    prestoadmin.deploy.configure_hosts(rendered, hosts,
+                                       on_result=print_deploy_summary)
+
+
+def print_deploy_summary(host, summary):
+    if not isinstance(summary, remote_digests.Summary):
+        return
+    print('Configuration on %s: changed: %s; unchanged: %s; '
+          'not in local configuration: %s' %
+          (host, ', '.join(summary.changed) or 'none',
+           ', '.join(summary.unchanged) or 'none',
+           ', '.join(summary.unmanaged) or 'none'))
+
+
+@task
+@runs_once
+@requires_topology
+def diff():
+    """
+    Show the hosts whose configuration differs from the local one.
+
+    The digests of the Presto configuration files and the connector
+    configurations on every host are compared with the files that
+    configuration deploy and connector add would write. Hosts with the
+    same differences are listed together, followed by a unified diff of
+    each file that differs. The node.id in node.properties is ignored,
+    since every host has its own.
+    """
+    hosts = get_host_list()
+    rendered = prestoadmin.deploy.render(hosts)
+    results = execute(collect_drift, rendered, local_connectors(),
+                      hosts=hosts)
+    print_drift(hosts, results)
+
+
+def local_connectors():
+    """
+    Returns:
+        dict of the name of each file in the connectors directory to its
+        contents
+    """
+    connectors = {}
+    if os.path.isdir(constants.CONNECTORS_DIR):
+        for name in os.listdir(constants.CONNECTORS_DIR):
+            path = os.path.join(constants.CONNECTORS_DIR, name)
+            if os.path.isfile(path):
+                with open(path) as f:
+                    connectors[name] = f.read()
+    return connectors
+
+
+def collect_drift(rendered, connectors):
+    """
+    Compare the configuration on the current host with rendered and
+    connectors. The digests of the files are fetched in one round trip,
+    and the contents of the files that differ in a second one, if any do.
+
+    Returns:
+        sorted tuple of (remote path, expected contents, actual contents)
+        for each file that differs, with None for the contents of a file
+        that is missing
+    """
+    conf = prestoadmin.deploy.host_conf(rendered)
+    node_path = os.path.join(constants.REMOTE_CONF_DIR, NODE_PROPERTIES)
+    batch = RemoteBatch()
+    listing = remote_digests.add_listing(
+        batch, [constants.REMOTE_CONF_DIR, constants.REMOTE_CATALOG_DIR])
+    node = batch.add('base64 ' + node_path, warn_only=True)
+    results = batch.run(use_sudo=True)
+    digests = remote_digests.parse(results[listing])
+
+    expected = {}
+    if conf is not None:
+        for name, text in conf.files:
+            expected[os.path.join(constants.REMOTE_CONF_DIR, name)] = \
+                text + '\n'
+    for name, content in connectors.iteritems():
+        expected[os.path.join(constants.REMOTE_CATALOG_DIR, name)] = content
+    differing = set(remote_digests.changed_files(expected, digests))
+    managed = [os.path.join(constants.REMOTE_CONF_DIR, name)
+               for name in PRESTO_FILES if name != NODE_PROPERTIES]
+    for path in digests:
+        if path not in expected and (
+                path in managed or
+                os.path.dirname(path) == constants.REMOTE_CATALOG_DIR):
+            differing.add(path)
+    actual = fetch_contents(sorted(p for p in differing if p in digests))
+    drift = [(path, expected.get(path), actual.get(path))
+             for path in differing]
+
+    if conf is not None:
+        expected_node = _without_node_id(
+            prestoadmin.deploy.node_properties_content(
+                [], conf.node_properties))
+        actual_node = None
+        if node_path in digests:
+            actual_node = _without_node_id(_decode(results[node]))
+        if expected_node != actual_node:
+            drift.append((node_path, expected_node, actual_node))
+    return tuple(sorted(drift))
+
+
+def fetch_contents(paths):
+    """
+    Fetch the files at paths on the current host in one round trip
+
+    Returns:
+        dict of each of paths to its contents, or None if it is missing
+    """
+    if not paths:
+        return {}
+    batch = RemoteBatch()
+    for path in paths:
+        batch.add('base64 ' + path, warn_only=True)
+    return dict((path, _decode(result)) for path, result in
+                zip(paths, batch.run(use_sudo=True)))
+
+
+def _decode(result):
+    if result is None or result.failed:
+        return None
+    return base64.b64decode(''.join(result.split()))
+
+
+def _without_node_id(content):
+    if content is None:
+        return None
+    return ''.join(line + '\n' for line in content.splitlines()
+                   if not re.search('node.id', line))
+
+
+def print_drift(hosts, results):
+    """
+    Print the hosts that differ from the expected configuration, grouped
+    by their differences
+    """
+    groups = {}
+    failed = []
+    for host in hosts:
+        drift = results.get(host)
+        if isinstance(drift, BaseException):
+            failed.append(host)
+        elif drift:
+            groups.setdefault(drift, []).append(host)
+
+    matching = len(hosts) - len(failed) - sum(len(group) for group in
+                                              groups.values())
+    print('%d of %d hosts match the expected configuration' %
+          (matching, len(hosts)))
+    for drift, group in sorted(groups.items(),
+                               key=lambda item: hosts.index(item[1][0])):
+        print('\n%s: %d %s from the expected configuration' %
+              (', '.join(group), len(drift),
+               'file differs' if len(drift) == 1 else 'files differ'))
+        for path, expected, actual in drift:
+            print(unified_diff(path, expected, actual))
+    for host in failed:
+        warn('Could not check the configuration of %s: %s' %
+             (host, results[host]))
+
+
+def unified_diff(path, expected, actual):
+    if expected is None:
+        message = '%s is not part of the expected configuration' % path
+    elif actual is None:
+        message = '%s is missing' % path
     else:
-        if rolename.lower() == 'coordinator':
-            prestoadmin.deploy.coordinator()
-        elif rolename.lower() == 'workers':
-            prestoadmin.deploy.workers()
-        else:
-            abort("Invalid Argument. Possible values: coordinator, workers")
+        message = '%s differs' % path
+    lines = difflib.unified_diff(
+        (expected or '').splitlines(), (actual or '').splitlines(),
+        'expected ' + path if expected is not None else '/dev/null',
+        path if actual is not None else '/dev/null', lineterm='')
+    return '\n'.join([message] + list(lines))
 
 
 def gather_directory(target_directory, allow_overwrite=False):
@@ -113,47 +304,78 @@ def configuration_fetch(file_name, config_destination, should_warn=True):
         return remote_file_path
 
 
-def configuration_show(file_name, should_warn=True):
-    with closing(StringIO()) as file_content_buffer:
-        file_path = configuration_fetch(file_name, file_content_buffer,
-                                        should_warn)
-        if file_path is None:
-            return
-        config_values = file_content_buffer.getvalue()
-        file_content_buffer.close()
-        print ("\n%s: Configuration file at %s:" % (env.host, file_path))
-        print config_values
+def show_files(paths, hosts, results, quiet_paths=()):
+    """
+    Print the contents of each of paths on the hosts. Hosts on which a
+    file has the same contents are printed as one block.
+
+    Parameters:
+        results - dict of each host to the contents of each path on it,
+            as returned by fetch_contents()
+        quiet_paths - paths for which no warning is printed when they
+            are missing
+    """
+    for host in hosts:
+        if not isinstance(results.get(host), dict):
+            with settings(host=host):
+                warn('Could not fetch the configuration files: %s'
+                     % results.get(host))
+    for path in paths:
+        groups = []
+        missing = []
+        for host in hosts:
+            contents = results.get(host)
+            if not isinstance(contents, dict):
+                continue
+            if contents.get(path) is None:
+                missing.append(host)
+                continue
+            for content, group in groups:
+                if content == contents[path]:
+                    group.append(host)
+                    break
+            else:
+                groups.append((contents[path], [host]))
+        if missing and path not in quiet_paths:
+            warn("No configuration file found for %s at %s"
+                 % (', '.join(missing), path))
+        for content, group in groups:
+            print ("\n%s: Configuration file at %s:" %
+                   (', '.join(group), path))
+            print content
 
 
 @task
-@serial
+@runs_once
 def show(config_type=None):
     """
     Print to the user the contents of the configuration files deployed
 
     If no config_type is specified, then all four configurations will be
     printed.  No warning will be printed for a missing log.properties since
-    it is not a required configuration file.
+    it is not a required configuration file. The files are fetched from all
+    of the hosts at once, and the hosts on which a file is the same are
+    listed together. A warning is printed for each host that the files
+    could not be fetched from.
 
     Parameters:
         config_type: [node|jvm|config|log]
     """
-    file_name = ''
     if config_type is None:
-        configuration_show(NODE_PROPERTIES)
-        configuration_show(JVM_CONFIG)
-        configuration_show(CONFIG_PROPERTIES)
-        configuration_show(LOG_PROPERTIES, should_warn=False)
+        file_names = [NODE_PROPERTIES, JVM_CONFIG, CONFIG_PROPERTIES,
+                      LOG_PROPERTIES]
+    elif config_type.lower() in CONFIG_TYPES:
+        file_names = [CONFIG_TYPES[config_type.lower()]]
     else:
-        if config_type.lower() == 'node':
-            file_name = NODE_PROPERTIES
-        elif config_type.lower() == 'jvm':
-            file_name = JVM_CONFIG
-        elif config_type.lower() == 'config':
-            file_name = CONFIG_PROPERTIES
-        elif config_type.lower() == 'log':
-            file_name = LOG_PROPERTIES
-        else:
-            abort("Invalid Argument. Possible values: node, jvm, config, log")
-
-        configuration_show(file_name)
+        abort("Invalid Argument. Possible values: node, jvm, config, log")
+        return
+
+    paths = [os.path.join(constants.REMOTE_CONF_DIR, file_name)
+             for file_name in file_names]
+    quiet_paths = []
+    if config_type is None:
+        quiet_paths = [os.path.join(constants.REMOTE_CONF_DIR,
+                                    LOG_PROPERTIES)]
+    hosts = get_host_list()
+    results = execute(fetch_contents, paths, hosts=hosts)
+    show_files(paths, hosts, results, quiet_paths)
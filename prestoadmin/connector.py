@@ -21,13 +21,15 @@ import errno
 from fabric.api import task, env, abort
 from fabric.context_managers import hide
 from fabric.contrib import files
-from fabric.operations import sudo, os, put, get
+from fabric.operations import sudo, os, get
 import fabric.utils
 
-from prestoadmin.util import constants
+from prestoadmin.util import bandwidth, conf_cache, constants, \
+    remote_digests
 from prestoadmin.util.exception import ConfigFileNotFoundError, \
     ConfigurationError
 from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.remote_batch import RemoteBatch
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -36,10 +38,28 @@ COULD_NOT_REMOVE = 'Could not remove connector'
 
 
 def deploy_files(filenames, local_dir, remote_dir):
+    """
+    Copy the files from local_dir to remote_dir in a single round trip.
+    The contents of every file are sent, but each file is only written if
+    its digest on the host differs, so that files that are already up to
+    date keep their modification times.
+
+    Returns:
+        sorted list of the names of the files that were written
+    """
     _LOGGER.info('Deploying configurations for ' + str(filenames))
-    sudo('mkdir -p ' + remote_dir)
+    contents = {}
     for name in filenames:
-        put(os.path.join(local_dir, name), remote_dir, use_sudo=True)
+        with open(os.path.join(local_dir, name)) as f:
+            contents[os.path.join(remote_dir, name)] = f.read()
+    batch = RemoteBatch()
+    batch.add('mkdir -p ' + remote_dir)
+    writes = dict((path, remote_digests.add_write_if_changed(
+        batch, path, contents[path])) for path in sorted(contents))
+    bandwidth.throttle(sum(len(content) for content in contents.values()))
+    results = batch.run(use_sudo=True)
+    return sorted(os.path.basename(path) for path, index in writes.items()
+                  if results[index] == remote_digests.WRITTEN)
 
 
 def gather_connectors(local_config_dir, allow_overwrite=False):
@@ -53,14 +73,38 @@ def gather_connectors(local_config_dir, allow_overwrite=False):
         return []
 
 
+def scan_connectors(connectors_dir):
+    """
+    Returns:
+        dict of the name of each readable file in connectors_dir to whether
+        it contains connector.name
+    """
+    scanned = {}
+    if not os.path.isdir(connectors_dir):
+        return scanned
+    for name in os.listdir(connectors_dir):
+        file_path = os.path.join(connectors_dir, name)
+        try:
+            with open(file_path) as f:
+                scanned[name] = 'connector.name' in f.read()
+        except IOError:
+            # validate() reports the error if the file is being added
+            continue
+    return scanned
+
+
 def validate(filenames):
+    scanned = conf_cache.load(constants.CONNECTORS_DIR, scan_connectors)
     for name in filenames:
         file_path = os.path.join(constants.CONNECTORS_DIR, name)
         _LOGGER.info('Validating connector configuration: ' + str(name))
         try:
-            with open(file_path) as f:
-                file_content = f.read()
-            if 'connector.name' not in file_content:
+            if name in scanned:
+                has_connector_name = scanned[name]
+            else:
+                with open(file_path) as f:
+                    has_connector_name = 'connector.name' in f.read()
+            if not has_connector_name:
                 message = ('Catalog configuration %s does not contain '
                            'connector.name' % name)
                 raise ConfigurationError(message)
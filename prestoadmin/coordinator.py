@@ -21,11 +21,13 @@ import copy
 import logging
 
 from fabric.api import env
+from fabric.utils import warn
 
 import config
 import presto_conf
+from prestoadmin import sizing
 from prestoadmin.presto_conf import validate_presto_conf, get_presto_conf
-from prestoadmin.util import constants
+from prestoadmin.util import conf_cache, constants
 from prestoadmin.util.exception import ConfigurationError
 
 DEFAULT_PROPERTIES = {'node.properties':
@@ -51,6 +53,13 @@ DEFAULT_PROPERTIES = {'node.properties':
                           'query.max-memory-per-node': '1GB'}
                       }
 
+# The properties of the coordinator that depend on the size of the cluster
+CLUSTER_PROPERTIES = ['query.max-memory', 'query.initial-hash-partitions',
+                      'node-scheduler.max-splits-per-node']
+
+# The number of splits queued on a node for each of its worker threads
+SPLITS_PER_WORKER_THREAD = 2
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -66,8 +75,17 @@ def get_conf():
     return conf
 
 
+def get_local_conf():
+    """
+    Returns:
+        the configuration in the local coordinator directory, without the
+        defaults
+    """
+    return _get_conf()
+
+
 def _get_conf():
-    return get_presto_conf(constants.COORDINATOR_DIR)
+    return conf_cache.load(constants.COORDINATOR_DIR, get_presto_conf)
 
 
 def build_defaults():
@@ -84,6 +102,77 @@ def build_defaults():
     return conf
 
 
+def build_cluster_defaults(node_properties):
+    """
+    Derive the cluster-wide memory and scheduling limits of the coordinator
+    from the config.properties of each of the nodes that run tasks
+
+    Returns:
+        dict of config.properties
+    """
+    if not node_properties:
+        return {}
+    memory = _cluster_memory(node_properties)
+    defaults = {'query.max-memory': sizing.data_size(memory),
+                'query.initial-hash-partitions': str(len(node_properties))}
+    threads = [int(node['task.max-worker-threads'])
+               for node in node_properties
+               if 'task.max-worker-threads' in node]
+    if len(threads) == len(node_properties):
+        defaults['node-scheduler.max-splits-per-node'] = \
+            str(SPLITS_PER_WORKER_THREAD * min(threads))
+    return defaults
+
+
+def apply_cluster_defaults(conf, local_conf, node_properties, check=True):
+    """
+    Returns:
+        a copy of conf with the limits derived from node_properties, except
+        for the ones that are set in local_conf, the configuration in the
+        local coordinator directory. Unless check is False, a warning is
+        printed if the limits don't fit the nodes.
+    """
+    conf = copy.deepcopy(conf)
+    explicit = local_conf.get('config.properties', {})
+    for key, value in build_cluster_defaults(node_properties).iteritems():
+        if key not in explicit:
+            conf['config.properties'][key] = value
+    if check:
+        check_cluster_memory(conf['config.properties'], node_properties)
+    return conf
+
+
+def check_cluster_memory(properties, node_properties):
+    """
+    Warn if query.max-memory is more than the nodes that run tasks can give
+    a query together, in which case queries run out of memory on the nodes
+    long before they reach the limit of the cluster
+    """
+    if not node_properties or 'query.max-memory' not in properties:
+        return
+    memory = _cluster_memory(node_properties)
+    if _data_size(properties, 'query.max-memory') > memory:
+        warn('query.max-memory of %s is more than the %s that the %d nodes '
+             'running tasks allow a query in total, going by their '
+             'query.max-memory-per-node.' %
+             (properties['query.max-memory'], sizing.data_size(memory),
+              len(node_properties)))
+
+
+def _cluster_memory(node_properties):
+    return sum(_data_size(node, 'query.max-memory-per-node')
+               for node in node_properties)
+
+
+def _data_size(properties, key):
+    try:
+        return sizing.parse_data_size(properties[key])
+    except ValueError:
+        raise ConfigurationError('Invalid value for %s in config.properties: '
+                                 '%s. Use a data size such as 1GB or 512MB.'
+                                 % (key, properties[key]))
+
+
 def validate(conf):
     validate_presto_conf(conf)
     if conf['config.properties']['coordinator'] != 'true':
@@ -19,11 +19,14 @@ Common module for deploying the presto configuration
 
 import logging
 import os
+from collections import namedtuple
 
-from fabric.contrib import files
-from fabric.operations import sudo
-from fabric.api import env
+from fabric.api import env, settings, warn
+from prestoadmin import sizing
+from prestoadmin.presto_conf import PRESTO_FILES
 from prestoadmin.util import constants
+from prestoadmin.util import remote_digests
+from prestoadmin.util.remote_batch import RemoteBatch, run_batches
 
 import coordinator as coord
 import prestoadmin.util.fabricapi as util
@@ -31,32 +34,365 @@ import workers as w
 
 _LOGGER = logging.getLogger(__name__)
 
+COORDINATOR = 'coordinator'
+WORKERS = 'workers'
+ROLES = [COORDINATOR, WORKERS]
 
-def coordinator():
+# The key of the configurations rendered for individual hosts, whose
+# settings were sized to their hardware, in the result of render()
+HOSTS = 'hosts'
+
+NODE_PROPERTIES = 'node.properties'
+
+# The contents of the configuration files of a role, ready to be written to
+# the hosts: files is a tuple of (file name, contents) pairs for every file
+# but node.properties, whose contents are merged with the node.id of the
+# host instead.
+RenderedConf = namedtuple('RenderedConf', ['files', 'node_properties'])
+
+
+def render(hosts, roles=ROLES):
+    """
+    Load, validate and render the configuration of the roles that any of
+    the hosts have. This is meant to run once, before the host tasks, which
+    are handed the result instead of each parsing the configuration again.
+
+    The cluster-wide limits of the coordinator, like query.max-memory, are
+    derived from the number of nodes that run tasks and their
+    query.max-memory-per-node, unless they are set in the local
+    configuration.
+
+    Returns:
+        dict of role to RenderedConf. If sizing is enabled, HOSTS maps to a
+        dict of host to the RenderedConf sized to the hardware of the host.
+    """
+    confs = {}
+    if COORDINATOR in roles and any(_is_coordinator(h) for h in hosts):
+        confs[COORDINATOR] = coord.get_conf()
+    if WORKERS in roles and any(_is_worker(h) for h in hosts):
+        confs[WORKERS] = w.get_conf()
+    if COORDINATOR in confs:
+        # Checked against the sized nodes instead when sizing is enabled
+        confs[COORDINATOR] = size_cluster(confs,
+                                          check=not sizing.enabled())
+    rendered = dict((role, render_conf(conf))
+                    for role, conf in confs.iteritems())
+    if confs and sizing.enabled():
+        rendered[HOSTS] = render_sized(hosts, confs)
+    return rendered
+
+
+def size_cluster(confs, check=True):
+    """
+    Returns:
+        the coordinator configuration in confs with the cluster-wide limits
+        derived from the configuration of the nodes that run tasks
+    """
+    coordinator = util.get_coordinator_role()[0]
+    scheduled = _scheduled_nodes(confs[COORDINATOR])
+    worker_conf = None
+    if [host for host in scheduled if host != coordinator]:
+        worker_conf = confs.get(WORKERS) or w.get_conf()
+    node_properties = [
+        (confs[COORDINATOR] if host == coordinator
+         else worker_conf)['config.properties'] for host in scheduled]
+    return coord.apply_cluster_defaults(confs[COORDINATOR],
+                                        coord.get_local_conf(),
+                                        node_properties, check)
+
+
+def render_sized(hosts, confs):
+    """
+    Render the configuration of each of the hosts with the settings sized
+    to its hardware. The cluster-wide limits of the coordinator are derived
+    from the sized settings of all of the nodes that run tasks, so their
+    hardware is gathered too when the coordinator is rendered.
+
+    Returns:
+        dict of host to RenderedConf
+    """
+    roles = dict((host, _role(host)) for host in hosts)
+    sized_hosts = [host for host in hosts if roles[host] in confs]
+    scheduled = []
+    if COORDINATOR in confs:
+        scheduled = _scheduled_nodes(confs[COORDINATOR])
+        if WORKERS not in confs:
+            confs = dict(confs)
+            confs[WORKERS] = w.get_conf()
+    local_confs = {}
+    if COORDINATOR in confs:
+        local_confs[COORDINATOR] = coord.get_local_conf()
+    local_confs[WORKERS] = w.get_local_conf()
+    nodes = sized_hosts + [host for host in scheduled
+                           if host not in sized_hosts]
+    facts = sizing.gather(nodes)
+    sizing_ratios = sizing.ratios()
+    sized_confs = {}
+    for host in nodes:
+        role = _role(host)
+        if host not in facts:
+            sized_confs[host] = confs[role]
+            continue
+        sized = sizing.size(facts[host], sizing_ratios)
+        if host in roles:
+            print(sizing.describe(host, facts[host], sized))
+        sized_confs[host] = sizing.apply_sizing(confs[role],
+                                                local_confs[role], sized)
+    if COORDINATOR in confs:
+        coordinator = util.get_coordinator_role()[0]
+        conf = coord.apply_cluster_defaults(
+            sized_confs.get(coordinator, confs[COORDINATOR]),
+            local_confs[COORDINATOR],
+            [sized_confs[host]['config.properties'] for host in scheduled])
+        properties = conf['config.properties']
+        print('Sizing %s for %d nodes running tasks: %s' %
+              (coordinator, len(scheduled),
+               ', '.join('%s=%s' % (key, properties[key])
+                         for key in sorted(coord.CLUSTER_PROPERTIES)
+                         if key in properties)))
+        sized_confs[coordinator] = conf
+    return dict((host, render_conf(sized_confs[host]))
+                for host in sized_hosts if host in facts or
+                _is_coordinator(host))
+
+
+def _scheduled_nodes(coordinator_conf):
     """
-    Deploy the coordinator configuration to the coordinator node
+    Returns:
+        the nodes that run tasks, including the coordinator if it schedules
+        work on itself
     """
-    if env.host in util.get_coordinator_role():
-        _LOGGER.info("Setting coordinator configuration for " + env.host)
-        configure_presto(coord.get_conf(), constants.REMOTE_CONF_DIR)
+    coordinator = util.get_coordinator_role()[0]
+    nodes = [host for host in util.get_worker_role() if host != coordinator]
+    if coordinator_conf['config.properties'].get(
+            'node-scheduler.include-coordinator') == 'true':
+        nodes.insert(0, coordinator)
+    return nodes
+
+
+def render_conf(conf):
+    return RenderedConf(
+        tuple(sorted((name, output_format(content)) for (name, content)
+                     in conf.iteritems() if name != NODE_PROPERTIES)),
+        output_format(conf[NODE_PROPERTIES]))
 
 
-def workers():
+def configure_host(rendered):
     """
-    Deploy workers configuration to the worker nodes.
-    This will not deploy configuration for a coordinator that is also a worker
+    Deploy the rendered configuration of the roles of the current host
+
+    Returns:
+        remote_digests.Summary of the files deployed, or None if the host
+        has none of the roles in rendered
     """
-    if env.host in util.get_worker_role() and env.host \
-            not in util.get_coordinator_role():
-        _LOGGER.info("Setting worker configuration for " + env.host)
-        configure_presto(w.get_conf(), constants.REMOTE_CONF_DIR)
+    conf = host_conf(rendered)
+    if conf is None:
+        return None
+    _LOGGER.info("Setting configuration for " + env.host)
+    return configure_rendered(conf, constants.REMOTE_CONF_DIR)
+
+
+def host_conf(rendered):
+    """
+    Returns:
+        the RenderedConf in rendered of the role of the current host, or
+        None if the host has none of the roles in rendered
+    """
+    if env.host in rendered.get(HOSTS, {}):
+        return rendered[HOSTS][env.host]
+    if COORDINATOR in rendered and _is_coordinator(env.host):
+        return rendered[COORDINATOR]
+    if WORKERS in rendered and _is_worker(env.host):
+        return rendered[WORKERS]
+    return None
+
 
+def _role(host):
+    if _is_coordinator(host):
+        return COORDINATOR
+    if _is_worker(host):
+        return WORKERS
+    return None
 
-def configure_presto(conf, remote_dir):
+
+def _is_coordinator(host):
+    return host in util.get_coordinator_role()
+
+
+def _is_worker(host):
+    return host in util.get_worker_role() and not _is_coordinator(host)
+
+
+def configure_rendered(rendered, remote_dir):
+    """
+    Bring the configuration in remote_dir up to date with rendered. The
+    digests of the files on the host are fetched first, and only the files
+    that differ are written, so that deploying an unchanged configuration
+    leaves the files and their modification times alone. Presto
+    configuration files on the host that are not part of the
+    configuration, like a log.properties maintained by hand, are reported
+    but never deleted.
+
+    Returns:
+        remote_digests.Summary of the names of the files
+    """
     print("Deploying configuration on: " + env.host)
-    deploy(dict((name, output_format(content)) for (name, content)
-                in conf.iteritems() if name != "node.properties"), remote_dir)
-    deploy_node_properties(output_format(conf['node.properties']), remote_dir)
+    batch = RemoteBatch()
+    probe = add_probe(batch, remote_dir)
+    summary, batch = plan_update(rendered, remote_dir, probe,
+                                 batch.run(use_sudo=True))
+    if batch is not None:
+        batch.run(use_sudo=True)
+    _log_summary(env.host, summary)
+    return summary
+
+
+def configure_hosts(rendered, hosts, on_result=None):
+    """
+    Deploy the rendered configuration of the roles of each of the hosts
+    like configure_rendered(), on all of the hosts at the same time: one
+    command, sent to every host at once, fetches the digests of the files,
+    and one more writes the files that differ.
+
+    Parameters:
+        rendered - the result of render()
+        hosts - the hosts to deploy to
+        on_result - optional callback, called with each host and its
+                    result
+
+    Returns:
+        dict of host to the remote_digests.Summary of the names of its
+        files, or to the exception that prevented the deployment. Hosts
+        with none of the roles in rendered are left out.
+    """
+    remote_dir = constants.REMOTE_CONF_DIR
+    confs = {}
+    for host in hosts:
+        with settings(host=host):
+            conf = host_conf(rendered)
+        if conf is not None:
+            print("Deploying configuration on: " + host)
+            confs[host] = conf
+
+    batches = dict((host, RemoteBatch()) for host in confs)
+    probes = dict((host, add_probe(batch, remote_dir))
+                  for host, batch in batches.iteritems())
+    summaries = {}
+    writes = {}
+    for host, results in run_batches(batches, use_sudo=True).iteritems():
+        error = _batch_error(batches[host], results)
+        if error is not None:
+            summaries[host] = error
+            continue
+        summaries[host], batch = plan_update(confs[host], remote_dir,
+                                             probes[host], results)
+        if batch is not None:
+            writes[host] = batch
+    for host, results in run_batches(writes, use_sudo=True).iteritems():
+        error = _batch_error(writes[host], results)
+        if error is not None:
+            summaries[host] = error
+
+    for host in hosts:
+        if host not in summaries:
+            continue
+        if isinstance(summaries[host], remote_digests.Summary):
+            _log_summary(host, summaries[host])
+        else:
+            with settings(host=host):
+                warn('Could not deploy the configuration: %s' %
+                     summaries[host])
+        if on_result is not None:
+            on_result(host, summaries[host])
+    return summaries
+
+
+def add_probe(batch, remote_dir):
+    """
+    Add the steps that fetch the digests of the files in remote_dir and
+    the node.id of the host to batch
+
+    Returns:
+        the indexes of the results of the steps, for plan_update()
+    """
+    node_file_path = os.path.join(remote_dir, NODE_PROPERTIES)
+    listing = remote_digests.add_listing(batch, [remote_dir])
+    node_id = batch.add("grep -s 'node.id' " + node_file_path,
+                        warn_only=True)
+    return listing, node_id
+
+
+def plan_update(rendered, remote_dir, probe, results):
+    """
+    Work out which files in remote_dir differ from rendered, given the
+    results of the steps added by add_probe()
+
+    Returns:
+        the remote_digests.Summary of the names of the files, and a
+        RemoteBatch that writes the files that differ, or None if they
+        are all up to date
+    """
+    listing, node_id = probe
+    digests = remote_digests.parse(results[listing])
+    node_id_lines = (results[node_id] or '').splitlines()
+
+    contents = dict((name, text + '\n') for name, text in rendered.files)
+    if node_id_lines:
+        contents[NODE_PROPERTIES] = node_properties_content(
+            node_id_lines, rendered.node_properties)
+    changed = [os.path.basename(path) for path in
+               remote_digests.changed_files(
+                   dict((os.path.join(remote_dir, name), content)
+                        for name, content in contents.iteritems()),
+                   digests)]
+    if not node_id_lines:
+        # A node.id is generated for the host, so the file changes anyway
+        changed = sorted(changed + [NODE_PROPERTIES])
+    unchanged = sorted(name for name in contents if name not in changed)
+    unmanaged = [name for name in PRESTO_FILES if name not in contents and
+                 os.path.join(remote_dir, name) in digests]
+
+    batch = None
+    if changed:
+        batch = RemoteBatch()
+        deploy(dict((name, text) for name, text in rendered.files
+                    if name in changed), remote_dir, batch)
+        if NODE_PROPERTIES in changed:
+            deploy_node_properties(rendered.node_properties, remote_dir,
+                                   batch)
+    return remote_digests.Summary(changed, unchanged, unmanaged), batch
+
+
+def _log_summary(host, summary):
+    _LOGGER.info('Configuration on %s: changed %s, unchanged %s, not in '
+                 'local configuration %s' % ((host,) + tuple(summary)))
+
+
+def _batch_error(batch, results):
+    """
+    Returns:
+        the exception that stopped the batch on a host, or None if the
+        batch ran to completion
+    """
+    if isinstance(results, Exception):
+        return results
+    for step, result in zip(batch.steps, results):
+        if result is not None and result.failed and not step.warn_only:
+            return Exception('%s returned %d: %s' % (
+                step.command.splitlines()[0], result.return_code, result))
+    return None
+
+
+def node_properties_content(node_id_lines, content):
+    """
+    The contents that deploy_node_properties() leaves in node.properties
+    on a host whose node.properties has node_id_lines
+    """
+    lines = list(node_id_lines)
+    for line in content.splitlines():
+        if line not in lines:
+            lines.append(line)
+    return ''.join(line + '\n' for line in lines)
 
 
 def output_format(conf):
@@ -87,16 +423,29 @@ def list_to_line_separated(conf):
     return "\n".join(conf)
 
 
-def deploy(confs, remote_dir):
+def deploy(confs, remote_dir, batch=None):
+    """
+    Write the configuration files in confs to remote_dir. The commands are
+    added to batch if one is given, otherwise they are run right away.
+    """
     _LOGGER.info("Deploying configurations for " + str(confs.keys()))
-    sudo("mkdir -p " + remote_dir)
+    run_now = batch is None
+    if run_now:
+        batch = RemoteBatch()
+    batch.add("mkdir -p " + remote_dir)
     for name, content in confs.iteritems():
-        write_to_remote_file(content, os.path.join(remote_dir, name))
+        write_to_remote_file(content, os.path.join(remote_dir, name), batch)
+    if run_now:
+        batch.run(use_sudo=True)
 
 
-def deploy_node_properties(content, remote_dir):
+def deploy_node_properties(content, remote_dir, batch=None):
+    """
+    Write node.properties to remote_dir, keeping the node.id of the host if
+    it already has one and generating one otherwise.
+    """
     _LOGGER.info("Deploying node.properties configuration")
-    name = "node.properties"
+    name = NODE_PROPERTIES
     node_file_path = (os.path.join(remote_dir, name))
     node_id_command = (
         "if ! ( grep -q -s 'node.id' " + node_file_path + " ); then "
@@ -105,15 +454,14 @@ def deploy_node_properties(content, remote_dir):
         "fi; "
         "sed -i '/node.id/!d' " + node_file_path + "; "
         )
-    sudo(node_id_command)
-    files.append(os.path.join(remote_dir, name), content, True)
-
-
-def write_to_remote_file(text, filename):
-    sudo("echo '%s' > %s" % (escape_single_quotes(text), filename))
+    run_now = batch is None
+    if run_now:
+        batch = RemoteBatch()
+    batch.add(node_id_command)
+    batch.append_lines(node_file_path, content)
+    if run_now:
+        batch.run(use_sudo=True)
 
 
-def escape_single_quotes(text):
-    # replace a single quote with a (closing) single quote followed by
-    # an escaped quote followed by an (opening) single quote
-    return text.replace(r"'", r"'\''")
+def write_to_remote_file(text, filename, batch):
+    batch.write_file(filename, text + '\n')
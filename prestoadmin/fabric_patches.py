@@ -14,14 +14,16 @@
 #
 
 """Monkey patches needed to change logging and error handling in Fabric"""
+import glob
 import traceback
 import sys
 import logging
+import os
 from traceback import format_exc
 
 from fabric import state
 from fabric.context_managers import settings
-from fabric.exceptions import NetworkError
+from fabric.exceptions import CommandTimeout, NetworkError
 from fabric.job_queue import JobQueue
 from fabric.tasks import _is_task, WrappedCallableTask, requires_parallel
 from fabric.task_utils import crawl, parse_kwargs
@@ -31,7 +33,11 @@ import fabric.operations
 import fabric.tasks
 from fabric.network import needs_host, to_dict, disconnect_all
 
-from prestoadmin.util import exception
+from prestoadmin.util import connection_pool, exception, threadpool, \
+    tracing
+from prestoadmin.util.exception import TaskTimeoutError
+from prestoadmin.util.job_queue import AdaptiveJobQueue, \
+    StreamingJobQueue, CONTINUE_ON_TIMEOUT
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -39,6 +45,12 @@ old_warn = fabric.utils.warn
 old_abort = fabric.utils.abort
 old_run = fabric.operations.run
 old_sudo = fabric.operations.sudo
+old_put = fabric.operations.put
+old_get = fabric.operations.get
+
+# Keep SSH connections open for the whole presto-admin invocation so that
+# consecutive tasks and execute() calls reuse them.
+connection_pool.install()
 
 
 # Need to monkey patch Fabric's warn method in order to print out
@@ -63,15 +75,17 @@ fabric.api.abort = abort
 
 
 # Monkey patch run and sudo so that the stdout and stderr
-# also go to the logs.
+# also go to the logs, and so that they are timed in the trace.
 @needs_host
 def run(command, shell=True, pty=True, combine_stderr=None, quiet=False,
         warn_only=False, stdout=None, stderr=None, timeout=None,
         shell_escape=None):
-    out = old_run(command, shell=shell, pty=pty,
-                  combine_stderr=combine_stderr, quiet=quiet,
-                  warn_only=warn_only, stdout=stdout, stderr=stderr,
-                  timeout=timeout, shell_escape=shell_escape)
+    with tracing.span(tracing.COMMAND, command=command) as span:
+        out = old_run(command, shell=shell, pty=pty,
+                      combine_stderr=combine_stderr, quiet=quiet,
+                      warn_only=warn_only, stdout=stdout, stderr=stderr,
+                      timeout=timeout, shell_escape=shell_escape)
+        record_output(span, out)
     log_output(out)
     return out
 
@@ -84,10 +98,13 @@ fabric.api.run = run
 def sudo(command, shell=True, pty=True, combine_stderr=None, user=None,
          quiet=False, warn_only=False, stdout=None, stderr=None, group=None,
          timeout=None, shell_escape=None):
-    out = old_sudo(command, shell=shell, pty=pty,
-                   combine_stderr=combine_stderr, user=user, quiet=quiet,
-                   warn_only=warn_only, stdout=stdout, stderr=stderr,
-                   group=group, timeout=timeout, shell_escape=shell_escape)
+    with tracing.span(tracing.COMMAND, command=command) as span:
+        out = old_sudo(command, shell=shell, pty=pty,
+                       combine_stderr=combine_stderr, user=user, quiet=quiet,
+                       warn_only=warn_only, stdout=stdout, stderr=stderr,
+                       group=group, timeout=timeout,
+                       shell_escape=shell_escape)
+        record_output(span, out)
     log_output(out)
     return out
 
@@ -96,6 +113,66 @@ fabric.operations.sudo = sudo
 fabric.api.sudo = sudo
 
 
+# Monkey patch put and get so that file transfers are timed in the trace.
+@needs_host
+def put(local_path=None, remote_path=None, use_sudo=False,
+        mirror_local_mode=False, mode=None, use_glob=True, temp_dir=""):
+    with tracing.span(tracing.TRANSFER,
+                      command='put %s %s' % (local_path, remote_path)) as span:
+        out = old_put(local_path, remote_path, use_sudo=use_sudo,
+                      mirror_local_mode=mirror_local_mode, mode=mode,
+                      use_glob=use_glob, temp_dir=temp_dir)
+        span['exit_code'] = 0 if out.succeeded else 1
+        if tracing.enabled() and isinstance(local_path, basestring):
+            span['bytes'] = _local_size(local_path, use_glob)
+    return out
+
+
+fabric.operations.put = put
+fabric.api.put = put
+
+
+@needs_host
+def get(remote_path, local_path=None, use_sudo=False, temp_dir=""):
+    with tracing.span(tracing.TRANSFER,
+                      command='get %s %s' % (remote_path, local_path)) as span:
+        out = old_get(remote_path, local_path, use_sudo=use_sudo,
+                      temp_dir=temp_dir)
+        span['exit_code'] = 0 if out.succeeded else 1
+        if tracing.enabled():
+            span['bytes'] = sum(_local_size(path, False) for path in out
+                                if isinstance(path, basestring))
+    return out
+
+
+fabric.operations.get = get
+fabric.api.get = get
+
+
+def _local_size(local_path, use_glob):
+    """
+    Total size in bytes of the local files matched by local_path
+    """
+    local_path = os.path.expanduser(local_path)
+    paths = glob.glob(local_path) if use_glob else [local_path]
+    size = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, files in os.walk(path):
+                size += sum(os.path.getsize(os.path.join(directory, name))
+                            for name in files)
+        elif os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+
+def record_output(span, out):
+    if not tracing.enabled():
+        return
+    span['exit_code'] = getattr(out, 'return_code', None)
+    span['bytes'] = len(out) + len(getattr(out, 'stderr', ''))
+
+
 def log_output(out):
     _LOGGER.info('\nCOMMAND: ' + out.command + '\nFULL COMMAND: ' +
                  out.real_command + '\nSTDOUT: ' + out + '\nSTDERR: '
@@ -124,7 +201,8 @@ def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
         # * expands the env it's given to ensure parallel, linewise, etc are
         # all set correctly and explicitly. Such changes are naturally
         # insulted from the parent process.
-        # * nukes the connection cache to prevent shared-access problems
+        # * leaves the connection pool alone: connections inherited from the
+        # parent are discarded by the pool itself on first use
         # * knows how to send the tasks' return value back over a Queue
         # * captures exceptions raised by the task
         def inner(args, kwargs, queue, name, env):
@@ -134,8 +212,7 @@ def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
                 queue.put({'name': name, 'result': result})
 
             try:
-                state.connections.clear()
-                submit(task.run(*args, **kwargs))
+                submit(_run_task(task, args, kwargs))
             except BaseException, e:
                 _LOGGER.error(traceback.format_exc())
                 submit(e)
@@ -157,13 +234,37 @@ def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
     # Handle serial execution
     else:
         with settings(**local_env):
-            return task.run(*args, **kwargs)
+            return _run_task(task, args, kwargs)
+
+
+def _run_task(task, args, kwargs):
+    """
+    Run the task on the current host, timing it in the trace
+    """
+    with tracing.span(tracing.TASK, exit_code=1) as span, \
+            connection_pool.task():
+        result = task.run(*args, **kwargs)
+        span['exit_code'] = 0
+    return result
 
 
 def execute(task, *args, **kwargs):
     """
     Patched version of fabric's execute task with alternative error handling
+
+    Besides the hosts, roles and exclude_hosts keyword arguments understood
+    by fabric, an on_result callback may be passed. It is called with the
+    host and the value returned by the task (or the exception raised by it)
+    as soon as the task finishes on that host, so that callers can report
+    progress without waiting for the slowest host.
+
+    When running in parallel, a host that is still running the task
+    env.task_timeout seconds after it started is stopped. Hosts that time
+    out, or on which a command exceeds env.command_timeout, fail the whole
+    task unless env.timeout_policy is 'continue', in which case a warning is
+    printed and the results of the other hosts are returned.
     """
+    on_result = kwargs.pop('on_result', None)
     my_env = {'clean_revert': True}
     results = {}
     # Obtain task
@@ -196,7 +297,11 @@ def execute(task, *args, **kwargs):
                                                                 state.env)
 
     parallel = requires_parallel(task)
-    if parallel:
+    if parallel and threadpool.is_thread_engine():
+        # Run the per-host task bodies in threads. The threadpool module
+        # provides the Process and Queue classes used below.
+        multiprocessing = threadpool
+    elif parallel:
         # Import multiprocessing if needed, erroring out usefully
         # if it can't.
         try:
@@ -213,15 +318,29 @@ def execute(task, *args, **kwargs):
     else:
         multiprocessing = None
 
-    # Get pool size for this task
-    pool_size = task.get_pool_size(my_env['all_hosts'], state.env.pool_size)
+    # Get pool size for this task. Unless the pool size was set explicitly,
+    # it is only an upper bound and the number of hosts running at the same
+    # time is adjusted as the task runs.
+    fixed_pool_size = state.env.pool_size or getattr(task, 'pool_size', None)
+    max_pool_size = state.env.get('max_parallel_hosts')
+    if parallel and threadpool.is_thread_engine():
+        max_pool_size = max_pool_size or threadpool.DEFAULT_POOL_SIZE
+    pool_size = task.get_pool_size(my_env['all_hosts'],
+                                   state.env.pool_size or max_pool_size)
     # Set up job queue in case parallel is needed
     queue = multiprocessing.Queue() if parallel else None
-    jobs = JobQueue(pool_size, queue)
+    timeout = state.env.get('task_timeout')
+    if parallel and not fixed_pool_size:
+        jobs = AdaptiveJobQueue(pool_size, queue, on_result, timeout=timeout)
+    elif parallel:
+        jobs = StreamingJobQueue(pool_size, queue, on_result, timeout)
+    else:
+        jobs = JobQueue(pool_size, queue)
     if state.output.debug:
         jobs._debug = True
 
     # Call on host list
+    timed_out = []
     if my_env['all_hosts']:
         # Attempt to cycle on hosts, skipping if needed
         for host in my_env['all_hosts']:
@@ -230,8 +349,17 @@ def execute(task, *args, **kwargs):
                     task, host, my_env, args, new_kwargs, jobs, queue,
                     multiprocessing
                 )
+                if not parallel and on_result is not None:
+                    on_result(host, results[host])
+            except CommandTimeout, e:
+                results[host] = e
+                timed_out.append(host)
+                if on_result is not None:
+                    on_result(host, e)
             except NetworkError, e:
                 results[host] = e
+                if on_result is not None:
+                    on_result(host, e)
                 # Backwards compat test re: whether to use an exception or
                 # abort
                 func = warn if state.env.skip_bad_hosts or state.env.warn_only \
@@ -250,10 +378,17 @@ def execute(task, *args, **kwargs):
             # Abort if any children did not exit cleanly (fail-fast).
             # This prevents Fabric from continuing on to any other tasks.
             # Otherwise, pull in results from the child run.
-            ran_jobs = jobs.run()
+            if multiprocessing is threadpool:
+                # Each worker thread gets its own env and output
+                with threadpool.thread_local_state():
+                    ran_jobs = jobs.run()
+            else:
+                ran_jobs = jobs.run()
             for name, d in ran_jobs.iteritems():
                 if d['exit_code'] != 0:
-                    if isinstance(d['results'], NetworkError):
+                    if _is_timeout(d['results']):
+                        timed_out.append(name)
+                    elif isinstance(d['results'], NetworkError):
                         func = warn if state.env.skip_bad_hosts \
                             or state.env.warn_only else abort
                         error(d['results'].message,
@@ -269,6 +404,9 @@ def execute(task, *args, **kwargs):
                         error('One or more hosts failed while executing task.')
                 results[name] = d['results']
 
+        if timed_out:
+            _handle_timeouts(my_env['command'], timed_out)
+
     # Or just run once for local-only
     else:
         with settings(**my_env):
@@ -278,5 +416,18 @@ def execute(task, *args, **kwargs):
     return results
 
 
+def _is_timeout(result):
+    return isinstance(result, (TaskTimeoutError, CommandTimeout))
+
+
+def _handle_timeouts(command, hosts):
+    message = 'Timed out running %s on %s' % (command,
+                                              ', '.join(sorted(hosts)))
+    if state.env.get('timeout_policy') == CONTINUE_ON_TIMEOUT:
+        warn(message)
+    else:
+        error(message)
+
+
 fabric.tasks._execute = _execute
 fabric.tasks.execute = execute
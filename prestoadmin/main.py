@@ -68,7 +68,10 @@ from prestoadmin import __version__
 from prestoadmin.util.application import entry_point
 from prestoadmin.util.fabric_application import FabricApplication
 from prestoadmin.util.hiddenoptgroup import HiddenOptionGroup
+from prestoadmin.util.job_queue import FAIL_ON_TIMEOUT, TIMEOUT_POLICIES
 from prestoadmin.util.parser import LoggingOptionParser
+from prestoadmin.util.threadpool import ENGINES, PROCESS_ENGINE
+from prestoadmin.util import tracing
 
 # One-time calculation of "all internal callables" to avoid doing this on every
 # check of a given fabfile callable (in is_classic_task()).
@@ -344,6 +347,65 @@ def parser_for_options():
         help="default to serial execution method"
     )
 
+    advanced_options.add_option(
+        '--engine',
+        type='choice',
+        choices=ENGINES,
+        dest='engine',
+        default=PROCESS_ENGINE,
+        metavar='ENGINE',
+        help="run parallel tasks in separate processes or threads "
+             "(processes|threads)"
+    )
+
+    advanced_options.add_option(
+        '--task-timeout',
+        type='int',
+        dest='task_timeout',
+        default=None,
+        metavar='N',
+        help="stop running a task on a host after N seconds"
+    )
+
+    advanced_options.add_option(
+        '--timeout-policy',
+        type='choice',
+        choices=TIMEOUT_POLICIES,
+        dest='timeout_policy',
+        default=FAIL_ON_TIMEOUT,
+        metavar='POLICY',
+        help="when a host times out, fail the command or continue with the "
+             "other hosts (fail|continue)"
+    )
+
+    advanced_options.add_option(
+        '--relay-fanout',
+        type='int',
+        dest='relay_fanout',
+        default=None,
+        metavar='K',
+        help="copy files to K hosts first, which each pass them on to K "
+             "more hosts"
+    )
+
+    advanced_options.add_option(
+        '--trace',
+        dest='trace_file',
+        default=None,
+        metavar='FILE',
+        help="write a timing trace of every task and remote operation to "
+             "FILE"
+    )
+
+    advanced_options.add_option(
+        '--pull',
+        action='store_true',
+        dest='pull',
+        default=False,
+        help="have the hosts download packages and jars from this node over "
+             "HTTP instead of uploading them"
+    )
+
     # Allow setting of arbitrary env vars at runtime.
     advanced_options.add_option(
         '--set',
@@ -787,6 +849,9 @@ def main(args=sys.argv[1:]):
     names = ", ".join(x[0] for x in commands_to_run)
     _LOGGER.debug("Commands to run: %s" % names)
 
+    if state.env.trace_file:
+        tracing.start(state.env.trace_file)
+
     # At this point all commands must exist, so execute them in order.
     run_tasks(commands_to_run)
 
@@ -19,19 +19,30 @@ import logging
 
 from fabric.context_managers import settings, hide
 from fabric.decorators import task, runs_once
-from fabric.operations import sudo, put, os, local
+from fabric.operations import sudo, os, local
 from fabric.state import env
 from fabric.tasks import execute
 from fabric.utils import abort
 
 from prestoadmin import topology
-from prestoadmin.util import constants
+from prestoadmin.util import constants, pull, relay
 from prestoadmin.util.fabricapi import get_host_list
+from prestoadmin.util.fanout import run_on_hosts
+from prestoadmin.util.filesystem import sha256
+from prestoadmin.util.remote_batch import RemoteBatch
+from prestoadmin.util.transfer import put_resumable
 
 
 _LOGGER = logging.getLogger(__name__)
 __all__ = ['install']
 
+# Number of packages kept in the package cache on each host, unless
+# overridden with --set package_cache_size=N. The least recently deployed
+# packages are removed first.
+PACKAGE_CACHE_SIZE = 3
+
+_preflights = {}
+
 
 @task
 @runs_once
@@ -46,8 +57,62 @@ def install(local_path):
             to adding --nodeps flag to rpm -i.
     """
     topology.set_topology_if_missing()
-    execute(deploy_install, local_path,
-            hosts=get_host_list())
+    rpm_info = preflight(local_path)
+    hosts = get_host_list()
+    distribute(local_path, hosts)
+    with pull.serving(local_path):
+        execute(deploy_install, local_path, rpm_info, hosts=hosts)
+
+
+class RpmInfo(object):
+    """
+    What presto-admin needs to know about a local rpm before deploying it
+    """
+
+    def __init__(self, digest, name, version):
+        self.digest = digest
+        self.name = name
+        self.version = version
+
+
+def preflight(local_path):
+    """
+    Check that the rpm at local_path is not corrupted, and read the name
+    and version of the package in it. The result is remembered for as long
+    as the file keeps the same size and modification time, so that the
+    checks run once per run in the parent process; per-host tasks should be
+    handed the result rather than calling this themselves.
+
+    Returns:
+        RpmInfo of the rpm
+    """
+    try:
+        stat = os.stat(local_path)
+        key = (os.path.abspath(local_path), stat.st_size, stat.st_mtime)
+    except OSError:
+        # Let rpm report the error
+        key = None
+    if key not in _preflights:
+        # The checks are local, so don't blame any particular host for them
+        with settings(host=None):
+            check_if_valid_rpm(local_path)
+            name, version = query_rpm(local_path)
+        _preflights[key] = RpmInfo(sha256(local_path), name, version)
+    return _preflights[key]
+
+
+def query_rpm(local_path):
+    """
+    Returns:
+        the name and the version of the package in the rpm at local_path
+    """
+    with settings(hide('warnings', 'stdout'), warn_only=True):
+        result = local('rpm -qp --queryformat \'%{NAME}\t%{VERSION}\' ' +
+                       local_path, capture=True)
+    if result.failed:
+        abort(result.stderr)
+    name, version = result.stdout.strip().split('\t')
+    return name, version
 
 
 def check_if_valid_rpm(local_path):
@@ -60,33 +125,132 @@ def check_if_valid_rpm(local_path):
         abort(result.stderr)
 
 
-def deploy_install(local_path):
-    deploy_action(local_path, rpm_install)
+def deploy_install(local_path, rpm_info=None):
+    deploy_action(local_path, rpm_info)
+    rpm_install(os.path.basename(local_path))
 
 
-def deploy_upgrade(local_path):
-    deploy_action(local_path, rpm_upgrade)
+def deploy_upgrade(local_path, rpm_info=None):
+    rpm_info = deploy_action(local_path, rpm_info)
+    rpm_upgrade(os.path.basename(local_path), rpm_info.name)
 
 
-def deploy_action(local_path, rpm_action):
-    check_if_valid_rpm(local_path)
+def deploy_action(local_path, rpm_info=None):
+    """
+    Deploy the rpm on the current host. rpm_info is the result of
+    preflight(), which is run here if it is not given.
+
+    Returns:
+        the RpmInfo of the rpm
+    """
+    if rpm_info is None:
+        rpm_info = preflight(local_path)
     deploy(local_path)
-    rpm_action(os.path.basename(local_path))
+    return rpm_info
+
+
+def distribute(local_path, hosts):
+    """
+    Prepare to deploy the rpm on the hosts. The digest of the rpm is
+    computed once here rather than on every host. If relay mode is on, the
+    rpm is copied through relay hosts to the hosts that don't already have
+    it in their package cache, and those hosts skip the upload in deploy().
+    """
+    digest = sha256(local_path)
+    if not relay.enabled(hosts):
+        return
+    remote_path = _remote_path(local_path)
+    results = run_on_hosts(_cache_probe(digest, remote_path), hosts,
+                           use_sudo=True)
+    missing = [host for host in hosts
+               if getattr(results[host], 'failed', True)]
+    relay.distribute(local_path, constants.REMOTE_PACKAGES_PATH, missing)
 
 
 def deploy(local_path=None):
+    """
+    Put the rpm in REMOTE_PACKAGES_PATH on the current host. Packages are
+    kept in a cache on the host, named by their SHA-256 digest, and the rpm
+    is only uploaded if the host doesn't already have a package with the
+    same digest. In pull mode the host downloads the rpm from this node,
+    otherwise it is uploaded, and an interrupted upload is resumed from the
+    last verified chunk.
+    """
     _LOGGER.info("Deploying rpm on %s..." % env.host)
     print("Deploying rpm on %s..." % env.host)
-    sudo('mkdir -p ' + constants.REMOTE_PACKAGES_PATH)
-    ret_list = put(local_path, constants.REMOTE_PACKAGES_PATH, use_sudo=True)
-    if not ret_list.succeeded:
+    digest = sha256(local_path)
+    remote_path = _remote_path(local_path)
+    if relay.is_staged(local_path, constants.REMOTE_PACKAGES_PATH):
+        add_to_cache(remote_path, digest)
+        print("Package deployed successfully on: " + env.host)
+        return
+    if link_from_cache(remote_path, digest):
+        _LOGGER.info("Package with digest %s already on %s; skipping upload"
+                     % (digest, env.host))
+        print("Package deployed successfully on: " + env.host)
+        return
+    succeeded = pull.is_served(local_path) and \
+        pull.fetch(local_path, remote_path, use_sudo=True)
+    if not succeeded:
+        succeeded = put_resumable(local_path, remote_path, use_sudo=True)
+    if not succeeded:
         _LOGGER.warn("Failure during put. Now using /tmp as temp dir...")
-        ret_list = put(local_path, constants.REMOTE_PACKAGES_PATH,
-                       use_sudo=True, temp_dir='/tmp')
-    if ret_list.succeeded:
+        succeeded = put_resumable(local_path, remote_path, use_sudo=True,
+                                  temp_dir='/tmp')
+    if succeeded:
+        add_to_cache(remote_path, digest)
         print("Package deployed successfully on: " + env.host)
 
 
+def _remote_path(local_path):
+    return os.path.join(constants.REMOTE_PACKAGES_PATH,
+                        os.path.basename(local_path))
+
+
+def _cache_probe(digest, remote_path):
+    cached = os.path.join(constants.REMOTE_PACKAGE_CACHE_DIR, digest)
+    return 'mkdir -p %(cache)s && test -f %(cached)s && ' \
+           'ln -f %(cached)s %(path)s && touch %(cached)s' % \
+           {'cache': constants.REMOTE_PACKAGE_CACHE_DIR, 'cached': cached,
+            'path': remote_path}
+
+
+def link_from_cache(remote_path, digest):
+    """
+    Check in one round trip whether the package with the given digest is in
+    the cache on the current host, and if it is, put it at remote_path.
+
+    Returns:
+        True if the package was found in the cache
+    """
+    return sudo(_cache_probe(digest, remote_path), quiet=True).succeeded
+
+
+def add_to_cache(remote_path, digest):
+    """
+    Add the package at remote_path to the cache on the current host, once
+    its digest has been checked, and evict the least recently deployed
+    packages from the cache.
+    """
+    cached = os.path.join(constants.REMOTE_PACKAGE_CACHE_DIR, digest)
+    keep = int(env.get('package_cache_size') or PACKAGE_CACHE_SIZE)
+    batch = RemoteBatch()
+    verify = batch.add('sha256sum %s | grep -q ^%s && ln -f %s %s && '
+                       'touch %s' % (remote_path, digest, remote_path,
+                                     cached, cached),
+                       warn_only=True)
+    batch.add('cd %s && ls -t | tail -n +%d | while read digest; do '
+              'find %s -maxdepth 1 -samefile "$digest" -delete; '
+              'rm -f "$digest"; done' %
+              (constants.REMOTE_PACKAGE_CACHE_DIR, keep + 1,
+               constants.REMOTE_PACKAGES_PATH),
+              warn_only=True)
+    results = batch.run(use_sudo=True)
+    if results[verify].failed:
+        abort('Package %s on %s does not match the local package' %
+              (remote_path, env.host))
+
+
 def rpm_install(rpm_name):
     _LOGGER.info("Installing the rpm")
     nodeps = ''
@@ -100,15 +264,16 @@ def rpm_install(rpm_name):
         print("Package installed successfully on: " + env.host)
 
 
-def rpm_upgrade(rpm_name):
+def rpm_upgrade(rpm_name, package_name=None):
     _LOGGER.info("Upgrading the rpm")
     nodeps = ''
     if env.nodeps:
         nodeps = '--nodeps '
 
     package_path = os.path.join(constants.REMOTE_PACKAGES_PATH, rpm_name)
-    package_name = sudo('rpm -qp --queryformat \'%%{NAME}\' %s'
-                        % package_path, quiet=True)
+    if package_name is None:
+        package_name = sudo('rpm -qp --queryformat \'%%{NAME}\' %s'
+                            % package_path, quiet=True)
 
     ret_uninstall = sudo('rpm -e %s%s' % (nodeps, package_name))
     ret_install = sudo('rpm -i %s%s' % (nodeps, package_path))
@@ -16,23 +16,40 @@
 module for tasks relating to presto plugins
 """
 import logging
-from fabric.decorators import task
-from fabric.operations import sudo, put
+from fabric.decorators import task, runs_once
 import os
-from fabric.api import env
+from fabric.api import env, abort
+from fabric.tasks import execute
 from prestoadmin.topology import requires_topology
+from prestoadmin.util import pull, relay
 from prestoadmin.util.constants import REMOTE_PLUGIN_DIR
+from prestoadmin.util.fabricapi import get_host_list
+from prestoadmin.util.filesystem import sha256
+from prestoadmin.util.transfer import put_resumable
 
 __all__ = ['add_jar']
 _LOGGER = logging.getLogger(__name__)
 
 
 def write(local_path, remote_dir):
-    sudo("mkdir -p " + remote_dir)
-    put(local_path, remote_dir, use_sudo=True)
+    if relay.is_staged(local_path, remote_dir):
+        return
+    remote_path = os.path.join(remote_dir, os.path.basename(local_path))
+    succeeded = pull.is_served(local_path) and \
+        pull.fetch(local_path, remote_path, use_sudo=True)
+    if not succeeded and \
+            not put_resumable(local_path, remote_path, use_sudo=True):
+        abort('Failed to send %s to %s on host %s' %
+              (local_path, remote_dir, env.host))
+
+
+def deploy_jar(local_path, remote_dir):
+    _LOGGER.info('deploying jars on %s' % env.host)
+    write(local_path, remote_dir)
 
 
 @task
+@runs_once
 @requires_topology
 def add_jar(local_path, plugin_name, plugin_dir=REMOTE_PLUGIN_DIR):
     """
@@ -44,5 +61,10 @@ def add_jar(local_path, plugin_name, plugin_dir=REMOTE_PLUGIN_DIR):
         plugin_dir - (Optional) The plugin directory.  If no directory is
                      given, '/usr/lib/presto/lib/plugin' is used by default.
     """
-    _LOGGER.info('deploying jars on %s' % env.host)
-    write(local_path, os.path.join(plugin_dir, plugin_name))
+    remote_dir = os.path.join(plugin_dir, plugin_name)
+    hosts = get_host_list()
+    # Hash the jar here, once, rather than in every forked task
+    sha256(local_path)
+    relay.distribute(local_path, remote_dir, hosts)
+    with pull.serving(local_path):
+        execute(deploy_jar, local_path, remote_dir, hosts=hosts)
@@ -29,11 +29,45 @@ from prestoadmin.util.exception import InvalidArgumentError
 
 _LOGGER = logging.getLogger(__name__)
 URL_TIMEOUT_MS = 5000
+INFO_TIMEOUT = 2
 NUM_ROWS = 1000
 DATA_RESP = "data"
 NEXT_URI_RESP = "nextUri"
 
 
+def get_server_info(server, port, timeout=INFO_TIMEOUT):
+    """
+    Fetch /v1/info from a Presto server. Every node answers it as soon as
+    its HTTP server is up, without running a query.
+
+    Returns:
+        the info as a dict, or None if the server did not answer
+    """
+    conn = HTTPConnection(server, port, False, timeout)
+    try:
+        conn.request('GET', '/v1/info')
+        response = conn.getresponse()
+        if response.status != 200:
+            _LOGGER.debug('Server info from %s:%s: %d %s' %
+                          (server, port, response.status, response.reason))
+            return None
+        return json.loads(response.read())
+    except (HTTPException, socket.error, ValueError) as e:
+        _LOGGER.debug('Server info from %s:%s: %s' % (server, port, e))
+        return None
+    finally:
+        conn.close()
+
+
+def is_started(info):
+    """
+    Returns:
+        True if the server info returned by get_server_info() is from a
+        server that has finished starting up
+    """
+    return info is not None and not info.get('starting', False)
+
+
 class PrestoClient:
     response_from_server = {}
     # rows returned by the query
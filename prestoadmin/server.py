@@ -18,46 +18,79 @@ using presto-admin
 """
 import logging
 import re
+import sys
+import time
+import urlparse
+from collections import namedtuple
 
 from fabric.api import task, sudo, env, quiet
 from fabric.context_managers import settings, hide
-from fabric.decorators import runs_once, with_settings, parallel
+from fabric.decorators import runs_once, with_settings
 from fabric.operations import run, os
 from fabric.tasks import execute
-from fabric.utils import warn
+from fabric.utils import abort, warn
 
 from prestoadmin import configure_cmds
 from prestoadmin import connector
+from prestoadmin import deploy
 from prestoadmin import package
 from prestoadmin import topology
 from prestoadmin.util.constants import REMOTE_PRESTO_LOG_DIR
-from prestoadmin.prestoclient import PrestoClient
+from prestoadmin.prestoclient import PrestoClient, get_server_info, \
+    is_started
 from prestoadmin.topology import requires_topology
 from prestoadmin.util import constants
-from prestoadmin.util.exception import ConfigFileNotFoundError
+from prestoadmin.util import fanout
+from prestoadmin.util import pull
+from prestoadmin.util.exception import ConfigFileNotFoundError, \
+    ConfigurationError
 from prestoadmin.util.fabricapi import get_host_list, get_coordinator_role
-from prestoadmin.util.service_util import lookup_port
+from prestoadmin.util.remote_batch import RemoteBatch
+from prestoadmin.util.service_util import parse_port
 
 from tempfile import mkdtemp
 import util.filesystem
 
 __all__ = ['install', 'uninstall', 'upgrade', 'start', 'stop', 'restart',
-           'status']
+           'rolling_restart', 'status']
 
 INIT_SCRIPTS = '/etc/init.d/presto'
 RETRY_TIMEOUT = 120
-SLEEP_INTERVAL = 10
-SYSTEM_RUNTIME_NODES = 'select * from system.runtime.nodes'
-NODE_INFO_PER_URI_SQL = 'select http_uri, node_version, active from ' \
-                        'system.runtime.nodes where ' \
-                        'url_extract_host(http_uri) = \'%s\''
-EXTERNAL_IP_SQL = 'select url_extract_host(http_uri) from system.runtime.nodes' \
-                  ' WHERE node_id = \'%s\''
+# Seconds between the probes of a starting server, doubling from the first
+# interval up to the longest
+PROBE_FIRST_INTERVAL = 0.25
+PROBE_MAX_INTERVAL = 4
+NODES_SQL = 'select node_id, http_uri, node_version, active from ' \
+            'system.runtime.nodes'
 CONNECTOR_INFO_SQL = 'select catalog_name from system.metadata.catalogs'
+NODE_STATE_SQL = 'select node_id, active from system.runtime.nodes'
+NODE_FACTS_SCRIPT = (
+    "if version=$(rpm -q --qf '%%{VERSION}' presto 2>/dev/null) || "
+    "version=$(rpm -q --qf '%%{VERSION}' presto-server-rpm 2>/dev/null); "
+    "then echo installed=true; echo version=$version; "
+    "else echo installed=false; fi; "
+    "echo node_id=$(sed -n s/^node.id=//p %(node_properties)s 2>/dev/null); "
+    "%(init_script)s status >/dev/null 2>&1; echo status=$?"
+    % {'node_properties': os.path.join(constants.REMOTE_CONF_DIR,
+                                       'node.properties'),
+       'init_script': INIT_SCRIPTS})
+SERVER_NODE_SCRIPT = (
+    "echo node_id=$(sed -n s/^node.id=//p %(node_properties)s 2>/dev/null); "
+    "echo port=$(sed -n s/^http-server.http.port=//p %(config_properties)s "
+    "2>/dev/null)"
+    % {'node_properties': os.path.join(constants.REMOTE_CONF_DIR,
+                                       'node.properties'),
+       'config_properties': os.path.join(constants.REMOTE_CONF_DIR,
+                                         'config.properties')})
+# How many workers a rolling restart takes down at a time by default
+ROLLING_MAX_DOWN = '25%'
 PRESTO_RPM_MIN_REQUIRED_VERSION = 103
 PRESTO_TD_RPM = ['101t']
 _LOGGER = logging.getLogger(__name__)
 
+# The node id and the HTTP port of the Presto server on a host
+ServerNode = namedtuple('ServerNode', ['host', 'node_id', 'port'])
+
 
 @task
 @runs_once
@@ -83,12 +116,18 @@ def install(local_path):
     """
 
     topology.set_topology_if_missing()
-    execute(deploy_install_configure, local_path, hosts=get_host_list())
+    rpm_info = package.preflight(local_path)
+    hosts = get_host_list()
+    rendered = deploy.render(hosts)
+    package.distribute(local_path, hosts)
+    with pull.serving(local_path):
+        execute(deploy_install_configure, local_path, rpm_info, rendered,
+                hosts=hosts)
 
 
-def deploy_install_configure(local_path):
-    package.deploy_install(local_path)
-    update_configs()
+def deploy_install_configure(local_path, rpm_info=None, rendered=None):
+    package.deploy_install(local_path, rpm_info)
+    update_configs(rendered)
 
 
 def add_tpch_connector():
@@ -98,8 +137,10 @@ def add_tpch_connector():
                                                 tpch_connector_config)
 
 
-def update_configs():
-    configure_cmds.deploy()
+def update_configs(rendered=None):
+    if rendered is None:
+        rendered = deploy.render([env.host])
+    deploy.configure_host(rendered)
 
     add_tpch_connector()
     try:
@@ -129,6 +170,7 @@ def uninstall():
 
 
 @task
+@runs_once
 @requires_topology
 def upgrade(local_package_path, local_config_dir=None):
     """
@@ -153,6 +195,15 @@ def upgrade(local_package_path, local_config_dir=None):
                                 configuration in. If not specified, a temp
                                 directory is used.
     """
+    rpm_info = package.preflight(local_package_path)
+    hosts = get_host_list()
+    package.distribute(local_package_path, hosts)
+    with pull.serving(local_package_path):
+        execute(upgrade_host, local_package_path, local_config_dir, rpm_info,
+                hosts=hosts)
+
+
+def upgrade_host(local_package_path, local_config_dir=None, rpm_info=None):
     stop()
 
     if not local_config_dir:
@@ -162,7 +213,7 @@ def upgrade(local_package_path, local_config_dir=None):
     configure_cmds.gather_directory(local_config_dir)
     filenames = connector.gather_connectors(local_config_dir)
 
-    package.deploy_upgrade(local_package_path)
+    package.deploy_upgrade(local_package_path, rpm_info)
 
     configure_cmds.deploy_all(local_config_dir)
     connector.deploy_files(
@@ -173,38 +224,105 @@ def upgrade(local_package_path, local_config_dir=None):
 
 
 def service(control=None):
-    if check_presto_version() != '':
+    # Check the version and the port in one round trip before running the
+    # init script in a second one
+    batch = RemoteBatch()
+    version = add_version_check(batch)
+    if control == 'start':
+        port_check = add_port_check(batch)
+    results = batch.run()
+    if presto_version_error(results[version]) != '':
         return False
-    if control == 'start' and is_port_in_use(env.host):
+    if control == 'start' and \
+            port_in_use(env.host, *[results[i] for i in port_check]):
         return False
     _LOGGER.info('Executing %s on presto server' % control)
-    ret = sudo('set -m; ' + INIT_SCRIPTS + ' ' + control)
-    return ret.succeeded
+    batch = RemoteBatch()
+    batch.add('set -m; ' + INIT_SCRIPTS + ' ' + control, show_output=True)
+    return batch.run(use_sudo=True)[0].succeeded
 
 
-def check_status_for_control_commands():
-    client = PrestoClient(env.host, env.port)
-    print('Waiting to make sure we can connect to the Presto server on %s, '
+def check_status_for_control_commands(hosts, restarted=False):
+    """
+    Waits until the servers started on hosts have registered with the
+    coordinator, polling its list of nodes once per interval for the whole
+    cluster, and reports the hosts that never joined.
+
+    Parameters:
+        hosts - hosts where the server was started
+        restarted - whether the servers were restarted. Unless the
+                    coordinator was restarted too, it may still list the
+                    old servers as active, so each server is also asked
+                    whether it has started.
+    """
+    if not hosts:
+        return
+    print('Waiting to make sure we can connect to the Presto servers on %s, '
           'please wait. This check will time out after %d minutes if the '
-          'server does not respond.'
-          % (env.host, (RETRY_TIMEOUT / 60)))
-    if check_server_status(client):
-        print('Server started successfully on: ' + env.host)
+          'servers do not respond.'
+          % (', '.join(hosts), (RETRY_TIMEOUT / 60)))
+    coordinator = get_coordinator_role()[0]
+    nodes = get_server_nodes(hosts if coordinator in hosts
+                             else hosts + [coordinator])
+    coordinator_port = nodes[coordinator].port \
+        if coordinator in nodes else None
+    if coordinator in hosts or (coordinator_port and is_started(
+            get_server_info(coordinator, coordinator_port))):
+        client = PrestoClient(coordinator, env.user, coordinator_port)
     else:
-        warn('Server failed to start on: ' + env.host
-             + '\nPlease check ' + REMOTE_PRESTO_LOG_DIR + '/server.log')
+        _LOGGER.info('The coordinator is not running. Checking that each '
+                     'of the servers has started instead.')
+        client = None
+    not_joined = wait_for_nodes(
+        client, [nodes[host] for host in hosts if host in nodes],
+        check_started=restarted and coordinator not in hosts)
+    for host in hosts:
+        if host in nodes and host not in not_joined:
+            print('Server started successfully on: ' + host)
+        else:
+            with settings(host=host):
+                warn('Server failed to start on: ' + host
+                     + '\nPlease check ' + REMOTE_PRESTO_LOG_DIR +
+                     '/server.log')
+
+
+def started_hosts(hosts, results):
+    """
+    Returns the hosts on which results, returned by execute(), shows the
+    server was started
+    """
+    return [host for host in hosts if results.get(host) is True]
+
 
+def add_port_check(batch):
+    """
+    Adds the commands needed by port_in_use() to batch and returns the
+    indexes of their results
+    """
+    config_file = os.path.join(constants.REMOTE_CONF_DIR, 'config.properties')
+    return (batch.add('grep http-server.http.port= ' + config_file,
+                      warn_only=True),
+            batch.add('netstat -an | grep LISTEN', warn_only=True))
 
-def is_port_in_use(host):
+
+def port_in_use(host, port_result, listening_result):
+    """
+    Checks if the port of the Presto server is in use, given the results of
+    the commands added by add_port_check()
+    """
     _LOGGER.info("Checking if port used by Prestoserver is already in use..")
     try:
-        portnum = lookup_port(host)
-    except Exception:
+        if port_result.return_code > 1:
+            raise ConfigurationError('Configuration file does not exist on '
+                                     'host %s' % host)
+        portnum = parse_port(port_result if port_result.succeeded else '',
+                             host)
+    except ConfigurationError:
         _LOGGER.info("Cannot find port from config.properties. "
                      "Skipping check for port already being used")
         return 0
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        output = run('netstat -an |grep %s |grep LISTEN' % str(portnum))
+    output = '\n'.join(line for line in listening_result.splitlines()
+                       if str(portnum) in line)
     if output:
         _LOGGER.info("Presto server port already in use. Skipping "
                      "server start...")
@@ -214,6 +332,7 @@ def is_port_in_use(host):
 
 
 @task
+@runs_once
 @requires_topology
 def start():
     """
@@ -222,8 +341,9 @@ def start():
     A status check is performed on the entire cluster and a list of
     servers that did not start, if any, are reported at the end.
     """
-    if service('start'):
-        check_status_for_control_commands()
+    hosts = get_host_list()
+    results = execute(service, 'start', hosts=hosts)
+    check_status_for_control_commands(started_hosts(hosts, results))
 
 
 @task
@@ -236,17 +356,25 @@ def stop():
 
 
 def stop_and_start():
-    if check_presto_version() != '':
+    batch = RemoteBatch()
+    version = add_version_check(batch)
+    if presto_version_error(batch.run()[version]) != '':
         return False
-    sudo('set -m; ' + INIT_SCRIPTS + ' stop')
-    if is_port_in_use(env.host):
+    batch = RemoteBatch()
+    batch.add('set -m; ' + INIT_SCRIPTS + ' stop', show_output=True)
+    port_check = add_port_check(batch)
+    results = batch.run(use_sudo=True)
+    if None in results or \
+            port_in_use(env.host, *[results[i] for i in port_check]):
         return False
     _LOGGER.info('Executing start on presto server')
-    ret = sudo('set -m; ' + INIT_SCRIPTS + ' start')
-    return ret.succeeded
+    batch = RemoteBatch()
+    batch.add('set -m; ' + INIT_SCRIPTS + ' start', show_output=True)
+    return batch.run(use_sudo=True)[0].succeeded
 
 
 @task
+@runs_once
 @requires_topology
 def restart():
     """
@@ -255,8 +383,195 @@ def restart():
     A status check is performed on the entire cluster and a list of
     servers that did not start, if any, are reported at the end.
     """
-    if stop_and_start():
-        check_status_for_control_commands()
+    hosts = get_host_list()
+    results = execute(stop_and_start, hosts=hosts)
+    check_status_for_control_commands(started_hosts(hosts, results),
+                                      restarted=True)
+
+
+@task
+@runs_once
+@requires_topology
+def rolling_restart(max_down=ROLLING_MAX_DOWN, coordinator='last'):
+    """
+    Restart the Presto server a few nodes at a time, so that the cluster
+    keeps running queries.
+
+    The workers are restarted in groups of at most max_down workers. Each
+    group must have started and become active in the coordinator's list of
+    nodes before the next group is restarted. The coordinator is restarted
+    on its own, first or last, after which all of the nodes must become
+    active again. The rolling restart stops at the first node that fails to
+    restart or to rejoin the cluster, and exits with an error if any node
+    failed.
+
+    Parameters:
+        max_down - the number of workers to restart at the same time, or a
+                   percentage of the workers, such as 25%. Defaults to 25%,
+                   which keeps three quarters of the workers running.
+        coordinator - restart the coordinator first or last. Defaults to
+                      last.
+    """
+    if coordinator not in ['first', 'last']:
+        abort('Invalid value for coordinator: %s. Use first or last.'
+              % coordinator)
+    hosts = get_host_list()
+    coordinator_host = get_coordinator_role()[0]
+    workers = [host for host in hosts if host != coordinator_host]
+    size = rolling_group_size(max_down, len(workers))
+    groups = [workers[i:i + size] for i in range(0, len(workers), size)]
+    if coordinator_host in hosts:
+        groups.insert(0 if coordinator == 'first' else len(groups),
+                      [coordinator_host])
+
+    nodes = get_server_nodes(hosts)
+    unknown = [host for host in hosts if host not in nodes]
+    if unknown:
+        abort('Not restarting: could not read the node id and port of the '
+              'Presto server on %s' % ', '.join(unknown))
+    coordinator_port = nodes[coordinator_host].port \
+        if coordinator_host in nodes else None
+    client = PrestoClient(coordinator_host, env.user, coordinator_port)
+
+    failed = []
+    not_restarted = []
+    for index, group in enumerate(groups):
+        if group == [coordinator_host]:
+            # Every node has to register again with a new coordinator
+            wait_for = [nodes[host] for host in hosts]
+        else:
+            wait_for = [nodes[host] for host in group]
+        failed = restart_group(client, group, wait_for)
+        if failed:
+            not_restarted = [host for remaining in groups[index + 1:]
+                             for host in remaining]
+            break
+    if not_restarted:
+        abort('Stopped the rolling restart. Not restarted: %s'
+              % ', '.join(not_restarted))
+    elif failed:
+        abort('Rolling restart failed on %s' % ', '.join(failed))
+
+
+def rolling_group_size(max_down, worker_count):
+    """
+    Returns the number of workers to restart at the same time, given
+    max_down, a number of workers or a percentage such as 25%
+    """
+    max_down = str(max_down).strip()
+    try:
+        if max_down.endswith('%'):
+            percentage = float(max_down[:-1])
+            if not 0 < percentage <= 100:
+                raise ValueError(max_down)
+            return max(1, int(worker_count * percentage / 100))
+        size = int(max_down)
+        if size < 1:
+            raise ValueError(max_down)
+        return size
+    except ValueError:
+        abort('Invalid value for max_down: %s. Use a number of workers or a '
+              'percentage of the workers, such as 25%%.' % max_down)
+
+
+def restart_group(client, group, wait_for):
+    """
+    Restart the servers on the hosts in group at the same time and wait
+    until all of the nodes in wait_for are back in the cluster
+
+    Returns:
+        list of the hosts that failed to restart or to rejoin the cluster
+    """
+    print('Restarting the Presto server on %s' % ', '.join(group))
+    results = execute(stop_and_start, hosts=group)
+    failed = [host for host in group if results.get(host) is not True]
+    waiting = [node for node in wait_for if node.host not in failed]
+    failed += [host for host in wait_for_nodes(client, waiting)
+               if host not in failed]
+    for host in group:
+        if host not in failed:
+            print('Server started successfully on: ' + host)
+    for host in failed:
+        warn('Server failed to start on: ' + host
+             + '\nPlease check ' + REMOTE_PRESTO_LOG_DIR + '/server.log')
+    return failed
+
+
+def get_server_nodes(hosts):
+    """
+    Reads the node id and the HTTP port of the Presto server on all of the
+    hosts at once with a single remote command per host.
+
+    Returns:
+        dict of host to ServerNode, for the hosts where they could be read
+    """
+    nodes = {}
+    for host, output in fanout.run_on_hosts(SERVER_NODE_SCRIPT, hosts,
+                                            use_sudo=True).iteritems():
+        if isinstance(output, Exception):
+            _LOGGER.error('Unable to read the server configuration on %s: '
+                          '%s' % (host, output))
+            continue
+        facts = parse_node_facts(output)
+        port = facts.get('port')
+        try:
+            port = parse_port('http-server.http.port=' + port
+                              if port else '', host)
+        except ConfigurationError as e:
+            _LOGGER.error(e.message)
+            continue
+        nodes[host] = ServerNode(host, facts.get('node_id', ''), port)
+    return nodes
+
+
+def wait_for_nodes(client, nodes, timeout=None, check_started=True):
+    """
+    Wait until each of the nodes is active in the coordinator's list of
+    nodes, which is queried once per interval for all of the nodes
+
+    Parameters:
+        client - client that queries the coordinator, or None if the
+                 coordinator is not running, to only wait until each node
+                 answers /v1/info as started
+        nodes - ServerNodes to wait for
+        timeout - seconds to wait, RETRY_TIMEOUT by default
+        check_started - also require each node that the coordinator lists
+                        as active to answer /v1/info as started, for when
+                        the coordinator may still list a restarted node
+                        from before its restart
+
+    Returns:
+        sorted list of the hosts of the nodes that were not back in the
+        cluster before the timeout
+    """
+    waiting = list(nodes)
+    if not waiting:
+        return []
+
+    def all_ready():
+        if client is None:
+            ready = list(waiting)
+        else:
+            active = get_active_node_ids(client)
+            ready = [node for node in waiting if node.node_id in active]
+        if check_started or client is None:
+            ready = [node for node in ready
+                     if is_started(get_server_info(node.host, node.port))]
+        waiting[:] = [node for node in waiting if node not in ready]
+        return not waiting
+
+    poll_with_backoff(all_ready,
+                      RETRY_TIMEOUT if timeout is None else timeout)
+    return sorted(node.host for node in waiting)
+
+
+def get_active_node_ids(client):
+    """
+    Returns the set of the ids of the nodes that are active according to
+    the coordinator
+    """
+    return set(row[0] for row in run_sql(client, NODE_STATE_SQL)
+               if row and row[1])
 
 
 def check_presto_version():
@@ -266,12 +581,46 @@ def check_presto_version():
     Returns:
         Error string if applicable
     """
-    if not presto_installed():
+    batch = RemoteBatch()
+    version = add_version_check(batch)
+    return presto_version_error(batch.run()[version])
+
+
+def add_version_check(batch):
+    """
+    Adds a command that prints the version of the installed presto rpm to
+    batch and returns the index of its result
+    """
+    # currently we have two rpm names out so we need this retry
+    return batch.add("version=$(rpm -q --qf '%{VERSION}\\n' presto) || "
+                     "version=$(rpm -q --qf '%{VERSION}\\n' "
+                     "presto-server-rpm) || exit 1; echo $version",
+                     warn_only=True)
+
+
+def presto_version_error(version_result):
+    """
+    Checks that the Presto version is suitable, given the result of the
+    command added by add_version_check()
+
+    Returns:
+        Error string if applicable
+    """
+    if not version_result.succeeded:
         not_installed_str = 'Presto is not installed.'
         warn(not_installed_str)
         return not_installed_str
+    _LOGGER.debug('Presto rpm version: ' + version_result)
+    return validate_presto_version(version_result.strip())
+
+
+def validate_presto_version(version):
+    """
+    Checks that the given Presto version is suitable.
 
-    version = get_presto_version()
+    Returns:
+        Error string if applicable
+    """
     if version in PRESTO_TD_RPM:
         return ''
 
@@ -293,14 +642,6 @@ def check_presto_version():
     return ''
 
 
-def presto_installed():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        package_search = run('rpm -q presto')
-        if not package_search.succeeded:
-            package_search = run('rpm -q presto-server-rpm')
-        return package_search.succeeded
-
-
 def get_presto_version():
     with settings(hide('warnings', 'stdout'), warn_only=True):
         version = run('rpm -q --qf \"%{VERSION}\\n\" presto')
@@ -312,29 +653,26 @@ def get_presto_version():
         return version
 
 
-def check_server_status(client):
+def poll_with_backoff(probe, timeout):
     """
-    Checks if server is running for env.host. Retries connecting to server
-    until server is up or till RETRY_TIMEOUT is reached
-
-    Parameters:
-        client - client that executes the query
+    Calls probe until it returns True or timeout seconds have passed,
+    waiting PROBE_FIRST_INTERVAL between the first calls and twice as long
+    after each call, up to PROBE_MAX_INTERVAL.
 
     Returns:
-        True or False
-    """
-    result = True
-    time = 0
-    while time < RETRY_TIMEOUT:
-        result = client.execute_query(SYSTEM_RUNTIME_NODES)
-        if not result:
-            run('sleep %d' % SLEEP_INTERVAL)
-            _LOGGER.debug('Status retrieval for the server failed after '
-                          'waiting for %d seconds. Retrying...' % time)
-            time += SLEEP_INTERVAL
-        else:
-            break
-    return result
+        the last value returned by probe
+    """
+    deadline = time.time() + timeout
+    interval = PROBE_FIRST_INTERVAL
+    while True:
+        result = probe()
+        remaining = deadline - time.time()
+        if result or remaining <= 0:
+            return result
+        _LOGGER.debug('Not ready yet, probing again in %.2f seconds' %
+                      min(interval, remaining))
+        time.sleep(min(interval, remaining))
+        interval = min(PROBE_MAX_INTERVAL, interval * 2)
 
 
 def run_sql(client, sql):
@@ -358,24 +696,12 @@ def execute_connector_info_sql(client):
     return run_sql(client, CONNECTOR_INFO_SQL)
 
 
-def execute_external_ip_sql(client, uuid):
-    """
-    Returns external ip of the host with uuid after parsing the http_uri column
-    from nodes system table
-
-    Parameters:
-        client - client that executes the query
-        uuid - node_id of the node
-    """
-    return run_sql(client, EXTERNAL_IP_SQL % uuid)
-
-
 def get_sysnode_info_from(node_info_row):
     """
     Returns system node info dict from node info row for a node
 
     Parameters:
-        node_info_row -
+        node_info_row - rows of NODES_SQL for the node
 
     Returns:
         Node info dict in format:
@@ -384,12 +710,32 @@ def get_sysnode_info_from(node_info_row):
     output = {}
     for row in node_info_row:
         if row:
-            output[row[0]] = [row[1], row[2]]
+            output[row[1]] = [row[2], row[3]]
 
     _LOGGER.info('Node info: %s ', output)
     return output
 
 
+def index_nodes(node_rows):
+    """
+    Index the rows of NODES_SQL, so that the status of every host can be
+    looked up without querying the coordinator again.
+
+    Returns:
+        (nodes_by_id, nodes_by_host), dicts of node_id and of the host of
+        the http_uri to the list of rows for it
+    """
+    nodes_by_id = {}
+    nodes_by_host = {}
+    for row in node_rows:
+        if not row:
+            continue
+        nodes_by_id.setdefault(row[0], []).append(row)
+        host = urlparse.urlparse(row[1]).hostname
+        nodes_by_host.setdefault(host, []).append(row)
+    return nodes_by_id, nodes_by_host
+
+
 def get_connector_info_from(client):
     """
     Returns installed connectors
@@ -432,25 +778,20 @@ def print_node_info(node_status, connector_status):
             print('\tConnectors:     ' + connector_status)
 
 
-def get_ext_ip_of_node(client):
-    node_properties_file = os.path.join(constants.REMOTE_CONF_DIR,
-                                        'node.properties')
-    with settings(hide('stdout')):
-        node_uuid = run('sed -n s/^node.id=//p ' + node_properties_file)
-    external_ip_row = execute_external_ip_sql(client, node_uuid)
+def get_ext_ip_from_node_id(nodes_by_id, node_uuid, host):
+    node_rows = nodes_by_id.get(node_uuid, [])
     external_ip = ''
-    if len(external_ip_row) > 1:
+    if len(node_rows) > 1:
         warn_more_than_one_ip = 'More than one external ip found for ' \
-                                + env.host + '. There could be multiple nodes ' \
-                                             'associated with the same node.id'
+                                + host + '. There could be multiple nodes ' \
+                                         'associated with the same node.id'
         _LOGGER.debug(warn_more_than_one_ip)
         warn(warn_more_than_one_ip)
         return external_ip
-    for row in external_ip_row:
-        if row:
-            external_ip = row[0]
+    for row in node_rows:
+        external_ip = urlparse.urlparse(row[1]).hostname
     if not external_ip:
-        _LOGGER.debug('Cannot get external IP for ' + env.host)
+        _LOGGER.debug('Cannot get external IP for ' + host)
         external_ip = 'Unknown'
     return external_ip
 
@@ -462,31 +803,102 @@ def print_status_header(external_ip, server_status, host):
                                            is_server_up(server_status)))
 
 
-@parallel
-def collect_node_information():
-    client = PrestoClient(get_coordinator_role()[0], env.user)
-    with settings(hide('warnings')):
-        error_message = check_presto_version()
+def parse_node_facts(output):
+    """
+    Returns a dict of the key=value lines printed by NODE_FACTS_SCRIPT
+    """
+    facts = {}
+    for line in output.splitlines():
+        if '=' in line:
+            key, value = line.split('=', 1)
+            facts[key.strip()] = value.strip()
+    return facts
+
+
+def collect_node_information(nodes_by_id, hosts, on_result=None):
+    """
+    Gathers the status of presto on all of the hosts at once with a single
+    remote command per host.
+
+    Parameters:
+        nodes_by_id - the nodes known to the coordinator, by node_id, used
+                      to look up the external ip of running nodes
+        hosts - hosts to collect the information from
+        on_result - optional callback, called with the host and its
+                    information as soon as that host has answered
+
+    Returns:
+        dict of host to (external_ip, is_running, error_message), or to the
+        exception raised while collecting the information for that host.
+    """
+    node_information = {}
+
+    def host_finished(host, output):
+        node_information[host] = get_node_information(nodes_by_id, host,
+                                                      output)
+        if on_result is not None:
+            on_result(host, node_information[host])
+
+    fanout.run_on_hosts(NODE_FACTS_SCRIPT, hosts, use_sudo=True,
+                        on_result=host_finished)
+    return node_information
+
+
+def get_node_information(nodes_by_id, host, output):
+    """
+    Returns (external_ip, is_running, error_message) for a host given the
+    output of NODE_FACTS_SCRIPT on it, or the exception that prevented the
+    script from running.
+    """
+    if isinstance(output, Exception):
+        return output
+    facts = parse_node_facts(output)
+    if facts.get('installed') != 'true':
+        error_message = 'Presto is not installed.'
+    else:
+        with settings(hide('warnings')):
+            error_message = validate_presto_version(facts.get('version', ''))
     if error_message:
+        return 'Unknown', False, error_message
+    external_ip = get_ext_ip_from_node_id(nodes_by_id,
+                                          facts.get('node_id', ''), host)
+    is_running = facts.get('status') == '0'
+    return external_ip, is_running, ''
+
+
+def print_host_status(nodes_by_host, host, node_information,
+                      coordinator_status, connector_status):
+    if isinstance(node_information, Exception):
         external_ip = 'Unknown'
         is_running = False
+        error_message = node_information.message
+    else:
+        (external_ip, is_running, error_message) = node_information
+
+    print_status_header(external_ip, is_running, host)
+    if error_message:
+        print('\t' + error_message)
+    elif not coordinator_status:
+        print('\tNo information available: unable to query coordinator')
+    elif not is_running:
+        print('\tNo information available')
     else:
-        with settings(hide('warnings', 'aborts', 'stdout')):
-            try:
-                external_ip = get_ext_ip_of_node(client)
-            except:
-                external_ip = 'Unknown'
-            try:
-                is_running = service('status')
-            except:
-                is_running = False
-    return external_ip, is_running, error_message
+        node_status = get_sysnode_info_from(
+            nodes_by_host.get(external_ip, []))
+        if node_status:
+            print_node_info(node_status, connector_status)
+        else:
+            print('\tNo information available: the coordinator has not yet'
+                  ' discovered this node')
 
 
 def get_status_from_coordinator():
+    # The coordinator is asked once for all of its nodes and once for its
+    # catalogs, however large the cluster; the status of each host is then
+    # looked up in the indexes of those nodes.
     client = PrestoClient(get_coordinator_role()[0], env.user)
     try:
-        coordinator_status = run_sql(client, SYSTEM_RUNTIME_NODES)
+        coordinator_status = run_sql(client, NODES_SQL)
         connector_status = get_connector_info_from(client)
     except BaseException as e:
         # Just log errors that come from a missing port or anything else; if
@@ -495,36 +907,17 @@ def get_status_from_coordinator():
         _LOGGER.warn(e.message)
         coordinator_status = []
         connector_status = []
+    nodes_by_id, nodes_by_host = index_nodes(coordinator_status)
 
-    with settings(hide('running')):
-        node_information = execute(collect_node_information,
-                                   hosts=get_host_list())
+    # Print the status of each host as soon as it has answered, so that one
+    # slow host does not hold up the output for the rest of the cluster.
+    def host_finished(host, node_information):
+        print_host_status(nodes_by_host, host, node_information,
+                          coordinator_status, connector_status)
+        sys.stdout.flush()
 
-    for host in get_host_list():
-        if isinstance(node_information[host], Exception):
-            external_ip = 'Unknown'
-            is_running = False
-            error_message = node_information[host].message
-        else:
-            (external_ip, is_running, error_message) = node_information[host]
-
-        print_status_header(external_ip, is_running, host)
-        if error_message:
-            print('\t' + error_message)
-        elif not coordinator_status:
-            print('\tNo information available: unable to query coordinator')
-        elif not is_running:
-            print('\tNo information available')
-        else:
-            # just get the node_info row for the host if server is up
-            node_info_row = run_sql(client, NODE_INFO_PER_URI_SQL
-                                    % external_ip)
-            node_status = get_sysnode_info_from(node_info_row)
-            if node_status:
-                print_node_info(node_status, connector_status)
-            else:
-                print('\tNo information available: the coordinator has not yet'
-                      ' discovered this node')
+    collect_node_information(nodes_by_id, get_host_list(),
+                             on_result=host_finished)
 
 
 @task
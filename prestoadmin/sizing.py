@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sizing of the JVM and of Presto's memory and thread settings to the
+hardware of each host.
+
+When the topology configuration has a sizing property, the memory, number
+of cores and number of NUMA nodes of every host are gathered in parallel
+before the configuration is deployed, and the following settings are
+derived from them for each host:
+
+    -Xmx                        heap_fraction of the memory of the host
+    -XX:G1HeapRegionSize=32M    for heaps of 16GB or more
+    -XX:+UseNUMA                on hosts with more than one NUMA node
+    query.max-memory-per-node   query_memory_fraction of the heap
+    task.concurrency            the largest power of two up to the number
+                                of cores
+    task.max-worker-threads     worker_threads_per_core per core
+
+The cluster-wide limits of the coordinator are then derived from the sized
+settings of all of the nodes that run tasks, by
+coordinator.build_cluster_defaults().
+
+The ratios have defaults that the sizing property can override:
+
+    "sizing": {"heap_fraction": 0.8, "query_memory_fraction": 0.4}
+
+Settings that are in the local configuration files take precedence over
+the derived ones, and a jvm.config in the local configuration is deployed
+as it is.
+"""
+import copy
+import logging
+import re
+from collections import namedtuple
+
+from fabric.api import env, run
+from fabric.tasks import execute
+from fabric.utils import warn
+
+_LOGGER = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+DEFAULT_RATIOS = {'heap_fraction': 0.7,
+                  'query_memory_fraction': 0.5,
+                  'worker_threads_per_core': 2}
+
+_DATA_SIZE = re.compile(r'(\d+(?:\.\d+)?)\s*(B|kB|MB|GB|TB|PB)$')
+_DATA_SIZE_UNITS = {'B': 1, 'kB': 1024, 'MB': MB, 'GB': GB, 'TB': 1024 * GB,
+                    'PB': 1024 * 1024 * GB}
+
+# Heaps at least this large get the largest G1 regions, so that large
+# objects don't end up allocated as humongous
+LARGE_HEAP = 16 * GB
+
+FACTS_COMMAND = ('grep MemTotal /proc/meminfo; nproc; '
+                 'ls -d /sys/devices/system/node/node[0-9]* 2>/dev/null '
+                 '| wc -l')
+
+# Memory in bytes, number of cores and number of NUMA nodes of a host
+HostFacts = namedtuple('HostFacts', ['memory', 'cores', 'numa_nodes'])
+
+
+def enabled():
+    return env.get('sizing') is not None
+
+
+def ratios():
+    result = dict(DEFAULT_RATIOS)
+    for name, value in (env.get('sizing') or {}).items():
+        result[name] = float(value)
+    return result
+
+
+def gather_facts():
+    """
+    Returns:
+        the HostFacts of the current host, or None if they could not be
+        read
+    """
+    output = run(FACTS_COMMAND, quiet=True)
+    if output.failed:
+        return None
+    return parse_facts(output)
+
+
+def parse_facts(output):
+    match = re.search(r'MemTotal:\s*(\d+)\s*kB\s+(\d+)\s+(\d+)', output)
+    if not match:
+        return None
+    return HostFacts(int(match.group(1)) * 1024, int(match.group(2)),
+                     max(1, int(match.group(3))))
+
+
+def gather(hosts):
+    """
+    Gather the hardware facts of the hosts in parallel
+
+    Returns:
+        dict of host to HostFacts for the hosts whose facts were read
+    """
+    results = execute(gather_facts, hosts=hosts)
+    facts = {}
+    for host in hosts:
+        result = results.get(host)
+        if isinstance(result, HostFacts):
+            facts[host] = result
+        else:
+            warn('Could not read the memory and cores of %s. Its '
+                 'configuration will not be sized to its hardware.' % host)
+    return facts
+
+
+def size(facts, sizing_ratios=None):
+    """
+    Derive the settings for a host with facts
+
+    Returns:
+        dict with the jvm.config flags and the config.properties for the
+        host
+    """
+    sizing_ratios = sizing_ratios or ratios()
+    heap = max(GB, int(facts.memory * sizing_ratios['heap_fraction']) //
+               GB * GB)
+    jvm = ['-Xmx%dG' % (heap // GB)]
+    if heap >= LARGE_HEAP:
+        jvm.append('-XX:G1HeapRegionSize=32M')
+    if facts.numa_nodes > 1:
+        jvm.append('-XX:+UseNUMA')
+    query_memory = max(MB, int(heap * sizing_ratios['query_memory_fraction'])
+                       // MB * MB)
+    concurrency = 1
+    while concurrency * 2 <= facts.cores:
+        concurrency *= 2
+    worker_threads = max(1, int(facts.cores *
+                                sizing_ratios['worker_threads_per_core']))
+    return {'jvm.config': jvm,
+            'config.properties': {
+                'query.max-memory-per-node': data_size(query_memory),
+                'task.concurrency': str(concurrency),
+                'task.max-worker-threads': str(worker_threads)}}
+
+
+def data_size(size_in_bytes):
+    if size_in_bytes % GB == 0:
+        return '%dGB' % (size_in_bytes // GB)
+    return '%dMB' % (size_in_bytes // MB)
+
+
+def parse_data_size(value):
+    """
+    Returns:
+        the number of bytes in a Presto data size such as 1GB or 512MB
+    """
+    match = _DATA_SIZE.match(value.strip())
+    if not match:
+        raise ValueError('Invalid data size: ' + value)
+    return int(float(match.group(1)) * _DATA_SIZE_UNITS[match.group(2)])
+
+
+def apply_sizing(conf, local_conf, sized):
+    """
+    Returns:
+        a copy of conf with the sized settings, except for the ones that
+        are set in local_conf, the configuration in the local files
+    """
+    conf = copy.deepcopy(conf)
+    if 'jvm.config' not in local_conf:
+        conf['jvm.config'] = merge_jvm_flags(conf['jvm.config'],
+                                             sized['jvm.config'])
+    explicit = local_conf.get('config.properties', {})
+    for key, value in sized['config.properties'].iteritems():
+        if key not in explicit:
+            conf['config.properties'][key] = value
+    return conf
+
+
+def merge_jvm_flags(flags, sized_flags):
+    """
+    Replace the flags in flags that set the same option as one of
+    sized_flags, and add the rest of sized_flags at the end
+    """
+    flags = list(flags)
+    names = [_flag_name(flag) for flag in flags]
+    for flag in sized_flags:
+        name = _flag_name(flag)
+        if name in names:
+            flags[names.index(name)] = flag
+        else:
+            flags.append(flag)
+            names.append(name)
+    return flags
+
+
+def _flag_name(flag):
+    if flag.startswith('-Xmx') or flag.startswith('-Xms'):
+        return flag[:4]
+    if flag.startswith('-XX:'):
+        return '-XX:' + flag[4:].lstrip('+-').split('=')[0]
+    return flag.split('=')[0]
+
+
+def describe(host, facts, sized):
+    return ('Sizing %s: %d GB of memory, %d cores, %d NUMA %s: %s, %s' %
+            (host, facts.memory // GB, facts.cores, facts.numa_nodes,
+             'node' if facts.numa_nodes == 1 else 'nodes',
+             ' '.join(sized['jvm.config']),
+             ', '.join('%s=%s' % item for item in
+                       sorted(sized['config.properties'].items()))))
@@ -20,12 +20,14 @@ import os.path
 
 from fabric.api import env, task, abort
 from fabric.decorators import runs_once
-from fabric.operations import put, sudo
+from fabric.operations import sudo
 from fabric.tasks import execute
 
 from prestoadmin.slider.config import requires_conf, DIR, SLIDER_MASTER
 
 from prestoadmin.util.fabricapi import get_host_list, task_by_rolename
+from prestoadmin.util.filesystem import sha256
+from prestoadmin.util.transfer import put_resumable
 
 __all__ = ['slider_install', 'slider_uninstall']
 
@@ -40,6 +42,8 @@ def slider_install(slider_tarball):
 
     :param slider_tarball:
     """
+    # Hash the tarball here, once, rather than in every forked task
+    sha256(slider_tarball)
     execute(deploy_install, slider_tarball, hosts=get_host_list())
 
 
@@ -50,10 +54,9 @@ def deploy_install(slider_tarball):
 
     sudo('mkdir -p %s' % (slider_dir))
 
-    result = put(slider_tarball, os.path.join(slider_parent, slider_file))
-    if result.failed:
-        abort('Failed to send slider tarball to directory %s on host %s' %
-              (slider_tarball, slider_dir, env.host))
+    if not put_resumable(slider_tarball, slider_file):
+        abort('Failed to send slider tarball %s to directory %s on host %s' %
+              (slider_tarball, slider_parent, env.host))
 
     sudo('gunzip -c %s | tar -x -C %s --strip-components=1 && rm -f %s' %
          (slider_file, slider_dir, slider_file))
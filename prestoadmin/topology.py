@@ -24,17 +24,20 @@ from fabric.api import task, env, runs_once
 
 from fabric.context_managers import settings
 
-from prestoadmin import config
-from prestoadmin.util import constants
+from prestoadmin import config, sizing
+from prestoadmin.util import bandwidth, constants
 from prestoadmin.util.exception import ConfigurationError,\
     ConfigFileNotFoundError
 import prestoadmin.util.fabricapi as util
 from prestoadmin.util.validators import validate_username, validate_port, \
-    validate_host
+    validate_host, validate_max_parallel_hosts, validate_bandwidth_limit, \
+    validate_bandwidth_groups, validate_sizing
 
 __all__ = ['show']
 
-PRESTO_ADMIN_PROPERTIES = ['username', 'port', 'coordinator', 'workers']
+PRESTO_ADMIN_PROPERTIES = ['username', 'port', 'coordinator', 'workers',
+                           'max_parallel_hosts', 'bandwidth_limit',
+                           'bandwidth_groups', 'sizing']
 DEFAULT_PROPERTIES = {'username': 'root',
                       'port': '22',
                       'coordinator': 'localhost',
@@ -168,6 +171,34 @@ def validate(conf):
     else:
         validate_workers(workers)
 
+    try:
+        max_parallel_hosts = conf['max_parallel_hosts']
+    except KeyError:
+        pass
+    else:
+        validate_max_parallel_hosts(max_parallel_hosts)
+
+    try:
+        bandwidth_limit = conf['bandwidth_limit']
+    except KeyError:
+        pass
+    else:
+        validate_bandwidth_limit(bandwidth_limit)
+
+    try:
+        bandwidth_groups = conf['bandwidth_groups']
+    except KeyError:
+        pass
+    else:
+        validate_bandwidth_groups(bandwidth_groups)
+
+    try:
+        sizing_ratios = conf['sizing']
+    except KeyError:
+        pass
+    else:
+        validate_sizing(sizing_ratios, sizing.DEFAULT_RATIOS.keys())
+
     try:
         ssh_port = conf['ssh-port']
     except KeyError:
@@ -212,6 +243,15 @@ def set_env_from_conf():
     env.roledefs['worker'] = conf['workers']
     env.roledefs['all'] = dedup_list(util.get_coordinator_role() +
                                      util.get_worker_role())
+    if 'max_parallel_hosts' in conf:
+        env.max_parallel_hosts = int(conf['max_parallel_hosts'])
+    if 'bandwidth_limit' in conf:
+        env.bandwidth_limit = float(conf['bandwidth_limit'])
+    if 'bandwidth_groups' in conf:
+        env.bandwidth_groups = conf['bandwidth_groups']
+    bandwidth.install()
+    if 'sizing' in conf:
+        env.sizing = conf['sizing']
 
     # This ensures that we honor a hosts list passed on the command line.
     if not env.hosts:
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bandwidth limits for the files sent to the hosts.
+
+The topology configuration can set bandwidth_limit, in megabytes per
+second, for everything sent from the node running presto-admin, and
+bandwidth_groups, which limits what is sent to a group of hosts, such as
+the hosts behind one top-of-rack switch:
+
+    "bandwidth_limit": 100,
+    "bandwidth_groups": {"rack1": {"hosts": ["slave1", "slave2"],
+                                   "limit": 40}}
+
+Each limit is a token bucket. Before sending a block of data to a host,
+the sender takes as many tokens as the block has bytes from the global
+bucket and from the bucket of the host's group, and waits until the
+buckets have refilled if they have run dry. The buckets are kept in shared
+memory and created by install() before any tasks run, so that forked
+workers and worker threads all draw from the same buckets.
+"""
+import logging
+import multiprocessing
+import time
+
+from fabric import state
+
+_LOGGER = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# The scheduler installed for this run, if any limits are set
+_scheduler = None
+
+
+class TokenBucket(object):
+    """
+    Tokens, one per byte, are added at rate per second up to burst. Taking
+    more tokens than the bucket holds leaves it in debt, and the caller
+    waits until the debt is paid off, so that large blocks are not starved
+    by small ones.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._lock = multiprocessing.Lock()
+        self._tokens = multiprocessing.Value('d', self.burst, lock=False)
+        self._updated = multiprocessing.Value('d', time.time(), lock=False)
+
+    def reserve(self, size):
+        """
+        Take size tokens from the bucket.
+
+        Returns:
+            the number of seconds to wait before sending size bytes
+        """
+        with self._lock:
+            now = time.time()
+            elapsed = max(0.0, now - self._updated.value)
+            tokens = min(self.burst,
+                         self._tokens.value + elapsed * self.rate)
+            tokens -= size
+            self._tokens.value = tokens
+            self._updated.value = now
+        return max(0.0, -tokens / self.rate)
+
+
+class Scheduler(object):
+    """
+    A global token bucket and one token bucket per group of hosts
+    """
+
+    def __init__(self, limit=None, groups=None):
+        self.buckets = {}
+        self.bucket_for_host = {}
+        if limit:
+            self.buckets[None] = TokenBucket(float(limit) * MB)
+        for name, group in (groups or {}).items():
+            self.buckets[name] = TokenBucket(float(group['limit']) * MB)
+            for host in group['hosts']:
+                self.bucket_for_host[host] = self.buckets[name]
+
+    def throttle(self, size, host):
+        """
+        Wait until size bytes can be sent to host within the limits
+        """
+        buckets = [self.buckets[None]] if None in self.buckets else []
+        if host in self.bucket_for_host:
+            buckets.append(self.bucket_for_host[host])
+        delay = max([bucket.reserve(size) for bucket in buckets] + [0.0])
+        if delay:
+            _LOGGER.debug('Waiting %.2f seconds to send %d bytes to %s' %
+                          (delay, size, host))
+            time.sleep(delay)
+
+
+def install():
+    """
+    Create the token buckets for the limits set in env. Must be called
+    before tasks are run in parallel, so that all workers share them.
+    """
+    global _scheduler
+    limit = state.env.get('bandwidth_limit')
+    groups = state.env.get('bandwidth_groups')
+    if limit or groups:
+        _scheduler = Scheduler(limit, groups)
+    else:
+        _scheduler = None
+    return _scheduler
+
+
+def throttle(size, host=None):
+    """
+    Wait until size bytes can be sent to host, by default the current host
+    """
+    if _scheduler is not None:
+        _scheduler.throttle(size, host or state.env.host)
+
+
+def report(name, size, seconds):
+    """
+    Print the throughput achieved sending a file to the current host
+    """
+    rate = float(size) / MB / seconds if seconds > 0 else 0.0
+    message = 'Sent %s to %s: %.1f MB in %.1f seconds (%.1f MB/s)' % \
+              (name, state.env.host, float(size) / MB, seconds, rate)
+    _LOGGER.info(message)
+    print(message)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of the parsed configuration directories under LOCAL_CONF_DIR, so
+that commands don't parse the same files over and over again.
+
+The cache is a JSON file that holds, for each directory, the parsed
+configuration and the size, modification time and SHA-256 digest of every
+file in the directory when it was parsed. An entry is used only if the
+directory still has the same files, and each file still has the same size
+and modification time or, failing that, the same digest. Otherwise the
+directory is parsed again and the entry replaced. If the cache can't be
+read or written, the directory is simply parsed every time.
+"""
+import json
+import logging
+import os
+import tempfile
+
+from prestoadmin.util import constants
+from prestoadmin.util.filesystem import sha256
+
+_LOGGER = logging.getLogger(__name__)
+
+VERSION = 1
+
+
+def load(conf_dir, parse):
+    """
+    Returns:
+        parse(conf_dir), from the cache if no file in conf_dir has changed
+        since it was cached. The result of parse must be JSON serializable.
+    """
+    if not os.path.isdir(conf_dir):
+        return parse(conf_dir)
+    files = _stat_files(conf_dir)
+    cache = _read()
+    entry = cache.get(conf_dir)
+    if entry is not None and _unchanged(conf_dir, entry['files'], files):
+        _LOGGER.debug('Using cached configuration for %s' % conf_dir)
+        return _to_str(entry['conf'])
+    conf = parse(conf_dir)
+    cache[conf_dir] = {
+        'files': dict((name, [size, mtime,
+                              sha256(os.path.join(conf_dir, name))])
+                      for name, (size, mtime) in files.items()),
+        'conf': conf}
+    _write(cache)
+    return conf
+
+
+def _stat_files(conf_dir):
+    files = {}
+    for name in os.listdir(conf_dir):
+        path = os.path.join(conf_dir, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files[name] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def _unchanged(conf_dir, cached, files):
+    if set(cached) != set(files):
+        return False
+    for name, (size, mtime) in files.items():
+        cached_size, cached_mtime, digest = cached[name]
+        if (size, mtime) == (cached_size, cached_mtime):
+            continue
+        if size != cached_size or \
+                sha256(os.path.join(conf_dir, name)) != digest:
+            return False
+    return True
+
+
+def _read():
+    try:
+        with open(constants.LOCAL_CONF_CACHE) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get('version') != VERSION:
+        return {}
+    return cache.get('directories', {})
+
+
+def _write(directories):
+    """
+    Replace the cache file in one rename, so that concurrent commands never
+    read a partly written cache
+    """
+    cache_dir = os.path.dirname(constants.LOCAL_CONF_CACHE)
+    if not os.path.isdir(cache_dir):
+        return
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': VERSION, 'directories': directories},
+                          f)
+            os.rename(temp_path, constants.LOCAL_CONF_CACHE)
+        except:
+            os.remove(temp_path)
+            raise
+    except (IOError, OSError), e:
+        _LOGGER.debug('Unable to write configuration cache %s: %s' %
+                      (constants.LOCAL_CONF_CACHE, e))
+
+
+def _to_str(value):
+    """
+    Convert the unicode strings that json returns back to str, the type the
+    configuration parsers return
+    """
+    if isinstance(value, dict):
+        return dict((_to_str(k), _to_str(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_to_str(v) for v in value]
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
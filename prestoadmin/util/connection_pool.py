@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+SSH connection pool that keeps connections open for the rest of the
+presto-admin invocation, for the later tasks and execute() calls run in
+the same process.
+
+Which tasks share connections depends on the engine. Serial tasks,
+runs_once tasks and the fanout commands they run all run in the main
+process, as do the parallel tasks of the thread engine, so all of them
+reuse the connections in the pool. With the default process engine every
+parallel task is a forked process that starts without usable
+connections: it opens its own, which only the commands of that task
+reuse, and they are closed when it exits. Use --engine=threads to reuse
+connections across parallel tasks as well.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from contextlib import contextmanager
+
+from fabric import state
+from fabric.network import HostConnectionCache, normalize_to_string
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ConnectionPool(HostConnectionCache):
+    """
+    Drop-in replacement for Fabric's HostConnectionCache that keeps
+    connections open for the lifetime of the process that opened them,
+    so that the later tasks run by that process reuse them.
+
+    Connections are tagged with the pid of the process that opened them. A
+    forked worker never reuses a connection it inherited from its parent
+    (the paramiko transport thread does not survive the fork); it opens its
+    own instead. Within a process, access to each host is serialized with a
+    per-host lock so that worker threads can share the pool.
+
+    A connection counts as reused when it is handed out to a task other
+    than the one that last had it, see task(). The opened/reused counters
+    live in shared memory so that connections made by forked workers are
+    included in the totals seen by the parent.
+    """
+
+    def __init__(self):
+        super(ConnectionPool, self).__init__()
+        self._lock = threading.Lock()
+        self._host_locks = {}
+        self._owners = {}
+        self._last_task = {}
+        self._task_numbers = itertools.count(1)
+        self._current = threading.local()
+        self._opened = multiprocessing.Value('l', 0)
+        self._reused = multiprocessing.Value('l', 0)
+
+    def _host_lock(self, key):
+        with self._lock:
+            if key not in self._host_locks:
+                self._host_locks[key] = threading.RLock()
+            return self._host_locks[key]
+
+    def connect(self, key):
+        key = normalize_to_string(key)
+        with self._host_lock(key):
+            HostConnectionCache.connect(self, key)
+            self._owners[key] = os.getpid()
+            self._last_task[key] = self._task_number()
+            _increment(self._opened)
+
+    def __getitem__(self, key):
+        key = normalize_to_string(key)
+        with self._host_lock(key):
+            if dict.__contains__(self, key):
+                if self._is_usable(key):
+                    if self._last_task.get(key) != self._task_number():
+                        self._last_task[key] = self._task_number()
+                        _increment(self._reused)
+                    return dict.__getitem__(self, key)
+                _LOGGER.debug('Discarding stale connection to %s', key)
+                dict.__delitem__(self, key)
+            self.connect(key)
+            return dict.__getitem__(self, key)
+
+    def _is_usable(self, key):
+        if self._owners.get(key) != os.getpid():
+            return False
+        transport = dict.__getitem__(self, key).get_transport()
+        return transport is not None and transport.is_active()
+
+    @contextmanager
+    def task(self):
+        """
+        Mark the connections handed out to the current thread within the
+        block as belonging to a new task
+        """
+        previous = self._task_number()
+        with self._lock:
+            self._current.number = next(self._task_numbers)
+        try:
+            yield
+        finally:
+            self._current.number = previous
+
+    def _task_number(self):
+        return getattr(self._current, 'number', 0)
+
+    def stats(self):
+        return {'opened': self._opened.value, 'reused': self._reused.value}
+
+
+def _increment(counter):
+    with counter.get_lock():
+        counter.value += 1
+
+
+def install():
+    """
+    Replace fabric's connection cache with a ConnectionPool. Fabric modules
+    that bound the cache at import time are rebound as well.
+    """
+    if isinstance(state.connections, ConnectionPool):
+        return state.connections
+    import fabric.context_managers
+    import fabric.operations
+    import fabric.sftp
+
+    pool = ConnectionPool()
+    for module in [state, fabric.context_managers, fabric.operations,
+                   fabric.sftp]:
+        module.connections = pool
+    return pool
+
+
+@contextmanager
+def task():
+    """
+    Run the block as a task of its own in the connection pool, if one is
+    installed
+    """
+    if isinstance(state.connections, ConnectionPool):
+        with state.connections.task():
+            yield
+    else:
+        yield
+
+
+def log_stats():
+    if isinstance(state.connections, ConnectionPool):
+        _LOGGER.info('SSH connections opened: %(opened)d, reused: '
+                     '%(reused)d' % state.connections.stats())
@@ -36,10 +36,12 @@ CONFIG_PATH = os.path.join(LOCAL_CONF_DIR, 'config.json')
 COORDINATOR_DIR = os.path.join(LOCAL_CONF_DIR, 'coordinator')
 WORKERS_DIR = os.path.join(LOCAL_CONF_DIR, 'workers')
 CONNECTORS_DIR = os.path.join(LOCAL_CONF_DIR, 'connectors')
+LOCAL_CONF_CACHE = os.path.join(LOCAL_CONF_DIR, '.parsed-conf-cache.json')
 
 # remote configuration
 REMOTE_CONF_DIR = '/etc/presto'
 REMOTE_CATALOG_DIR = os.path.join(REMOTE_CONF_DIR, 'catalog')
 REMOTE_PACKAGES_PATH = '/opt/prestoadmin/packages'
+REMOTE_PACKAGE_CACHE_DIR = os.path.join(REMOTE_PACKAGES_PATH, 'sha256')
 REMOTE_PRESTO_LOG_DIR = '/var/log/presto'
 REMOTE_PLUGIN_DIR = '/usr/lib/presto/lib/plugin'
@@ -61,6 +61,14 @@ class ConfigFileNotFoundError(ConfigurationError):
     pass
 
 
+class TaskTimeoutError(ExceptionWithCause):
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        super(TaskTimeoutError, self).__init__(
+            'Task did not finish within %s seconds' % timeout)
+
+
 def is_arguments_error(exception):
     return isinstance(exception, TypeError) and \
         re.match(r'.+\(\) takes (at most \d+|no|exactly \d+|at least \d+) '
@@ -18,6 +18,8 @@ Logic for starting and stopping Fabric applications.
 
 from fabric.network import disconnect_all
 from prestoadmin.util.application import Application
+from prestoadmin.util.connection_pool import log_stats
+from prestoadmin.util import tracing
 
 import logging
 import sys
@@ -40,9 +42,12 @@ class FabricApplication(Application):
 
     def _exit_cleanup_hook(self):
         """
-        Disconnect all Fabric connections in addition to shutting down the
-        logging.
+        Print the timing summary of the trace, log the connection pool
+        statistics and disconnect all Fabric connections in addition to
+        shutting down the logging.
         """
+        tracing.print_summary()
+        log_stats()
         disconnect_all()
         Application._exit_cleanup_hook(self)
 
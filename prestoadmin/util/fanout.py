@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Event loop that runs one remote command on many hosts from a single thread.
+
+Each host gets an SSH channel on the shared connection pool and one loop
+multiplexes the output of all of the channels, so running a command on
+thousands of hosts does not need a process or a thread per host. Only
+opening the SSH connections themselves, which paramiko does synchronously,
+is spread over a small number of threads.
+
+This is a separate API for commands, not a replacement for fabric's run,
+sudo, put and get: it has no file transfers, and tasks that call those
+operations still run on each host through execute(). It is used by
+server status, which gathers the facts of every host this way, the node
+lookup of server rolling-restart, the relay of files between nodes, and
+configuration deploy, which reads and writes the configuration of every
+host this way, see remote_batch.run_batches(). connector add is still a
+task that runs on each host, because it is also run on each host by
+server install and upgrade.
+"""
+import logging
+import threading
+import time
+from Queue import Queue, Empty
+
+from fabric import state
+from fabric.exceptions import CommandTimeout
+from fabric.network import ssh, normalize_to_string
+from fabric.operations import _AttributeString, _shell_wrap, _sudo_prefix, \
+    _prefix_commands, _prefix_env_vars
+
+from prestoadmin.util import tracing
+
+_LOGGER = logging.getLogger(__name__)
+
+CONNECT_CONCURRENCY = 20
+RECV_BUFFER_SIZE = 32768
+
+
+def connect_all(hosts):
+    """
+    Make sure there is a pooled connection to every host, opening up to
+    CONNECT_CONCURRENCY new connections at a time.
+
+    Returns:
+        dict of host to the exception raised while connecting, for the hosts
+        that could not be connected to.
+    """
+    pending = Queue()
+    for host in hosts:
+        pending.put(host)
+    errors = {}
+
+    def connect():
+        while True:
+            try:
+                host = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                state.connections[host]
+            except BaseException, e:
+                _LOGGER.error('Unable to connect to %s: %s' % (host, e))
+                errors[host] = e
+
+    threads = [threading.Thread(target=connect) for i in
+               range(min(CONNECT_CONCURRENCY, len(hosts)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class RemoteCommand(object):
+    """
+    A command running on one host, read from without ever blocking.
+    """
+
+    def __init__(self, host, command, use_sudo=False, pty=None):
+        self.host = host
+        self.command = command
+        self.use_pty = state.env.always_use_pty if pty is None else pty
+        sudo_prefix = _sudo_prefix(None) if use_sudo else None
+        self.real_command = _shell_wrap(
+            _prefix_commands(_prefix_env_vars(command), 'remote'),
+            state.env.get('shell_escape', True), sudo_prefix=sudo_prefix)
+        self.password = None
+        if use_sudo:
+            host_string = normalize_to_string(host)
+            self.password = state.env.passwords.get(host_string,
+                                                    state.env.password)
+        self.prompt_answered = False
+        self.stdout = []
+        self.stderr = []
+        self.channel = None
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        transport = state.connections[self.host].get_transport()
+        self.channel = transport.open_session()
+        if self.use_pty:
+            self.channel.get_pty()
+        self.channel.exec_command(self.real_command)
+
+    def poll(self):
+        """
+        Read whatever output is available.
+
+        Returns:
+            True once the command has exited and all output has been read
+        """
+        while self.channel.recv_ready():
+            self.stdout.append(self.channel.recv(RECV_BUFFER_SIZE))
+        while self.channel.recv_stderr_ready():
+            self.stderr.append(
+                self.channel.recv_stderr(RECV_BUFFER_SIZE))
+        self._answer_sudo_prompt()
+        return self.channel.exit_status_ready() and not \
+            self.channel.recv_ready() and not \
+            self.channel.recv_stderr_ready()
+
+    def _answer_sudo_prompt(self):
+        if self.prompt_answered:
+            return
+        prompt = state.env.sudo_prompt
+        for output in [self.stdout, self.stderr]:
+            if ''.join(output).endswith(prompt):
+                self.prompt_answered = True
+                if self.password is None:
+                    # Never hang waiting on a password that we don't have
+                    self.channel.shutdown_write()
+                else:
+                    self.channel.sendall(self.password + '\n')
+                return
+
+    def close(self):
+        if self.channel is not None:
+            self.channel.close()
+
+    def trace(self, result):
+        """
+        Record the command in the timing trace, with its exit code if it ran
+        to completion.
+        """
+        if not tracing.enabled() or self.start_time is None:
+            return
+        fields = {'host': self.host, 'command': self.command}
+        if isinstance(result, Exception):
+            fields['error'] = str(result)
+        else:
+            fields['exit_code'] = result.return_code
+            fields['bytes'] = len(result) + len(result.stderr)
+        tracing.record(tracing.COMMAND, self.start_time,
+                       time.time() - self.start_time, **fields)
+
+    def result(self):
+        prompt = state.env.sudo_prompt
+        stdout = ''.join(self.stdout).replace('\r\n', '\n')
+        stderr = ''.join(self.stderr).replace('\r\n', '\n')
+        if self.prompt_answered:
+            stdout = stdout.replace(prompt, '', 1)
+            stderr = stderr.replace(prompt, '', 1)
+        out = _AttributeString(stdout.strip())
+        out.stderr = stderr.strip()
+        out.command = self.command
+        out.real_command = self.real_command
+        out.return_code = self.channel.recv_exit_status()
+        out.succeeded = out.return_code == 0
+        out.failed = not out.succeeded
+        _LOGGER.info('\n[' + self.host + ']\nCOMMAND: ' + out.command +
+                     '\nFULL COMMAND: ' + out.real_command + '\nSTDOUT: ' +
+                     out + '\nSTDERR: ' + out.stderr)
+        return out
+
+
+def run_on_hosts(command, hosts, use_sudo=False, timeout=None,
+                 on_result=None):
+    """
+    Run command on all of the hosts at the same time.
+
+    Parameters:
+        command - shell command to run
+        hosts - hosts to run it on
+        use_sudo - run the command with sudo
+        timeout - seconds to wait for all of the hosts to finish. Defaults
+                  to env.command_timeout.
+        on_result - optional callback, called with the host and its result
+                    as soon as the command is done on that host
+
+    Returns:
+        dict of host to the output of the command, with the same
+        attributes as the value returned by run() and sudo(), or to the
+        exception that prevented the command from completing on that host.
+    """
+    return run_commands(dict((host, command) for host in hosts), use_sudo,
+                        timeout, on_result, order=hosts)
+
+
+def run_commands(commands, use_sudo=False, timeout=None, on_result=None,
+                 order=None):
+    """
+    Run a command of its own on each host, all at the same time.
+
+    Parameters:
+        commands - dict of host to the shell command to run on it
+        order - the hosts in the order in which to start the commands.
+                Defaults to the sorted hosts.
+
+    The other parameters and the value returned are those of
+    run_on_hosts().
+    """
+    hosts = order if order is not None else sorted(commands)
+    results = {}
+
+    def finished(host, result):
+        results[host] = result
+        if on_result is not None:
+            on_result(host, result)
+
+    connect_errors = connect_all(hosts)
+    running = []
+    for host in hosts:
+        if host in connect_errors:
+            finished(host, connect_errors[host])
+            continue
+        remote_command = RemoteCommand(host, commands[host],
+                                       use_sudo=use_sudo)
+        try:
+            remote_command.start()
+        except Exception, e:
+            _LOGGER.error('Unable to run command on %s: %s' % (host, e))
+            finished(host, e)
+            continue
+        running.append(remote_command)
+
+    if timeout is None:
+        timeout = state.env.command_timeout
+    deadline = time.time() + timeout if timeout else None
+
+    while running:
+        still_running = []
+        for remote_command in running:
+            try:
+                done = remote_command.poll()
+                result = remote_command.result() if done else None
+            except Exception, e:
+                _LOGGER.error('Lost connection to %s: %s' %
+                              (remote_command.host, e))
+                done = True
+                result = e
+            if done:
+                remote_command.close()
+                remote_command.trace(result)
+                finished(remote_command.host, result)
+            else:
+                still_running.append(remote_command)
+        running = still_running
+        if running and deadline is not None and time.time() > deadline:
+            for remote_command in running:
+                remote_command.close()
+                remote_command.trace(CommandTimeout(timeout))
+                finished(remote_command.host, CommandTimeout(timeout))
+            break
+        if running:
+            time.sleep(ssh.io_sleep)
+    return results
@@ -15,12 +15,21 @@
 """ Filesystem tools."""
 
 import errno
+import hashlib
 import logging
 import os
 
 
 logger = logging.getLogger(__name__)
 
+# Size of the chunks whose digests are remembered along with the digest of
+# the whole file, so that an interrupted upload can be resumed from the
+# last good chunk, see prestoadmin.util.transfer
+CHUNK_SIZE = 8 * 1024 * 1024
+# Digests of the local files, keyed by (path, size, modification time,
+# chunk size)
+_digests = {}
+
 
 def ensure_parent_directories_exist(path):
     try:
@@ -59,3 +68,34 @@ def write_to_file_if_not_exists(content, path):
     else:
         with os.fdopen(file_handle, 'w') as f:
             f.write(content)
+
+
+def sha256(path):
+    """
+    Hex SHA-256 digest of the file at path. Digests are remembered for as
+    long as the file keeps the same size and modification time, so that a
+    large package is only read once per run. Computing it before tasks are
+    forked leaves it cached for all of them.
+    """
+    return chunk_digests(path)[1]
+
+
+def chunk_digests(path, chunk_size=CHUNK_SIZE):
+    """
+    Returns:
+        the hex SHA-256 digests of the chunk_size chunks of the file at
+        path, and the hex SHA-256 digest of the whole file, remembered like
+        sha256()
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime, chunk_size)
+    if key not in _digests:
+        chunks = []
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(chunk_size), ''):
+                chunks.append(hashlib.sha256(data).hexdigest())
+                digest.update(data)
+        _digests[key] = (chunks, digest.hexdigest())
+    return _digests[key]
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Job queues for parallel execution that report each host's result as soon as
+it is available, whose concurrency can adapt to how the hosts and the node
+running presto-admin are coping, and that stop waiting for hosts that take
+longer than a deadline.
+"""
+import logging
+import time
+from Queue import Empty
+
+from fabric.context_managers import settings
+from fabric.job_queue import JobQueue
+from fabric.network import ssh
+
+from prestoadmin.util.exception import TaskTimeoutError
+
+_LOGGER = logging.getLogger(__name__)
+
+# Number of hosts a task starts out running on at the same time
+INITIAL_POOL_SIZE = 16
+# Completed hosts whose run time is taken as the normal run time of the task
+BASELINE_SAMPLES = 5
+# A host taking this many times longer than normal is a sign of overload
+LATENCY_FACTOR = 3
+# Recent outcomes considered when computing the failure rate
+FAILURE_WINDOW = 10
+MIN_FAILURE_SAMPLES = 5
+MAX_FAILURE_RATE = 0.2
+# Seconds to wait for a worker to exit after it has been told to stop
+KILL_WAIT = 5
+
+# What to do once a host has timed out: fail the command, or carry on with
+# the results of the other hosts
+FAIL_ON_TIMEOUT = 'fail'
+CONTINUE_ON_TIMEOUT = 'continue'
+TIMEOUT_POLICIES = [FAIL_ON_TIMEOUT, CONTINUE_ON_TIMEOUT]
+
+
+def _median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) / 2]
+
+
+class PoolSizeController(object):
+    """
+    Additive increase, multiplicative decrease control of the number of
+    hosts that a task runs on concurrently.
+
+    The pool starts at INITIAL_POOL_SIZE and grows by one for every host
+    that completes successfully in a normal amount of time, doubling each
+    round, until the first sign of overload. After that it grows by about
+    one per round. When hosts take LATENCY_FACTOR times longer than the
+    first few hosts did, or more than MAX_FAILURE_RATE of the recent hosts
+    failed, the pool is halved. The pool never exceeds max_pool_size.
+    """
+
+    def __init__(self, max_pool_size, initial_pool_size=INITIAL_POOL_SIZE):
+        self.max_pool_size = max(1, max_pool_size)
+        self._window = float(min(initial_pool_size, self.max_pool_size))
+        self._slow_start_threshold = float(self.max_pool_size)
+        self._durations = []
+        self._outcomes = []
+        self._completed_since_decrease = 0
+
+    @property
+    def pool_size(self):
+        return max(1, int(self._window))
+
+    def baseline_latency(self):
+        if len(self._durations) < BASELINE_SAMPLES:
+            return None
+        return _median(self._durations[:BASELINE_SAMPLES])
+
+    def failure_rate(self):
+        if len(self._outcomes) < MIN_FAILURE_SAMPLES:
+            return 0.0
+        return self._outcomes.count(False) / float(len(self._outcomes))
+
+    def record(self, duration, succeeded):
+        """
+        Adjust the pool size after a host finished in duration seconds
+        """
+        self._durations.append(duration)
+        self._outcomes = (self._outcomes + [succeeded])[-FAILURE_WINDOW:]
+        self._completed_since_decrease += 1
+
+        if self._is_overloaded(duration):
+            # Only back off once per round of hosts, so that the hosts that
+            # were already running when the overload started don't shrink
+            # the pool over and over.
+            if self._completed_since_decrease >= self.pool_size:
+                self._decrease()
+        elif not succeeded:
+            return
+        elif self._window < self._slow_start_threshold:
+            self._window += 1
+        else:
+            self._window += 1 / self._window
+        self._window = min(self._window, float(self.max_pool_size))
+
+    def _is_overloaded(self, duration):
+        if self.failure_rate() > MAX_FAILURE_RATE:
+            return True
+        baseline = self.baseline_latency()
+        return baseline is not None and duration > baseline * LATENCY_FACTOR
+
+    def _decrease(self):
+        self._window = max(1.0, self._window / 2)
+        self._slow_start_threshold = self._window
+        self._completed_since_decrease = 0
+        _LOGGER.debug('Reducing parallel pool size to %d' % self.pool_size)
+
+
+class StreamingJobQueue(JobQueue):
+    """
+    Fabric JobQueue that hands each job's result to a callback as soon as
+    the job finishes, rather than only returning all of the results once
+    every job is done.
+
+    on_result is called in the parent process with the name of the job (the
+    host) and the value it returned, or the exception it raised.
+
+    If timeout is set, a job that is still running timeout seconds after it
+    started is killed, and its result is a TaskTimeoutError.
+    """
+
+    def __init__(self, max_running, comms_queue, on_result=None,
+                 timeout=None):
+        super(StreamingJobQueue, self).__init__(max_running, comms_queue)
+        self._on_result = on_result
+        self._timeout = timeout
+        self._start_times = {}
+        self._timed_out = set()
+
+    def _pool_size(self):
+        return self._max
+
+    def _advance_the_queue(self):
+        job = self._queued.pop()
+        with settings(clean_revert=True, host_string=job.name,
+                      host=job.name):
+            job.start()
+        self._start_times[job.name] = time.time()
+        self._running.append(job)
+
+    def _job_finished(self, job, results):
+        if self._on_result is not None:
+            self._on_result(job.name, results[job.name]['results'])
+
+    def _is_overdue(self, job):
+        return self._timeout and \
+            time.time() - self._start_times[job.name] > self._timeout
+
+    def _kill(self, job, results):
+        _LOGGER.error('Task on %s did not finish within %s seconds; '
+                      'stopping it' % (job.name, self._timeout))
+        self._timed_out.add(job.name)
+        job.terminate()
+        job.join(KILL_WAIT)
+        results[job.name]['exit_code'] = 1
+        results[job.name]['results'] = TaskTimeoutError(self._timeout)
+
+    def _fill_results(self, results):
+        while True:
+            try:
+                datum = self._comms_queue.get_nowait()
+            except Empty:
+                break
+            # Whatever a killed job managed to send back is ignored; its
+            # result is the timeout.
+            if datum['name'] not in self._timed_out:
+                results[datum['name']]['results'] = datum['result']
+
+    def run(self):
+        """
+        Run all of the queued jobs, keeping at most _pool_size() running at
+        a time, and return their results in the same format as
+        JobQueue.run().
+        """
+        results = {}
+        for job in self._queued:
+            results[job.name] = dict.fromkeys(('exit_code', 'results'))
+
+        if not self._closed:
+            raise Exception("Need to close() before starting.")
+
+        while not self._finished:
+            while self._queued and len(self._running) < self._pool_size():
+                self._advance_the_queue()
+
+            for job in self._running[:]:
+                if not job.is_alive():
+                    job.join()
+                    self._running.remove(job)
+                    self._completed.append(job)
+                    results[job.name]['exit_code'] = job.exitcode
+                    self._fill_results(results)
+                    self._job_finished(job, results)
+                elif self._is_overdue(job):
+                    self._running.remove(job)
+                    self._completed.append(job)
+                    self._kill(job, results)
+                    self._job_finished(job, results)
+
+            if not (self._queued or self._running):
+                self._finished = True
+
+            self._fill_results(results)
+            time.sleep(ssh.io_sleep)
+
+        self._fill_results(results)
+
+        for job in self._completed:
+            if job.name not in self._timed_out:
+                results[job.name]['exit_code'] = job.exitcode
+
+        return results
+
+
+class AdaptiveJobQueue(StreamingJobQueue):
+    """
+    StreamingJobQueue that sizes its running window with a
+    PoolSizeController instead of keeping it fixed.
+    """
+
+    def __init__(self, max_running, comms_queue, on_result=None,
+                 controller=None, timeout=None):
+        super(AdaptiveJobQueue, self).__init__(max_running, comms_queue,
+                                               on_result, timeout)
+        if controller is None:
+            controller = PoolSizeController(max_running)
+        self._controller = controller
+
+    def _pool_size(self):
+        return self._controller.pool_size
+
+    def _job_finished(self, job, results):
+        duration = time.time() - self._start_times[job.name]
+        succeeded = job.exitcode == 0 and job.name not in self._timed_out
+        self._controller.record(duration, succeeded)
+        super(AdaptiveJobQueue, self)._job_finished(job, results)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pull-based distribution of files over HTTP.
+
+With env.pull set, the node running presto-admin serves the file being
+deployed from a short-lived HTTP server for as long as the deployment
+runs, and every host downloads it with curl, or wget if curl is missing,
+instead of being sent it over SFTP. The download goes to a partial file
+that is resumed with a range request if the connection drops, and is only
+renamed into place once its SHA-256 digest matches.
+
+Each file is served under a random path, and nothing else is served. The
+hosts reach the server through the address of the node running
+presto-admin on their SSH connection, unless env.pull_address is set.
+"""
+import BaseHTTPServer
+import SocketServer
+import logging
+import os
+import posixpath
+import re
+import socket
+import threading
+import time
+import urllib
+from contextlib import contextmanager
+
+from fabric import state
+from fabric.api import sudo, run
+
+from prestoadmin.util import bandwidth
+from prestoadmin.util.filesystem import sha256
+from prestoadmin.util.remote_batch import quote
+
+_LOGGER = logging.getLogger(__name__)
+
+BLOCK_SIZE = 64 * 1024
+
+# Number of times a host retries a download that failed or didn't match
+# the digest
+FETCH_ATTEMPTS = 3
+
+# Seconds a host waits for data from the server before retrying
+FETCH_TIMEOUT = 60
+
+# The files being served, by local path: (url path, SHA-256 digest)
+_served = {}
+
+_server = None
+
+# Topology host names by address, so that a download is throttled under
+# the name the host has in bandwidth_groups
+_hosts_by_address = {}
+
+
+def enabled():
+    return bool(state.env.get('pull'))
+
+
+@contextmanager
+def serving(local_path):
+    """
+    Serve local_path for the hosts to fetch() while the body of the with
+    statement runs. Does nothing unless pull mode is on.
+    """
+    if not enabled():
+        yield
+        return
+    local_path = os.path.abspath(local_path)
+    token = os.urandom(16).encode('hex')
+    url_path = '/%s/%s' % (token, urllib.quote(os.path.basename(local_path)))
+    _served[local_path] = (url_path, sha256(local_path))
+    server = _start()
+    try:
+        yield
+    finally:
+        del _served[local_path]
+        if not _served:
+            _stop(server)
+
+
+def is_served(local_path):
+    return os.path.abspath(local_path) in _served
+
+
+def fetch(local_path, remote_path, use_sudo=False):
+    """
+    Have the current host download local_path from the server into
+    remote_path.
+
+    Returns:
+        True if the file is in place and its digest matches
+    """
+    url_path, digest = _served[os.path.abspath(local_path)]
+    url = 'http://%s:%d%s' % (_address(), _server.server_address[1],
+                              url_path)
+    partial = '%s.%s.part' % (remote_path, digest[:16])
+    values = {'url': quote(url), 'partial': quote(partial),
+              'path': quote(remote_path), 'digest': digest,
+              'dir': quote(posixpath.dirname(remote_path)),
+              'attempts': FETCH_ATTEMPTS, 'timeout': FETCH_TIMEOUT}
+    # curl -C - and wget -c resume the partial file with a range request.
+    # A partial file that doesn't match the digest once complete is
+    # removed, and the next attempt starts over.
+    script = ('mkdir -p %(dir)s && for attempt in $(seq %(attempts)d); do '
+              'if command -v curl >/dev/null; then '
+              'curl -fsS --speed-time %(timeout)d --speed-limit 1 -C - '
+              '-o %(partial)s %(url)s; '
+              'else wget -q -T %(timeout)d -c -O %(partial)s %(url)s; fi; '
+              'if echo "%(digest)s  "%(partial)s | sha256sum -c --status; '
+              'then mv -f %(partial)s %(path)s && exit 0; fi; '
+              'test -f %(partial)s && [ $(stat -c %%s %(partial)s) -ge '
+              '%(size)d ] && rm -f %(partial)s; done; exit 1' %
+              dict(values, size=os.path.getsize(local_path)))
+    start_time = time.time()
+    if use_sudo:
+        result = sudo(script, quiet=True)
+    else:
+        result = run(script, quiet=True)
+    if result.succeeded:
+        bandwidth.report(os.path.basename(local_path),
+                         os.path.getsize(local_path),
+                         time.time() - start_time)
+    else:
+        _LOGGER.error('Fetching %s from %s failed: %s' %
+                      (local_path, url, result))
+    return result.succeeded
+
+
+def _address():
+    """
+    The address the current host connects to this node from
+    """
+    if state.env.get('pull_address'):
+        return state.env.pull_address
+    transport = state.connections[state.env.host_string].get_transport()
+    return transport.sock.getsockname()[0]
+
+
+def _start():
+    global _server
+    if _server is None:
+        port = int(state.env.get('pull_port') or 0)
+        _hosts_by_address.clear()
+        _hosts_by_address.update(_resolve_hosts())
+        _server = _ThreadingHTTPServer(('', port), _Handler)
+        thread = threading.Thread(target=_server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        _LOGGER.info('Serving files on port %d' % _server.server_address[1])
+    return _server
+
+
+def _resolve_hosts():
+    """
+    Map the address of every host in the topology and in bandwidth_groups
+    to its host name. Hosts that don't resolve are left out, and downloads
+    to them are throttled by address.
+    """
+    hosts = list(state.env.get('hosts') or [])
+    for group in (state.env.get('bandwidth_groups') or {}).values():
+        hosts.extend(group['hosts'])
+    hosts_by_address = {}
+    for host in hosts:
+        try:
+            address = socket.gethostbyname(host)
+        except socket.error:
+            _LOGGER.debug('Could not resolve %s' % host)
+            continue
+        hosts_by_address.setdefault(address, host)
+    return hosts_by_address
+
+
+def _stop(server):
+    global _server
+    server.shutdown()
+    server.server_close()
+    if _server is server:
+        _server = None
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the files in _served, with support for a single byte range
+    """
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        local_path = self._local_path()
+        if local_path is None:
+            self.send_error(404)
+            return
+        size = os.path.getsize(local_path)
+        start, end = 0, size - 1
+        status = 200
+        match = re.match(r'bytes=(\d*)-(\d*)$',
+                         self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % size)
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, end, size))
+        self.end_headers()
+        if send_body:
+            with open(local_path, 'rb') as f:
+                f.seek(start)
+                self._copy(f, end - start + 1)
+
+    def _copy(self, source, length):
+        while length > 0:
+            data = source.read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            address = self.client_address[0]
+            bandwidth.throttle(len(data),
+                               _hosts_by_address.get(address, address))
+            self.wfile.write(data)
+            length -= len(data)
+
+    def _local_path(self):
+        for local_path, (url_path, digest) in _served.items():
+            if self.path == url_path:
+                return local_path
+        return None
+
+    def log_message(self, format, *args):
+        _LOGGER.debug('%s %s' % (self.client_address[0], format % args))
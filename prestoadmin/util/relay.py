@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Distribution of a file to many hosts through a tree of relay hosts.
+
+With env.relay_fanout set to K, the node running presto-admin uploads the
+file to the first K hosts only. Every host that has the file then sends it
+on to its K children in the tree, so the file reaches all N hosts in about
+log_K(N) rounds instead of being uploaded N times over the same network
+interface.
+
+The hosts do not need to be able to log in to each other: presto-admin
+starts a receiver on the child and a sender on the parent over its own SSH
+connections, and the two talk over a plain TCP connection. The receiver
+listens only on the address that the parent connects to, accepts only a
+connection that starts with a random token generated for that transfer,
+and only keeps the file if its size and SHA-256 checksum match the
+original.
+
+Hosts that did not get the file through the tree, because a relay or the
+transfer to them failed, are left for the caller to upload to directly.
+
+The uploads from presto-admin to the first hosts of the tree stay within
+the bandwidth limits, like any other upload, but the transfers between the
+hosts are not limited: they don't go through the network interface of the
+node running presto-admin.
+"""
+import binascii
+import logging
+import os
+import re
+import socket
+import threading
+import time
+
+from fabric import state
+from fabric.api import hide, settings, sudo
+from fabric.network import parse_host_string, ssh
+
+from prestoadmin.util import threadpool
+from prestoadmin.util.fanout import RemoteCommand, connect_all
+from prestoadmin.util.filesystem import sha256
+from prestoadmin.util.remote_batch import quote
+from prestoadmin.util.transfer import put_resumable
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds a receiver or a sender waits for the other end before giving up
+RELAY_TIMEOUT = 600
+
+PYTHON = '"$(command -v python || command -v python3)"'
+
+RECEIVE_SCRIPT = """
+import hashlib, os, socket, sys
+path, checksum, timeout = sys.argv[1], sys.argv[2], int(sys.argv[3])
+address, token, size = sys.argv[4], sys.argv[5], int(sys.argv[6])
+if not os.path.isdir(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+server.settimeout(timeout)
+server.bind((address, 0))
+server.listen(1)
+sys.stdout.write('port=%d\\n' % server.getsockname()[1])
+sys.stdout.flush()
+while True:
+    connection = server.accept()[0]
+    connection.settimeout(timeout)
+    received = b''
+    while len(received) < len(token):
+        data = connection.recv(len(token) - len(received))
+        if not data:
+            break
+        received += data
+    if received == token.encode('ascii'):
+        break
+    connection.close()
+digest = hashlib.sha256()
+temp_path = path + '.relay'
+out = open(temp_path, 'wb')
+written = 0
+while True:
+    data = connection.recv(65536)
+    if not data:
+        break
+    written += len(data)
+    if written > size:
+        break
+    out.write(data)
+    digest.update(data)
+out.close()
+if written != size or digest.hexdigest() != checksum:
+    os.remove(temp_path)
+    sys.exit('checksum mismatch')
+os.rename(temp_path, path)
+"""
+
+SEND_SCRIPT = """
+import socket, sys
+address, port, path = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+timeout, token = int(sys.argv[4]), sys.argv[5]
+connection = socket.create_connection((address, port), timeout)
+connection.sendall(token.encode('ascii'))
+source = open(path, 'rb')
+while True:
+    data = source.read(65536)
+    if not data:
+        break
+    connection.sendall(data)
+connection.close()
+"""
+
+
+def enabled(hosts):
+    fanout = state.env.get('relay_fanout')
+    return bool(fanout) and len(hosts) > fanout
+
+
+def children(index, count, fanout):
+    """
+    Indexes of the children of the host at index in a fanout-ary tree over
+    count hosts. The node running presto-admin is the root, with index -1.
+    """
+    first = (index + 1) * fanout
+    return range(first, min(first + fanout, count))
+
+
+def distribute(local_path, remote_dir, hosts):
+    """
+    Copy local_path into remote_dir on the hosts through the relay tree.
+    Does nothing unless relay mode is enabled and there are more hosts than
+    the fanout. The hosts that got the file are recorded in env, see
+    is_staged().
+
+    Returns:
+        set of the hosts that got the file
+    """
+    if not enabled(hosts):
+        return set()
+    fanout = state.env.relay_fanout
+    remote_path = os.path.join(remote_dir, os.path.basename(local_path))
+    checksum = sha256(local_path)
+    print('Distributing %s to %d hosts through relays' %
+          (os.path.basename(local_path), len(hosts)))
+
+    # Open the connections up front, CONNECT_CONCURRENCY at a time. A host
+    # that can't be reached simply doesn't get the file, and neither does
+    # its subtree.
+    connect_all(hosts)
+    staged = set(hosts[i] for i in _upload(
+        local_path, remote_dir, hosts, children(-1, len(hosts), fanout)))
+    frontier = [i for i in children(-1, len(hosts), fanout)
+                if hosts[i] in staged]
+    while frontier:
+        edges = [(hosts[parent], hosts[child]) for parent in frontier
+                 for child in children(parent, len(hosts), fanout)]
+        if not edges:
+            break
+        received = _relay(edges, remote_path, checksum,
+                          os.path.getsize(local_path))
+        staged.update(received)
+        frontier = [child for parent in frontier
+                    for child in children(parent, len(hosts), fanout)
+                    if hosts[child] in received]
+
+    missed = [host for host in hosts if host not in staged]
+    if missed:
+        _LOGGER.warn('Relay did not reach %s; uploading directly' %
+                     ', '.join(missed))
+    state.env.setdefault('relayed_files', {})[remote_path] = staged
+    return staged
+
+
+def is_staged(local_path, remote_dir):
+    """
+    Returns:
+        True if the file at local_path was already put into remote_dir on
+        the current host by distribute()
+    """
+    remote_path = os.path.join(remote_dir, os.path.basename(local_path))
+    relayed_files = state.env.get('relayed_files') or {}
+    return state.env.host_string in relayed_files.get(remote_path, ())
+
+
+def _upload(local_path, remote_dir, hosts, indexes):
+    """
+    Upload the file from this node to the first hosts of the tree, all at
+    the same time, within the bandwidth limits.
+
+    Returns:
+        indexes of the hosts the file was uploaded to
+    """
+    succeeded = []
+    remote_path = os.path.join(remote_dir, os.path.basename(local_path))
+    parent_state = threadpool.copy_state()
+
+    def upload(index):
+        with threadpool.own_state(parent_state), \
+                settings(hide('everything'), host_string=hosts[index],
+                         host=hosts[index], warn_only=True):
+            if sudo('mkdir -p ' + remote_dir).succeeded and \
+                    put_resumable(local_path, remote_path, use_sudo=True):
+                succeeded.append(index)
+
+    # Each upload runs under the settings of its own host
+    with threadpool.thread_local_state():
+        threads = [threading.Thread(target=upload, args=(index,))
+                   for index in indexes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return sorted(succeeded)
+
+
+def _relay(edges, remote_path, checksum, size):
+    """
+    Send the file from each parent to its child, for all of the edges at
+    the same time.
+
+    Returns:
+        set of the children that received the file
+    """
+    transfers = []
+    for parent, child in edges:
+        address = _address(child)
+        token = binascii.hexlify(os.urandom(16))
+        receive = '%s -c %s %s %s %d %s %s %d' % (
+            PYTHON, quote(RECEIVE_SCRIPT), quote(remote_path), checksum,
+            RELAY_TIMEOUT, quote(address), token, size)
+        receiver = RemoteCommand(child, receive, use_sudo=True)
+        try:
+            receiver.start()
+        except Exception, e:
+            _LOGGER.error('Unable to relay to %s: %s' % (child, e))
+            continue
+        transfers.append(_Transfer(parent, child, receiver, address, token))
+
+    received = set()
+    while transfers:
+        running = []
+        for transfer in transfers:
+            try:
+                done = transfer.poll(remote_path)
+            except Exception, e:
+                _LOGGER.error('Relay from %s to %s failed: %s' %
+                              (transfer.parent, transfer.child, e))
+                transfer.close()
+                continue
+            if not done:
+                running.append(transfer)
+            elif transfer.succeeded():
+                received.add(transfer.child)
+        transfers = running
+        if transfers:
+            time.sleep(ssh.io_sleep)
+    return received
+
+
+def _address(host):
+    """
+    The address that the receiver on host listens on and that the sender
+    connects to, resolved here so that both ends agree on it
+    """
+    name = parse_host_string(host)['host']
+    try:
+        return socket.gethostbyname(name)
+    except socket.error:
+        return name
+
+
+class _Transfer(object):
+    """
+    The receiver running on a child, and the sender on its parent that is
+    started once the receiver has reported the port it listens on.
+    """
+
+    def __init__(self, parent, child, receiver, address, token):
+        self.parent = parent
+        self.child = child
+        self.receiver = receiver
+        self.address = address
+        self.token = token
+        self.sender = None
+        self.sent = False
+        self.result = None
+
+    def poll(self, remote_path):
+        """
+        Returns:
+            True once the transfer is over, successfully or not
+        """
+        receiver_done = self.receiver.poll()
+        if self.sender is None and not receiver_done:
+            match = re.search(r'port=(\d+)', ''.join(self.receiver.stdout))
+            if match:
+                self._start_sender(int(match.group(1)), remote_path)
+        if self.sender is not None and not self.sent and \
+                self.sender.poll():
+            sent = self.sender.result()
+            self.sender.trace(sent)
+            self.sender.close()
+            self.sent = True
+            if sent.failed:
+                _LOGGER.error('Sending from %s to %s failed: %s' %
+                              (self.parent, self.child, sent))
+                # Don't leave the receiver waiting for a connection
+                self.receiver.close()
+                self.result = sent
+                return True
+        if receiver_done:
+            self.result = self.receiver.result()
+            self.receiver.trace(self.result)
+            self.close()
+        return receiver_done
+
+    def _start_sender(self, port, remote_path):
+        send = '%s -c %s %s %d %s %d %s' % (PYTHON, quote(SEND_SCRIPT),
+                                            quote(self.address), port,
+                                            quote(remote_path), RELAY_TIMEOUT,
+                                            self.token)
+        self.sender = RemoteCommand(self.parent, send, use_sudo=True)
+        self.sender.start()
+
+    def succeeded(self):
+        if self.result is None or self.result.failed:
+            _LOGGER.error('Relay from %s to %s failed: %s' %
+                          (self.parent, self.child, self.result))
+            return False
+        return True
+
+    def close(self):
+        self.receiver.close()
+        if self.sender is not None and not self.sent:
+            self.sender.close()
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Batching of remote commands, so that a sequence of operations on a host is
+sent as a single shell script instead of one SSH round trip per command.
+
+    batch = RemoteBatch()
+    batch.add('mkdir -p /etc/presto')
+    batch.write_file('/etc/presto/jvm.config', content)
+    results = batch.run(use_sudo=True)
+
+Each step's output and exit code are reported separately, with the same
+attributes as the value returned by run() and sudo().
+
+run_batches() runs a batch of its own on each of many hosts at the same
+time, see prestoadmin.util.fanout.
+"""
+import logging
+import sys
+import uuid
+
+from fabric import state
+from fabric.api import run, sudo
+from fabric.context_managers import settings
+from fabric.operations import _AttributeString
+from fabric.utils import error
+
+from prestoadmin.util import fanout
+
+_LOGGER = logging.getLogger(__name__)
+
+# Stay well below the kernel's limit on the length of a single argument,
+# since the whole script is passed to the remote shell as one.
+MAX_SCRIPT_SIZE = 65536
+
+
+def quote(text):
+    """
+    Quote text so that the remote shell treats it as a single word
+    """
+    # replace a single quote with a (closing) single quote followed by
+    # an escaped quote followed by an (opening) single quote
+    return "'" + text.replace("'", "'\\''") + "'"
+
+
+class Step(object):
+    def __init__(self, command, show_output, warn_only):
+        self.command = command
+        self.show_output = show_output
+        self.warn_only = warn_only
+
+
+class RemoteBatch(object):
+    """
+    A list of shell commands to run on the current host in one round trip.
+
+    By default the batch stops at the first command that fails and the
+    failure is reported the same way a failing run() or sudo() is: the task
+    aborts, or warns if env.warn_only is set. Commands added with
+    warn_only=True never stop the batch. Only the output of commands added
+    with show_output=True is printed; the output of every command is always
+    available in the results.
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.marker = '__presto_admin_step_' + uuid.uuid4().hex
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, command, show_output=False, warn_only=False):
+        """
+        Add a command to the batch.
+
+        Returns:
+            the index of the command's result in the list returned by run()
+        """
+        self.steps.append(Step(command, show_output, warn_only))
+        return len(self.steps) - 1
+
+    def write_file(self, path, content):
+        """
+        Add a command that replaces the contents of path with content
+        """
+        return self.add('printf %%s %s > %s' % (quote(content), path))
+
+    def append_lines(self, path, content):
+        """
+        Add a command that appends each line of content to path, unless the
+        file already contains that exact line.
+        """
+        commands = ['grep -q -s -x -F -e %(line)s %(path)s || '
+                    'echo %(line)s >> %(path)s' % {'line': quote(line),
+                                                   'path': path}
+                    for line in content.splitlines()]
+        return self.add('; '.join(commands) or 'true')
+
+    def commands(self):
+        return [step.command for step in self.steps]
+
+    def run(self, use_sudo=False):
+        """
+        Run the commands on the current host.
+
+        Returns:
+            list with the result of each command, in the order in which they
+            were added. Commands that were not run because an earlier one
+            failed have a result of None.
+        """
+        results = []
+        for steps in self._scripts():
+            start = len(results)
+            results += self._run_script(steps, start, use_sudo)
+            failed = [result for step, result in
+                      zip(steps, results[start:])
+                      if result is None or
+                      (result.failed and not step.warn_only)]
+            if failed:
+                results += [None] * (len(self.steps) - len(results))
+                break
+
+        for step, result in zip(self.steps, results):
+            if result is not None and result.failed and not step.warn_only:
+                function = 'sudo' if use_sudo else 'run'
+                error('%s() received nonzero return code %s while executing!'
+                      '\n\nRequested: %s' %
+                      (function, result.return_code, step.command),
+                      stdout=result)
+                break
+        return results
+
+    def _scripts(self):
+        """
+        Split the steps into scripts that are each short enough to be sent
+        as one command.
+        """
+        scripts = [[]]
+        size = 0
+        for step in self.steps:
+            length = len(step.command) + 2 * len(self.marker) + 64
+            if scripts[-1] and size + length > MAX_SCRIPT_SIZE:
+                scripts.append([])
+                size = 0
+            scripts[-1].append(step)
+            size += length
+        return [steps for steps in scripts if steps]
+
+    def _script(self, steps, start):
+        lines = []
+        for index, step in enumerate(steps, start):
+            lines.append('echo %s:%d:begin' % (self.marker, index))
+            lines.append('(%s) 2>&1' % step.command)
+            lines.append('rc=$?; echo; echo %s:%d:end:$rc' %
+                         (self.marker, index))
+            if not step.warn_only:
+                lines.append('[ $rc -eq 0 ] || exit $rc')
+        return '\n'.join(lines)
+
+    def _run_script(self, steps, start, use_sudo):
+        script = self._script(steps, start)
+        stream = _StepOutputFilter(self.marker, self.steps, sys.stdout)
+        operation = sudo if use_sudo else run
+        with settings(warn_only=True):
+            out = operation(script, stdout=stream)
+        stream.close()
+        return self._results(out, steps, start)
+
+    def _results(self, out, steps, start):
+        results = self._parse(out, start, len(steps))
+        if results[0] is None:
+            # The script never got to run the first command, e.g. because
+            # sudo failed. Report that as the failure of the first command.
+            result = _AttributeString(out)
+            result.command = steps[0].command
+            result.return_code = out.return_code
+            result.succeeded = False
+            result.failed = True
+            results[0] = result
+        return results
+
+    def _parse(self, out, start, count):
+        results = [None] * count
+        index = None
+        lines = []
+        for line in out.splitlines():
+            line = line.rstrip('\r')
+            if line.startswith(self.marker + ':'):
+                fields = line.split(':')
+                if fields[2] == 'begin':
+                    index = int(fields[1])
+                    lines = []
+                elif fields[2] == 'end' and index is not None:
+                    step = self.steps[index]
+                    result = _AttributeString('\n'.join(lines).strip())
+                    result.command = step.command
+                    result.return_code = int(fields[3])
+                    result.succeeded = result.return_code == 0
+                    result.failed = not result.succeeded
+                    results[index - start] = result
+                    index = None
+            elif index is not None:
+                lines.append(line)
+        return results
+
+
+def run_batches(batches, use_sudo=False):
+    """
+    Run a batch of its own on each host, all at the same time. The output
+    of the steps is not shown, and a step that fails stops its batch
+    without aborting.
+
+    Parameters:
+        batches - dict of host to the RemoteBatch to run on it
+
+    Returns:
+        dict of host to the list of the results of its batch, like the list
+        returned by RemoteBatch.run(), or to the exception that prevented
+        the batch from running on the host.
+    """
+    results = dict((host, []) for host in batches)
+    scripts = dict((host, batch._scripts()) for host, batch in
+                   batches.iteritems())
+    pending = [host for host in sorted(batches) if scripts[host]]
+    while pending:
+        commands = {}
+        for host in pending:
+            start = len(results[host])
+            steps = scripts[host][0]
+            commands[host] = batches[host]._script(steps, start)
+        outputs = fanout.run_commands(commands, use_sudo=use_sudo)
+        still_pending = []
+        for host in pending:
+            batch, steps = batches[host], scripts[host].pop(0)
+            out = outputs[host]
+            if isinstance(out, Exception):
+                results[host] = out
+                continue
+            start = len(results[host])
+            results[host] += batch._results(out, steps, start)
+            failed = [result for step, result in
+                      zip(steps, results[host][start:])
+                      if result is None or
+                      (result.failed and not step.warn_only)]
+            if failed:
+                results[host] += [None] * (len(batch.steps) -
+                                           len(results[host]))
+            elif scripts[host]:
+                still_pending.append(host)
+        pending = still_pending
+    return results
+
+
+class _StepOutputFilter(object):
+    """
+    Output stream given to run() and sudo() for a batch. It passes the
+    output of the steps that are meant to be shown, and anything printed
+    outside of the steps (like the sudo password prompt), through to the
+    real stream and drops the rest along with the step markers.
+    """
+
+    def __init__(self, marker, steps, stream):
+        self.marker = marker
+        self.steps = steps
+        self.stream = stream
+        self.buffer = ''
+        self.step = None
+        self.blank_line = None
+
+    def write(self, data):
+        self.buffer += data
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            self._line(line + '\n')
+        if self.step is None and self.buffer.endswith(
+                state.env.sudo_prompt):
+            # Show the prompt before the user gets asked for a password
+            self.stream.write(self.buffer)
+            self.buffer = ''
+
+    def _line(self, line):
+        if self.marker in line:
+            fields = line.strip().split(self.marker + ':', 1)[1].split(':')
+            self.step = self.steps[int(fields[0])] \
+                if fields[1] == 'begin' else None
+            # The blank line echoed just before an end marker is not part
+            # of the step's output
+            self.blank_line = None
+            return
+        if self.step is not None and not self.step.show_output:
+            return
+        if self.blank_line is not None:
+            self.stream.write(self.blank_line)
+            self.blank_line = None
+        if self.step is not None and not line.split(': ', 1)[-1].strip():
+            self.blank_line = line
+        else:
+            self.stream.write(line)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        if self.buffer and self.step is None:
+            self.stream.write(self.buffer)
+        self.buffer = ''
+        self.flush()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+SHA-256 digests of the files on the hosts, to tell which files differ from
+what is about to be written without copying them back.
+
+The digests of all of the files in a list of directories are gathered by a
+single command, which is added to a RemoteBatch along with any other steps
+that need to run in the same round trip:
+
+    batch = RemoteBatch()
+    listing = remote_digests.add_listing(batch, ['/etc/presto'])
+    results = batch.run(use_sudo=True)
+    digests = remote_digests.parse(results[listing])
+"""
+import hashlib
+import re
+from collections import namedtuple
+
+from prestoadmin.util.remote_batch import quote
+
+_DIGEST_LINE = re.compile(r'([0-9a-f]{64}) [ *](.+)$')
+
+# Printed by the command of add_write_if_changed() when it writes the file
+WRITTEN = 'written'
+
+# The names of the files that a deployment wrote, left alone because they
+# were already up to date, and found on a host without a local copy
+Summary = namedtuple('Summary', ['changed', 'unchanged', 'unmanaged'])
+
+
+def digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def listing_command(directories):
+    """
+    A command that prints the digest of every file directly under each of
+    the directories, in the format of sha256sum. Missing directories are
+    skipped.
+    """
+    return ('find -L %s -maxdepth 1 -type f -exec sha256sum {} + '
+            '2>/dev/null; true' % ' '.join(quote(d) for d in directories))
+
+
+def add_listing(batch, directories):
+    """
+    Returns:
+        the index of the listing's result in the results of the batch
+    """
+    return batch.add(listing_command(directories), warn_only=True)
+
+
+def add_write_if_changed(batch, path, content):
+    """
+    Add a command that replaces the contents of path with content, unless
+    the digest of the file on the host already matches. The command prints
+    WRITTEN if it wrote the file.
+
+    Returns:
+        the index of the command's result in the results of the batch
+    """
+    check = quote('%s  %s' % (digest(content), path))
+    return batch.add('echo %s | sha256sum -c --status 2>/dev/null || '
+                     '{ printf %%s %s > %s && echo %s; }' %
+                     (check, quote(content), path, WRITTEN))
+
+
+def parse(output):
+    """
+    Returns:
+        dict of remote path to digest
+    """
+    digests = {}
+    for line in (output or '').splitlines():
+        match = _DIGEST_LINE.match(line.rstrip('\r'))
+        if match:
+            digests[match.group(2)] = match.group(1)
+    return digests
+
+
+def changed_files(contents, digests):
+    """
+    Returns:
+        sorted list of the paths in contents, a dict of remote path to the
+        contents that belong there, whose digest on the host differs
+    """
+    return sorted(path for path, content in contents.iteritems()
+                  if digests.get(path) != digest(content))
@@ -45,24 +45,32 @@ def lookup_port(host):
     if isinstance(port, Exception):
         raise ConfigurationError('Configuration file %s does not exist on '
                                  'host %s' % (config_file, host))
-    else:
-        if str(port) is '':
-            _LOGGER.info('Could not find property http-server.http.port.'
-                         'Defaulting to 8080.')
-            return 8080
-        try:
-            port = port.split('=', 1)[1]
-            port = int(port)
-            prestoadmin.util.validators.validate_port(str(port))
-            _LOGGER.info('Looked up port ' + str(port) + ' on host '
-                         + host)
-            return port
-        except ValueError:
-            raise ConfigurationError('Unable to coerce http-server.http'
-                                     '.port \'%s\' to an int. Failed to '
-                                     'connect to %s.' % (port, host))
-        except ConfigurationError as e:
-            raise ConfigurationError(e.message +
-                                     ' for property '
-                                     'http-server.http.port on host '
-                                     + host + '.')
+    return parse_port(port, host)
+
+
+def parse_port(grep_output, host):
+    """
+    Get the http port from the output of grepping config.properties for
+    the http-server.http.port property, or 8080 if there was no match.
+    """
+    port = grep_output
+    if str(port) is '':
+        _LOGGER.info('Could not find property http-server.http.port.'
+                     'Defaulting to 8080.')
+        return 8080
+    try:
+        port = port.split('=', 1)[1]
+        port = int(port)
+        prestoadmin.util.validators.validate_port(str(port))
+        _LOGGER.info('Looked up port ' + str(port) + ' on host '
+                     + host)
+        return port
+    except ValueError:
+        raise ConfigurationError('Unable to coerce http-server.http'
+                                 '.port \'%s\' to an int. Failed to '
+                                 'connect to %s.' % (port, host))
+    except ConfigurationError as e:
+        raise ConfigurationError(e.message +
+                                 ' for property '
+                                 'http-server.http.port on host '
+                                 + host + '.')
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Thread based stand-in for the parts of the multiprocessing module used by
+execute(), so that per-host task bodies can run in a bounded pool of threads
+instead of one forked process per host.
+
+Fabric keeps its settings in a single global env dictionary, and the
+output levels that hide() and show() change in a global output dictionary.
+Within thread_local_state(), these are switched to a ThreadLocalEnv and a
+ThreadLocalOutput so that each worker thread reads and writes its own copy
+of env and output. They are switched back once the block and the threads
+started in it have finished.
+"""
+import logging
+import threading
+from Queue import Queue
+from contextlib import contextmanager
+
+from fabric import state
+from fabric.network import normalize_to_string
+from fabric.utils import _AliasDict, _AttributeDict
+
+__all__ = ['Process', 'Queue', 'DEFAULT_POOL_SIZE']
+
+DEFAULT_POOL_SIZE = 50
+THREAD_ENGINE = 'threads'
+PROCESS_ENGINE = 'processes'
+ENGINES = [PROCESS_ENGINE, THREAD_ENGINE]
+
+_LOGGER = logging.getLogger(__name__)
+_local = threading.local()
+
+# The number of thread_local_state() blocks and Process threads that need
+# env and output to stay thread-local, and the classes to restore after
+_users = 0
+_users_lock = threading.Lock()
+_original_classes = {}
+
+
+def _storage(mapping):
+    return getattr(_local, mapping._local_name, mapping)
+
+
+def _delegate(name):
+    method = getattr(dict, name)
+
+    def delegated(self, *args, **kwargs):
+        return method(_storage(self), *args, **kwargs)
+    delegated.__name__ = name
+    return delegated
+
+
+class ThreadLocalEnv(_AttributeDict):
+    """
+    Fabric env whose contents are private to each worker thread. Threads
+    that were not started by this module, including the main thread, share
+    the contents of the dictionary itself.
+    """
+    _local_name = 'env'
+
+
+class ThreadLocalOutput(_AliasDict):
+    """
+    Fabric output levels whose contents are private to each worker thread,
+    in the same way as ThreadLocalEnv. Aliases such as 'everything' still
+    set all the levels they stand for.
+    """
+    _local_name = 'output'
+
+    def __setitem__(self, key, value):
+        if key in self.aliases:
+            for aliased in self.aliases[key]:
+                self[aliased] = value
+        else:
+            dict.__setitem__(_storage(self), key, value)
+
+
+for _name in ['__getitem__', '__setitem__', '__delitem__', '__contains__',
+              '__iter__', '__len__', '__repr__', 'clear', 'copy', 'get',
+              'has_key', 'items', 'iteritems', 'iterkeys', 'itervalues',
+              'keys', 'pop', 'popitem', 'setdefault', 'update', 'values']:
+    setattr(ThreadLocalEnv, _name, _delegate(_name))
+    if _name != '__setitem__':
+        setattr(ThreadLocalOutput, _name, _delegate(_name))
+
+
+def _swap_class(mapping, cls):
+    # env.__setattr__ stores keys, so bypass it to swap the class in place;
+    # every module holding a reference to env or output then sees the
+    # per-thread data.
+    object.__setattr__(mapping, '__class__', cls)
+
+
+def _acquire(only_if_active=False):
+    global _users
+    with _users_lock:
+        if only_if_active and not _users:
+            return False
+        if not _users:
+            _original_classes['env'] = type(state.env)
+            _original_classes['output'] = type(state.output)
+            _swap_class(state.env, ThreadLocalEnv)
+            _swap_class(state.output, ThreadLocalOutput)
+        _users += 1
+        return True
+
+
+def _release():
+    global _users
+    with _users_lock:
+        _users -= 1
+        if not _users:
+            _swap_class(state.env, _original_classes.pop('env'))
+            _swap_class(state.output, _original_classes.pop('output'))
+
+
+@contextmanager
+def thread_local_state():
+    """
+    Switch env and output to thread-local storage for the duration of the
+    block, so that the threads started in it can each have their own copy,
+    see Process and own_state().
+    """
+    _acquire()
+    try:
+        yield
+    finally:
+        _release()
+
+
+def copy_state():
+    """
+    Returns:
+        a copy of the env and output of the current thread, for own_state()
+    """
+    return state.env.copy(), state.output.copy()
+
+
+@contextmanager
+def own_state(copied):
+    """
+    Give the current thread its own env and output, starting from copied,
+    the result of copy_state(), for the duration of the block. This only
+    isolates the thread within thread_local_state().
+    """
+    _local.env, _local.output = dict(copied[0]), dict(copied[1])
+    try:
+        yield
+    finally:
+        del _local.env
+        del _local.output
+
+
+def is_thread_engine():
+    return state.env.get('engine', PROCESS_ENGINE) == THREAD_ENGINE
+
+
+class Process(threading.Thread):
+    """
+    Thread with the subset of the multiprocessing.Process interface that
+    fabric's JobQueue relies on. Within thread_local_state(), the thread
+    starts with its own copy of the env and output of the thread that
+    started it, and env and output stay thread-local until it finishes,
+    even if it outlives the block. exitcode is set from SystemExit the same
+    way it is for a child process.
+    """
+
+    def __init__(self, target=None, kwargs=None):
+        super(Process, self).__init__(target=target, kwargs=kwargs or {})
+        self.daemon = True
+        self.exitcode = None
+        self._parent_state = None
+        self._holds_state = False
+
+    def start(self):
+        self._parent_state = copy_state()
+        self._holds_state = _acquire(only_if_active=True)
+        try:
+            super(Process, self).start()
+        except BaseException:
+            if self._holds_state:
+                _release()
+            raise
+
+    def run(self):
+        try:
+            with own_state(self._parent_state):
+                self._run()
+        finally:
+            if self._holds_state:
+                _release()
+
+    def _run(self):
+        try:
+            super(Process, self).run()
+            self.exitcode = 0
+        except SystemExit, e:
+            if e.code is None:
+                self.exitcode = 0
+            elif isinstance(e.code, int):
+                self.exitcode = e.code
+            else:
+                self.exitcode = 1
+        except BaseException:
+            _LOGGER.exception('Unexpected error in thread %s' % self.name)
+            self.exitcode = 1
+
+    def terminate(self):
+        """
+        Threads cannot be killed, so close the connection to the host that
+        the thread is working on instead. The remote operation the thread is
+        blocked on then fails, and the thread finishes on its own.
+        """
+        host_string = normalize_to_string(self.name)
+        connection = dict.get(state.connections, host_string)
+        if connection is not None:
+            _LOGGER.debug('Closing connection to %s' % host_string)
+            connection.close()
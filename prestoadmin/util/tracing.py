@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Timing trace of the tasks and remote operations run by presto-admin.
+
+When env.trace_file is set, every task run on a host and every run, sudo,
+put and get is recorded as a span: one JSON object per line with the kind
+of span, the host, the task, the command, the start time, the duration in
+seconds and, where they apply, the exit code and the number of bytes
+transferred. Spans are appended with a single write each, so that forked
+workers and worker threads can all write to the same file.
+"""
+import json
+import logging
+import math
+import os
+import time
+from contextlib import contextmanager
+
+from fabric import state
+
+_LOGGER = logging.getLogger(__name__)
+
+TASK = 'task'
+COMMAND = 'command'
+TRANSFER = 'transfer'
+MAX_COMMAND_LENGTH = 1000
+SLOWEST_HOSTS = 5
+
+
+def enabled():
+    return bool(state.env.get('trace_file'))
+
+
+def start(path):
+    """
+    Start a new trace in path, replacing any previous trace in that file
+    """
+    path = os.path.abspath(path)
+    open(path, 'w').close()
+    state.env.trace_file = path
+
+
+def record(kind, start_time, duration, **fields):
+    """
+    Append a span to the trace file, if tracing is enabled
+    """
+    path = state.env.get('trace_file')
+    if not path:
+        return
+    span = {'kind': kind,
+            'host': state.env.get('host_string'),
+            'task': state.env.get('command'),
+            'start': start_time,
+            'duration': duration,
+            'pid': os.getpid()}
+    span.update(fields)
+    if span.get('command'):
+        span['command'] = span['command'][:MAX_COMMAND_LENGTH]
+    line = json.dumps(span) + '\n'
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0600)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except (IOError, OSError), e:
+        _LOGGER.warn('Unable to write to trace file %s: %s' % (path, e))
+
+
+@contextmanager
+def span(kind, **fields):
+    """
+    Record the time taken by the body of the with statement as a span. The
+    body can add fields to the dictionary that is yielded, such as the exit
+    code once it is known.
+    """
+    start_time = time.time()
+    try:
+        yield fields
+    finally:
+        if enabled():
+            record(kind, start_time, time.time() - start_time, **fields)
+
+
+def read_spans(path):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                _LOGGER.warn('Skipping malformed trace line: %r' % line)
+    return spans
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of values
+    """
+    ordered = sorted(values)
+    index = max(0, int(math.ceil(fraction * len(ordered))) - 1)
+    return ordered[index]
+
+
+def summarize(spans):
+    """
+    Returns:
+        list of (task, number of hosts, p50, p95, max) for the task spans,
+        in the order in which the tasks were first started, and a list of
+        the SLOWEST_HOSTS slowest (duration, host, task) task spans.
+    """
+    durations = {}
+    order = []
+    slowest = []
+    for s in sorted(spans, key=lambda s: s['start']):
+        if s['kind'] != TASK:
+            continue
+        if s['task'] not in durations:
+            durations[s['task']] = []
+            order.append(s['task'])
+        durations[s['task']].append(s['duration'])
+        if s.get('host'):
+            slowest.append((s['duration'], s['host'], s['task']))
+    rows = [(task, len(durations[task]), percentile(durations[task], 0.5),
+             percentile(durations[task], 0.95), max(durations[task]))
+            for task in order]
+    slowest.sort(reverse=True)
+    return rows, slowest[:SLOWEST_HOSTS]
+
+
+def format_summary(rows, slowest):
+    lines = ['Task timings (seconds):',
+             '  %-40s %6s %8s %8s %8s' % ('task', 'hosts', 'p50', 'p95',
+                                          'max')]
+    for task, count, p50, p95, maximum in rows:
+        lines.append('  %-40s %6d %8.2f %8.2f %8.2f' %
+                     (task, count, p50, p95, maximum))
+    if slowest:
+        lines.append('Slowest hosts:')
+        for duration, host, task in slowest:
+            lines.append('  %-30s %-30s %8.2f' % (host, task, duration))
+    return '\n'.join(lines)
+
+
+def print_summary():
+    """
+    Print the timing summary of the trace, if tracing is enabled
+    """
+    path = state.env.get('trace_file')
+    if not path or not os.path.exists(path):
+        return
+    rows, slowest = summarize(read_spans(path))
+    if rows:
+        print(format_summary(rows, slowest))
+        print('Trace written to: ' + path)
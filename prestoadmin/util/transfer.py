@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Resumable upload of large files, such as the presto rpm and the slider
+tarball.
+
+The file is sent in chunks of CHUNK_SIZE bytes to a partial file whose name
+contains the SHA-256 digest of the whole file. If the connection drops, the
+next attempt, in this run or in a later one, checks the digest of every
+complete chunk already in the partial file in a single round trip and only
+sends the file from the end of the last chunk that matches. Once all of the
+file is there and its digest matches, it is renamed to the destination, so
+the destination never holds a partial or corrupt file. The digests of the
+local file are those of prestoadmin.util.filesystem, so that a file hashed
+once before the tasks are forked is not hashed again for every host.
+
+Every chunk waits for its turn within the bandwidth limits, see
+prestoadmin.util.bandwidth.
+"""
+import logging
+import os
+import posixpath
+import socket
+import time
+
+from fabric import state
+from fabric.api import run, sudo
+from fabric.exceptions import NetworkError
+from fabric.network import normalize_to_string, ssh
+
+from prestoadmin.util import bandwidth, filesystem, tracing
+from prestoadmin.util.remote_batch import quote
+
+_LOGGER = logging.getLogger(__name__)
+
+CHUNK_SIZE = filesystem.CHUNK_SIZE
+
+# Number of times a transfer is resumed after a dropped connection or a
+# digest mismatch before giving up on the host
+MAX_ATTEMPTS = 3
+
+PARTIAL_SUFFIX = '.part'
+
+
+def put_resumable(local_path, remote_path, use_sudo=False, temp_dir=None):
+    """
+    Upload local_path to remote_path on the current host, resuming from the
+    last verified chunk if an earlier attempt was interrupted.
+
+    Args:
+        local_path: the file to upload
+        remote_path: the full path of the file on the host
+        use_sudo: if True, the partial file is kept in temp_dir, or in the
+            home directory of the user, and moved into place with sudo.
+            Otherwise it is kept next to remote_path.
+        temp_dir: where to keep the partial file when use_sudo is True
+
+    Returns:
+        True if the file is in place and its digest matches
+    """
+    chunks, digest = filesystem.chunk_digests(local_path, CHUNK_SIZE)
+    size = os.path.getsize(local_path)
+    start_time = time.time()
+    with tracing.span(tracing.TRANSFER, command='put %s %s' %
+                      (local_path, remote_path), bytes=0) as span:
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                sftp = _sftp()
+                try:
+                    partial = _partial_path(sftp, remote_path, digest,
+                                            use_sudo, temp_dir)
+                    offset = verified_offset(partial, chunks)
+                    if 0 < offset < size:
+                        _LOGGER.info('Resuming upload of %s to %s at byte '
+                                     '%d' % (local_path, state.env.host,
+                                             offset))
+                    span['bytes'] += _send(sftp, local_path, partial, offset)
+                finally:
+                    sftp.close()
+                if _install(partial, remote_path, digest, use_sudo):
+                    span['exit_code'] = 0
+                    if span['bytes']:
+                        bandwidth.report(os.path.basename(local_path),
+                                         span['bytes'],
+                                         time.time() - start_time)
+                    return True
+                _LOGGER.warn('Digest of %s on %s does not match; resuming '
+                             'from the last good chunk' %
+                             (remote_path, state.env.host))
+            except (EnvironmentError, EOFError, NetworkError, socket.error,
+                    ssh.SSHException), e:
+                _LOGGER.warn('Upload of %s to %s was interrupted: %s' %
+                             (local_path, state.env.host, e))
+                _disconnect()
+        span['exit_code'] = 1
+        return False
+
+
+def _partial_path(sftp, remote_path, digest, use_sudo, temp_dir):
+    name = '.%s.%s%s' % (posixpath.basename(remote_path), digest[:16],
+                         PARTIAL_SUFFIX)
+    if not use_sudo:
+        return posixpath.join(posixpath.dirname(remote_path), name)
+    if not temp_dir:
+        temp_dir = sftp.normalize('.')
+    return posixpath.join(temp_dir, name)
+
+
+def verified_offset(partial, chunks):
+    """
+    Compare the digests of the complete chunks in the partial file on the
+    current host with the digests of the local chunks, in one round trip.
+
+    Returns:
+        the offset just past the last chunk that matches
+    """
+    script = ('if [ -f %(path)s ]; then size=$(stat -c %%s %(path)s); i=0; '
+              'while [ $(( (i + 1) * %(chunk)d )) -le $size ]; do '
+              'dd if=%(path)s bs=%(chunk)d skip=$i count=1 2>/dev/null | '
+              'sha256sum | cut -c1-64; i=$((i + 1)); done; fi' %
+              {'path': quote(partial), 'chunk': CHUNK_SIZE})
+    out = run(script, quiet=True)
+    verified = 0
+    for remote, local in zip(out.split(), chunks):
+        if remote != local:
+            break
+        verified += 1
+    return verified * CHUNK_SIZE
+
+
+def _send(sftp, local_path, partial, offset):
+    """
+    Send the local file from offset on to the partial file, dropping
+    whatever the partial file holds past offset.
+
+    Returns:
+        the number of bytes sent
+    """
+    if offset:
+        sftp.truncate(partial, offset)
+        remote = sftp.open(partial, 'r+')
+        remote.seek(offset)
+    else:
+        remote = sftp.open(partial, 'w')
+    sent = 0
+    try:
+        remote.set_pipelined(True)
+        with open(local_path, 'rb') as source:
+            source.seek(offset)
+            while True:
+                data = source.read(CHUNK_SIZE)
+                if not data:
+                    break
+                bandwidth.throttle(len(data))
+                remote.write(data)
+                sent += len(data)
+    finally:
+        remote.close()
+    return sent
+
+
+def _install(partial, remote_path, digest, use_sudo):
+    """
+    Check the digest of the partial file and rename it to remote_path. With
+    use_sudo the partial file may be on another file system, so it is first
+    copied next to remote_path; the final rename is always within the
+    destination directory.
+    """
+    values = {'digest': digest, 'partial': quote(partial),
+              'path': quote(remote_path),
+              'dir': quote(posixpath.dirname(remote_path)),
+              'temp': quote(remote_path + PARTIAL_SUFFIX)}
+    check = 'echo "%(digest)s  "%(partial)s | sha256sum -c --status' % values
+    if use_sudo:
+        if not run(check, quiet=True).succeeded:
+            return False
+        return sudo('mkdir -p %(dir)s && cp %(partial)s %(temp)s && '
+                    'mv -f %(temp)s %(path)s && rm -f %(partial)s' % values,
+                    quiet=True).succeeded
+    return run(check + ' && mv -f %(partial)s %(path)s' % values,
+               quiet=True).succeeded
+
+
+def _sftp():
+    return state.connections[state.env.host_string].open_sftp()
+
+
+def _disconnect():
+    """
+    Close the connection to the current host, so that the next attempt
+    opens a new one instead of reusing one that may be half dead
+    """
+    connection = dict.get(state.connections,
+                          normalize_to_string(state.env.host_string))
+    if connection is not None:
+        connection.close()
@@ -45,6 +45,68 @@ def validate_port(port):
     return port_int
 
 
+def validate_max_parallel_hosts(max_parallel_hosts):
+    try:
+        value = int(max_parallel_hosts)
+    except (TypeError, ValueError):
+        value = 0
+    if value < 1:
+        raise ConfigurationError('Invalid value ' + repr(max_parallel_hosts)
+                                 + ': max_parallel_hosts must be a positive '
+                                 'number.')
+    return value
+
+
+def validate_bandwidth_limit(limit, name='bandwidth_limit'):
+    try:
+        value = float(limit)
+    except (TypeError, ValueError):
+        value = 0
+    if value <= 0:
+        raise ConfigurationError('Invalid value ' + repr(limit) + ': ' +
+                                 name + ' must be a positive number of '
+                                 'megabytes per second.')
+    return value
+
+
+def validate_bandwidth_groups(groups):
+    if not isinstance(groups, dict):
+        raise ConfigurationError('bandwidth_groups must be an object mapping '
+                                 'group names to hosts and limits.')
+    for name, group in groups.items():
+        if not isinstance(group, dict) or \
+                not isinstance(group.get('hosts'), list) or \
+                'limit' not in group:
+            raise ConfigurationError('Bandwidth group ' + name + ' must have '
+                                     'a list of hosts and a limit.')
+        validate_bandwidth_limit(group['limit'],
+                                 'the limit of bandwidth group ' + name)
+    return groups
+
+
+def validate_sizing(sizing, ratio_names):
+    if not isinstance(sizing, dict):
+        raise ConfigurationError('sizing must be an object mapping sizing '
+                                 'ratios to numbers.')
+    for name, value in sizing.items():
+        if name not in ratio_names:
+            raise ConfigurationError('Invalid sizing ratio ' + name +
+                                     '. Possible ratios: ' +
+                                     ', '.join(sorted(ratio_names)))
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            number = 0
+        if name.endswith('_fraction') and not 0 < number <= 1:
+            raise ConfigurationError('Invalid value ' + repr(value) + ': ' +
+                                     name + ' must be a number greater '
+                                     'than 0 and at most 1.')
+        if number <= 0:
+            raise ConfigurationError('Invalid value ' + repr(value) + ': ' +
+                                     name + ' must be a positive number.')
+    return sizing
+
+
 def validate_host(host):
     try:
         socket.inet_pton(socket.AF_INET, host)
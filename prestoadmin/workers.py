@@ -27,7 +27,7 @@ from fabric.api import env
 from prestoadmin import config
 from prestoadmin.presto_conf import validate_presto_conf, get_presto_conf, \
     REQUIRED_FILES
-from prestoadmin.util import constants
+from prestoadmin.util import conf_cache, constants
 from prestoadmin.util.exception import ConfigurationError
 import prestoadmin.util.fabricapi as util
 
@@ -66,8 +66,17 @@ def get_conf():
     return conf
 
 
+def get_local_conf():
+    """
+    Returns:
+        the configuration in the local workers directory, without the
+        defaults
+    """
+    return _get_conf()
+
+
 def _get_conf():
-    return get_presto_conf(constants.WORKERS_DIR)
+    return conf_cache.load(constants.WORKERS_DIR, get_presto_conf)
 
 
 def build_defaults():
@@ -81,16 +81,18 @@ discovery-server.enabled=true
 discovery.uri=http://master:8080
 http-server.http.port=8080
 node-scheduler.include-coordinator=false
+query.initial-hash-partitions=3
 query.max-memory-per-node=1GB
-query.max-memory=50GB\n"""
+query.max-memory=3GB\n"""
 
     default_coordinator_test_config_ = """coordinator=true
 discovery-server.enabled=true
 discovery.uri=http://master:8080
 http-server.http.port=8080
 node-scheduler.include-coordinator=false
+query.initial-hash-partitions=3
 query.max-memory-per-node=512MB
-query.max-memory=50GB\n"""
+query.max-memory=1536MB\n"""
 
     down_node_connection_string = r'(\nWarning: (\[%(host)s\] )?Low level socket ' \
                                   r'error connecting to host %(host)s on ' \
@@ -33,13 +33,18 @@ class TestCollect(BaseProductTestCase):
         super(TestCollect, self).setUp()
         self.setup_cluster(self.STANDALONE_PRESTO_CLUSTER)
 
+    def expected_logs_output(self):
+        expected = 'Downloading logs from all the nodes...\n' + \
+                   'logs archive created: ' + OUTPUT_FILENAME_FOR_LOGS + '\n'
+        for host in self.cluster.all_internal_hosts():
+            expected += 'Downloaded logs from %s\n' % host
+        return expected
+
     @attr('smoketest')
     def test_collect_logs_basic(self):
         self.run_prestoadmin('server start')
         actual = self.run_prestoadmin('collect logs')
-        expected = 'Downloading logs from all the nodes...\n' + \
-                   'logs archive created: ' + OUTPUT_FILENAME_FOR_LOGS + '\n'
-        self.assertEqual(expected, actual)
+        self.assertEqualIgnoringOrder(self.expected_logs_output(), actual)
         self.assert_path_exists(self.cluster.master,
                                 OUTPUT_FILENAME_FOR_LOGS)
         self.assert_path_exists(self.cluster.master,
@@ -64,8 +69,10 @@ class TestCollect(BaseProductTestCase):
         actual = self.run_prestoadmin('collect system_info')
         expected = 'System info archive created: ' + \
                    OUTPUT_FILENAME_FOR_SYS_INFO + '\n'
+        for host in self.cluster.all_internal_hosts():
+            expected += 'Gathered system information from %s\n' % host
 
-        self.assertEqual(expected, actual)
+        self.assertEqualIgnoringOrder(expected, actual)
         self.assert_path_exists(self.cluster.master,
                                 OUTPUT_FILENAME_FOR_SYS_INFO)
         self.assert_path_exists(self.cluster.master,
@@ -143,9 +150,7 @@ class TestCollect(BaseProductTestCase):
 
     def test_collect_logs_server_stopped(self):
         actual = self.run_prestoadmin('collect logs')
-        expected = 'Downloading logs from all the nodes...\n' + \
-                   'logs archive created: ' + OUTPUT_FILENAME_FOR_LOGS + '\n'
-        self.assertEqual(actual, expected)
+        self.assertEqualIgnoringOrder(self.expected_logs_output(), actual)
         self.assert_path_exists(self.cluster.master,
                                 OUTPUT_FILENAME_FOR_LOGS)
 
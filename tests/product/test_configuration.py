@@ -39,9 +39,14 @@ class TestConfiguration(BaseProductTestCase):
         # deploy a default configuration, no files in coordinator or workers
         output = self.run_prestoadmin('configuration deploy')
         deploy_template = 'Deploying configuration on: %s\n'
+        summary_template = 'Configuration on %s: changed: %s; ' \
+                           'unchanged: %s; not in local configuration: none\n'
         expected = ''
         for host in self.cluster.all_internal_hosts():
             expected += deploy_template % host
+            expected += summary_template % (
+                host, 'config.properties, jvm.config, node.properties',
+                'none')
 
         for host in self.cluster.all_hosts():
             self.assert_has_default_config(host)
@@ -64,7 +69,10 @@ class TestConfiguration(BaseProductTestCase):
         # deploy coordinator configuration only.  Has a non-default file
         output = self.run_prestoadmin('configuration deploy coordinator')
         self.assertEqual(output,
-                         deploy_template % self.cluster.internal_master)
+                         deploy_template % self.cluster.internal_master +
+                         summary_template % (self.cluster.internal_master,
+                                             'config.properties',
+                                             'jvm.config, node.properties'))
         for container in self.cluster.slaves:
             self.assert_has_default_config(container)
 
@@ -88,6 +96,8 @@ class TestConfiguration(BaseProductTestCase):
         expected = ''
         for host in self.cluster.internal_slaves:
             expected += deploy_template % host
+            expected += summary_template % (
+                host, 'config.properties, node.properties', 'jvm.config')
         self.assertEqualIgnoringOrder(output, expected)
 
         for container in self.cluster.slaves:
@@ -106,6 +116,27 @@ plugin.dir=/usr/lib/presto/lib/plugin\n"""
         self.assert_node_config(self.cluster.master,
                                 self.default_node_properties_)
 
+    def test_configuration_diff(self):
+        self.upload_topology()
+        self.run_prestoadmin('configuration deploy')
+        host_count = len(self.cluster.all_hosts())
+
+        output = self.run_prestoadmin('configuration diff')
+        self.assertEqual('%d of %d hosts match the expected configuration\n'
+                         % (host_count, host_count), output)
+
+        self.cluster.write_content_to_host(
+            'query.max-memory=1GB',
+            os.path.join(constants.REMOTE_CONF_DIR, 'config.properties'),
+            self.cluster.slaves[0]
+        )
+        output = self.run_prestoadmin('configuration diff')
+        self.assertTrue('%d of %d hosts match the expected configuration' %
+                        (host_count - 1, host_count) in output)
+        self.assertTrue('%s: 1 file differs from the expected configuration'
+                        % self.cluster.internal_slaves[0] in output)
+        self.assertTrue('+query.max-memory=1GB' in output)
+
     def test_lost_coordinator_connection(self):
         internal_bad_host = self.cluster.internal_slaves[0]
         bad_host = self.cluster.slaves[0]
@@ -123,8 +154,9 @@ plugin.dir=/usr/lib/presto/lib/plugin\n"""
         )
         for host in self.cluster.all_internal_hosts():
             self.assertTrue('Deploying configuration on: %s' % host in output)
+        # A summary is printed for every host but the one that is down
         expected_size = self.len_down_node_error + \
-            len(self.cluster.all_hosts())
+            2 * len(self.cluster.all_hosts()) - 1
         self.assertEqual(len(output.splitlines()), expected_size)
 
         output = self.run_prestoadmin('configuration show config')
@@ -150,7 +182,7 @@ plugin.dir=/usr/lib/presto/lib/plugin\n"""
         )
         for host in self.cluster.all_internal_hosts():
             self.assertTrue('Deploying configuration on: %s' % host in output)
-        expected_length = len(self.cluster.all_hosts()) + \
+        expected_length = 2 * len(self.cluster.all_hosts()) - 1 + \
             self.len_down_node_error
         self.assertEqual(len(output.splitlines()), expected_length)
 
@@ -36,6 +36,27 @@ class TestControl(BaseProductTestCase):
         expected_output = self.expected_stop()[:] + self.expected_start()[:]
         self.assert_simple_server_restart(expected_output)
 
+    def test_server_rolling_restart(self):
+        self.setup_cluster(self.STANDALONE_PRESTO_CLUSTER)
+        start_output = self.run_prestoadmin('server start').splitlines()
+        started = self.get_process_per_host(start_output)
+
+        restart_output = self.run_prestoadmin(
+            'server rolling_restart 1').splitlines()
+        self.assert_stopped(started)
+        restarted = self.get_process_per_host(restart_output)
+        self.assertEqual(len(self.cluster.all_hosts()), len(restarted))
+        self.assert_started(restarted)
+        # The coordinator is restarted after the workers, one at a time
+        groups = [line for line in restart_output
+                  if line.startswith('Restarting the Presto server on')]
+        self.assertEqual(['Restarting the Presto server on ' + host
+                          for host in self.cluster.internal_slaves +
+                          [self.cluster.internal_master]], groups)
+        for host in self.cluster.all_internal_hosts():
+            self.assertTrue('Server started successfully on: ' + host
+                            in restart_output)
+
     def test_server_start_without_topology(self):
         self.assert_service_fails_without_topology('start')
 
@@ -373,25 +394,25 @@ class TestControl(BaseProductTestCase):
         if not already_started and not start_success and not failed_hosts:
             start_success = self.cluster.all_internal_hosts()
 
+        # The servers are checked all at once, in the order of the topology
+        checked_hosts = [host for host in self.cluster.all_internal_hosts()
+                         if host in (start_success or []) +
+                         (already_started or [])]
+        if checked_hosts:
+            return_str += [r'Waiting to make sure we can connect to the '
+                           r'Presto servers on %s, please wait. This check'
+                           r' will time out after %d minutes if the servers'
+                           r' do not respond.'
+                           % (', '.join(checked_hosts), RETRY_TIMEOUT / 60)]
         if start_success:
             for host in start_success:
-                return_str += [r'Waiting to make sure we can connect to the '
-                               r'Presto server on %s, please wait. This check'
-                               r' will time out after %d minutes if the server'
-                               r' does not respond.'
-                               % (host, RETRY_TIMEOUT / 60),
-                               r'Server started successfully on: %s' % host,
+                return_str += [r'Server started successfully on: %s' % host,
                                r'\[%s\] out: ' % host,
                                r'\[%s\] out: Started as .*' % host,
                                r'\[%s\] out: Starting presto' % host]
         if already_started:
             for host in already_started:
-                return_str += [r'Waiting to make sure we can connect to the '
-                               r'Presto server on %s, please wait. This check'
-                               r' will time out after %d minutes if the server'
-                               r' does not respond.'
-                               % (host, RETRY_TIMEOUT / 60),
-                               r'Server started successfully on: %s' % host,
+                return_str += [r'Server started successfully on: %s' % host,
                                r'\[%s\] out: ' % host,
                                r'\[%s\] out: Already running as .*' % host,
                                r'\[%s\] out: Starting presto' % host]
@@ -110,14 +110,12 @@ class TestPackageInstall(BaseProductTestCase):
         cmd_output = self.run_prestoadmin('package install /mnt/presto-admin'
                                           '/invalid-path/presto.rpm',
                                           rpm=rpm_name)
-        error = '\nFatal error: [%s] error: ' \
-                '/mnt/presto-admin/invalid-path/presto.rpm: open failed: ' \
-                'No such file or directory\n\nAborting.\n'
-        expected = ''
-        for host in self.cluster.all_internal_hosts():
-            expected += error % host
+        # The rpm is checked once on the presto-admin node, not per host
+        expected = '\nFatal error: error: ' \
+                   '/mnt/presto-admin/invalid-path/presto.rpm: open failed: ' \
+                   'No such file or directory\n\nAborting.\n'
 
-        self.assertEqualIgnoringOrder(cmd_output, expected)
+        self.assertEqual(cmd_output, expected)
 
     def test_install_no_path_arg(self):
         self.installer.copy_presto_rpm_to_master()
@@ -166,15 +164,12 @@ Package deployed successfully on: %(master)s
         cmd_output = self.run_prestoadmin('package install '
                                           '/etc/opt/prestoadmin/config.json')
 
-        error = """
-Fatal error: \[%s\] error: (/etc/opt/prestoadmin/config.json: )?not an rpm \
+        expected = """
+Fatal error: error: (/etc/opt/prestoadmin/config.json: )?not an rpm \
 package
 
 Aborting.
 """
-        expected = ''
-        for host in self.cluster.all_internal_hosts():
-            expected += error % host
 
         self.assertRegexpMatchesLineByLine(cmd_output.splitlines(),
                                            expected.splitlines())
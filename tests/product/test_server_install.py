@@ -119,8 +119,9 @@ discovery-server.enabled=true
 discovery.uri=http://slave1:8080
 http-server.http.port=8080
 node-scheduler.include-coordinator=false
+query.initial-hash-partitions=%(nodes)d
 query.max-memory-per-node=512MB
-query.max-memory=50GB\n"""
+query.max-memory=%(memory)s\n"""
 
     default_workers_config_regex_ = """coordinator=false
 discovery.uri=http:.*:8080
@@ -133,8 +134,9 @@ discovery-server.enabled=true
 discovery.uri=http:.*:8080
 http-server.http.port=8080
 node-scheduler.include-coordinator=false
+query.initial-hash-partitions=\d+
 query.max-memory-per-node=512MB
-query.max-memory=50GB\n"""
+query.max-memory=\d+[MG]B\n"""
 
     def setUp(self):
         super(TestServerInstall, self).setUp()
@@ -148,11 +150,12 @@ query.max-memory=50GB\n"""
         self.assert_node_config(container, self.default_node_properties_)
         self.assert_has_default_connector(container)
 
-    def assert_installed_with_configs(self, master, slaves):
+    def assert_installed_with_configs(self, master, slaves, memory):
         self.assert_common_configs(master)
         self.assert_file_content(master,
                                  '/etc/presto/config.properties',
-                                 self.default_coord_config_with_slave1_)
+                                 self.default_coord_config_with_slave1_ %
+                                 {'nodes': len(slaves), 'memory': memory})
         for container in slaves:
             self.assert_common_configs(container)
             self.assert_file_content(container,
@@ -200,7 +203,7 @@ query.max-memory=50GB\n"""
             self.cluster.slaves[0],
             [self.cluster.slaves[1],
              self.cluster.slaves[2],
-             self.cluster.master])
+             self.cluster.master], '1536MB')
 
     def test_install_ext_host_is_pa_master(self):
         topology = {"coordinator": "slave1",
@@ -216,7 +219,7 @@ query.max-memory=50GB\n"""
         self.assert_installed_with_configs(
             self.cluster.slaves[0],
             [self.cluster.slaves[1],
-             self.cluster.slaves[2]])
+             self.cluster.slaves[2]], '1GB')
 
     def test_install_when_connector_json_exists(self):
         topology = {"coordinator": "master",
@@ -484,14 +487,11 @@ query.max-memory=50GB\n"""
 
         script = 'chmod 600 /mnt/presto-admin/%(rpm)s; su app-admin -c ' \
                  '"./presto-admin server install /mnt/presto-admin/%(rpm)s "'
-        error_msg = '\nFatal error: [%(host)s] error: ' \
-                    '/mnt/presto-admin/%(rpm)s: ' \
-                    'open failed: Permission denied\n\nAborting.\n'
-        expected = ''
-        for host in self.cluster.all_internal_hosts():
-            expected += error_msg % {'host': host, 'rpm': rpm_name}
+        expected = '\nFatal error: error: /mnt/presto-admin/%(rpm)s: ' \
+                   'open failed: Permission denied\n\nAborting.\n' % \
+                   {'rpm': rpm_name}
         actual = self.run_script_from_prestoadmin_dir(script, rpm=rpm_name)
-        self.assertEqualIgnoringOrder(actual, expected)
+        self.assertEqual(actual, expected)
 
     def test_install_twice(self):
         self.test_install(dummy=True)
@@ -183,9 +183,10 @@ http-server.http.port=8090"""
         return statuses
 
     def check_status(self, cmd_output, statuses, port=8080):
-        expected_output = []
+        # Hosts are printed in the order in which they answered, so check the
+        # block of output for each host on its own.
         for status in statuses:
-            expected_output += \
+            expected_output = \
                 ['Server Status:',
                  '\t%s\(IP: %s, Roles: %s\): %s' %
                  (status['host'], status['ip'], status['role'],
@@ -200,7 +201,7 @@ http-server.http.port=8090"""
                      '\tNode is active: True',
                      '\tConnectors:     system, tpch']
 
-        self.assertRegexpMatches(cmd_output, '\n'.join(expected_output))
+            self.assertRegexpMatches(cmd_output, '\n'.join(expected_output))
 
     def _server_status_with_retries(self):
         return self.retry(lambda: self._get_status_until_coordinator_updated())
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stand-ins for run() and sudo() that run scripts with a local shell
+"""
+import os
+import subprocess
+
+from fabric.operations import _AttributeString
+
+
+def local_shell(script, stdout=None):
+    """
+    Run the script with a local shell and print its output the way fabric
+    does
+    """
+    process = subprocess.Popen(['/bin/bash', '-c', script],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    for line in output.splitlines(True):
+        stdout.write('[host] out: ' + line)
+    out = _AttributeString(output.strip())
+    out.return_code = process.returncode
+    out.succeeded = process.returncode == 0
+    out.failed = not out.succeeded
+    return out
+
+
+def quiet_shell(script, **kwargs):
+    """
+    Like local_shell(), but the output is discarded. Takes the keyword
+    arguments of run() and sudo(), such as stdout or quiet, and ignores
+    them.
+    """
+    with open(os.devnull, 'w') as devnull:
+        return local_shell(script, devnull)
@@ -18,7 +18,7 @@ Tests the presto diagnostic information using presto-admin collect
 
 from os import path
 
-from mock import patch
+from mock import patch, ANY
 from fabric.api import env
 import requests
 
@@ -53,12 +53,20 @@ class TestCollect(BaseTestCase):
         mock_execute.assert_called_with(collect.file_get,
                                         REMOTE_PRESTO_LOG_DIR,
                                         downloaded_logs_loc,
-                                        roles=[])
+                                        roles=[], on_result=ANY)
         tarfile_open_mock.assert_called_with(OUTPUT_FILENAME_FOR_LOGS, 'w:bz2')
         tar = tarfile_open_mock.return_value
         tar.add.assert_called_with(downloaded_logs_loc,
                                    arcname=path.basename(downloaded_logs_loc))
 
+    def test_report_progress(self):
+        self.capture_stdout_stderr()
+        on_result = collect.report_progress('Downloaded logs from')
+        on_result('master', None)
+        on_result('slave1', Exception('failed'))
+        self.assertEqual('Downloaded logs from master\n',
+                         self.test_stdout.getvalue())
+
     @patch("prestoadmin.collect.os.path.exists")
     @patch("prestoadmin.collect.get")
     @patch("prestoadmin.collect.exists")
@@ -189,7 +197,8 @@ class TestCollect(BaseTestCase):
         file_obj.write.assert_any_call(connector_info + '\n')
 
         execute_mock.assert_called_with(collect.get_system_info,
-                                        downloaded_sys_info_loc, roles=[])
+                                        downloaded_sys_info_loc, roles=[],
+                                        on_result=ANY)
 
         make_tarfile_mock.assert_called_with(OUTPUT_FILENAME_FOR_SYS_INFO,
                                              downloaded_sys_info_loc)
@@ -13,95 +13,138 @@
 # limitations under the License.
 
 import os
+import shutil
+import tempfile
+
 from fabric.state import env
 from mock import patch
 from prestoadmin.util import constants
+from prestoadmin.util import remote_digests
 from prestoadmin import configure_cmds
+import prestoadmin.deploy
 from tests.base_test_case import BaseTestCase
+from tests.unit.shell import quiet_shell
 
 
 class TestConfigureCmds(BaseTestCase):
-    @patch('prestoadmin.configure_cmds.get')
-    @patch('prestoadmin.configure_cmds.files.exists')
-    def test_config_show(self, mock_file_exists, mock_get):
-        mock_file_exists.return_value = True
-
-        configure_cmds.show("Node")
-        file_path_node = os.path.join(constants.REMOTE_CONF_DIR,
-                                      "node.properties")
-        args, kwargs = mock_get.call_args
-        self.assertEqual(args[0], file_path_node)
-
-        configure_cmds.show("jvm")
-        file_path_jvm = os.path.join(constants.REMOTE_CONF_DIR, "jvm.config")
-        args, kwargs = mock_get.call_args
-        self.assertEqual(args[0], file_path_jvm)
-
-        configure_cmds.show("conFig")
-        file_path_config = os.path.join(constants.REMOTE_CONF_DIR,
-                                        "config.properties")
-        args, kwargs = mock_get.call_args
-        self.assertEqual(args[0], file_path_config)
-
-    @patch('prestoadmin.configure_cmds.configuration_show')
-    def test_config_show_all(self, mock_show):
+    def setUp(self):
+        super(TestConfigureCmds, self).setUp()
+        self.remove_runs_once_flag(configure_cmds.deploy)
+
+    @patch('prestoadmin.configure_cmds.show_files')
+    @patch('prestoadmin.configure_cmds.execute')
+    def test_config_show(self, mock_execute, mock_show_files):
+        env.hosts = ['master', 'slave1']
+        for config_type, file_name in [('Node', 'node.properties'),
+                                       ('jvm', 'jvm.config'),
+                                       ('conFig', 'config.properties')]:
+            self.remove_runs_once_flag(configure_cmds.show)
+            configure_cmds.show(config_type)
+            paths = [os.path.join(constants.REMOTE_CONF_DIR, file_name)]
+            mock_execute.assert_called_with(configure_cmds.fetch_contents,
+                                            paths,
+                                            hosts=['master', 'slave1'])
+            mock_show_files.assert_called_with(
+                paths, ['master', 'slave1'], mock_execute.return_value, [])
+
+    @patch('prestoadmin.configure_cmds.show_files')
+    @patch('prestoadmin.configure_cmds.execute')
+    def test_config_show_all(self, mock_execute, mock_show_files):
+        env.hosts = ['master']
+        self.remove_runs_once_flag(configure_cmds.show)
         configure_cmds.show()
-        mock_show.assert_any_call("node.properties")
-        mock_show.assert_any_call("jvm.config")
-        mock_show.assert_any_call("config.properties")
-        mock_show.assert_any_call("log.properties", should_warn=False)
+        paths = [os.path.join(constants.REMOTE_CONF_DIR, name) for name in
+                 ['node.properties', 'jvm.config', 'config.properties',
+                  'log.properties']]
+        mock_execute.assert_called_with(configure_cmds.fetch_contents,
+                                        paths, hosts=['master'])
+        mock_show_files.assert_called_with(
+            paths, ['master'], mock_execute.return_value, paths[3:])
 
+    @patch('prestoadmin.configure_cmds.execute')
     @patch('prestoadmin.configure_cmds.abort')
-    @patch('prestoadmin.configure_cmds.warn')
-    @patch('prestoadmin.configure_cmds.files.exists')
-    def test_config_show_fail(self, mock_file_exists, mock_warn, mock_abort):
-        mock_file_exists.return_value = False
-        env.host = "any_host"
-        configure_cmds.configuration_show("any_path")
-        file_path = os.path.join(constants.REMOTE_CONF_DIR, "any_path")
-        mock_warn.assert_called_with("No configuration file found "
-                                     "for %s at %s" % (env.host, file_path))
-
+    def test_config_show_invalid(self, mock_abort, mock_execute):
+        self.remove_runs_once_flag(configure_cmds.show)
         configure_cmds.show("invalid_config")
         mock_abort.assert_called_with("Invalid Argument. Possible values: "
                                       "node, jvm, config, log")
+        self.assertFalse(mock_execute.called)
+
+    def test_show_files_groups_hosts(self):
+        self.capture_stdout_stderr()
+        jvm = '/etc/presto/jvm.config'
+        log = '/etc/presto/log.properties'
+        results = {'master': {jvm: '-Xmx4G\n', log: None},
+                   'slave1': {jvm: '-Xmx2G\n', log: None},
+                   'slave2': {jvm: '-Xmx2G\n', log: 'a=b\n'},
+                   'slave3': Exception('Timed out')}
+        configure_cmds.show_files([jvm, log],
+                                  ['master', 'slave1', 'slave2', 'slave3'],
+                                  results)
+        self.assertEqual('\nmaster: Configuration file at '
+                         '/etc/presto/jvm.config:\n-Xmx4G\n\n'
+                         '\nslave1, slave2: Configuration file at '
+                         '/etc/presto/jvm.config:\n-Xmx2G\n\n'
+                         '\nslave2: Configuration file at '
+                         '/etc/presto/log.properties:\na=b\n\n',
+                         self.test_stdout.getvalue())
+        self.assertTrue('No configuration file found for master, slave1 at '
+                        '/etc/presto/log.properties' in
+                        self.test_stderr.getvalue())
+        self.assertTrue('[slave3] Could not fetch the configuration files: '
+                        'Timed out' in self.test_stderr.getvalue())
 
     @patch('prestoadmin.configure_cmds.warn')
-    @patch('prestoadmin.configure_cmds.files.exists')
-    def test_config_show_fail_no_warn(self, mock_file_exists, mock_warn):
-        mock_file_exists.return_value = False
-        env.host = "any_host"
-        configure_cmds.configuration_show("any_path", should_warn=False)
+    def test_show_files_no_warn(self, mock_warn):
+        path = '/etc/presto/log.properties'
+        configure_cmds.show_files([path], ['master'],
+                                  {'master': {path: None}}, [path])
         self.assertFalse(mock_warn.called)
 
+    @patch('prestoadmin.deploy.configure_hosts')
     @patch('prestoadmin.configure_cmds.abort')
-    @patch('prestoadmin.deploy.workers')
-    @patch('prestoadmin.deploy.coordinator')
-    def test_config_deploy(self, mock_coordinator, mock_workers, mock_abort):
-        env.host = "any_host"
+    @patch('prestoadmin.deploy.render')
+    def test_config_deploy(self, mock_render, mock_abort, mock_configure):
+        env.hosts = ['master', 'slave1']
         configure_cmds.deploy("invalid_config")
         mock_abort.assert_called_with("Invalid Argument. "
                                       "Possible values: coordinator, workers")
+        self.assertFalse(mock_configure.called)
 
+        self.remove_runs_once_flag(configure_cmds.deploy)
         configure_cmds.deploy()
-        mock_workers.assert_called_with()
-        mock_coordinator.assert_called_with()
+        mock_render.assert_called_once_with(['master', 'slave1'],
+                                            ['coordinator', 'workers'])
+        mock_configure.assert_called_with(
+            mock_render.return_value, ['master', 'slave1'],
+            on_result=configure_cmds.print_deploy_summary)
+
+    def test_print_deploy_summary(self):
+        self.capture_stdout_stderr()
+        summary = remote_digests.Summary(['config.properties'],
+                                         ['jvm.config', 'node.properties'],
+                                         [])
+        configure_cmds.print_deploy_summary('master', summary)
+        configure_cmds.print_deploy_summary('slave1', Exception('failed'))
+        self.assertEqual('Configuration on master: changed: '
+                         'config.properties; unchanged: jvm.config, '
+                         'node.properties; not in local configuration: '
+                         'none\n',
+                         self.test_stdout.getvalue())
 
-    @patch('prestoadmin.deploy.workers')
-    @patch('prestoadmin.deploy.coordinator')
-    def test_config_deploy_coord(self, mock_coordinator, mock_workers):
-        env.host = "any_host"
+    @patch('prestoadmin.deploy.configure_hosts')
+    @patch('prestoadmin.deploy.render')
+    def test_config_deploy_coord(self, mock_render, mock_configure):
+        env.hosts = ['master']
         configure_cmds.deploy("coordinator")
-        mock_coordinator.assert_called_with()
-        assert not mock_workers.called
+        mock_render.assert_called_with(['master'], ['coordinator'])
 
-    @patch('prestoadmin.deploy.workers')
-    @patch('prestoadmin.deploy.coordinator')
-    def test_config_deploy_workers(self, mock_coordinator, mock_workers):
-        env.host = "any_host"
-        configure_cmds.deploy("workers")
-        mock_workers.assert_called_with()
-        assert not mock_coordinator.called
+    @patch('prestoadmin.deploy.configure_hosts')
+    @patch('prestoadmin.deploy.render')
+    def test_config_deploy_workers(self, mock_render, mock_configure):
+        env.hosts = ['master']
+        configure_cmds.deploy("Workers")
+        mock_render.assert_called_with(['master'], ['workers'])
 
     @patch('prestoadmin.configure_cmds.os.path.exists')
     @patch('prestoadmin.configure_cmds.ensure_parent_directories_exist')
@@ -158,3 +201,92 @@ class TestConfigureCmds(BaseTestCase):
         configure_cmds.deploy_all(local_dir)
         self.assertTrue(len(get_files) > 0)
         self.assertEquals(get_files, put_files)
+
+
+@patch('prestoadmin.util.remote_batch.sudo', quiet_shell)
+class TestConfigurationDiff(BaseTestCase):
+    def setUp(self):
+        super(TestConfigurationDiff, self).setUp(capture_output=True)
+        self.temp_dir = tempfile.mkdtemp()
+        self.conf_dir = os.path.join(self.temp_dir, 'presto')
+        self.catalog_dir = os.path.join(self.conf_dir, 'catalog')
+        os.makedirs(self.catalog_dir)
+        for name, value in [('REMOTE_CONF_DIR', self.conf_dir),
+                            ('REMOTE_CATALOG_DIR', self.catalog_dir)]:
+            patcher = patch('prestoadmin.configure_cmds.constants.' + name,
+                            value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1']
+        env.host = 'master'
+        self.rendered = {'coordinator': prestoadmin.deploy.RenderedConf(
+            (('config.properties', 'a=b'), ('jvm.config', '-server')),
+            'x=y')}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(TestConfigurationDiff, self).tearDown()
+
+    def write(self, directory, name, content):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(content)
+
+    def test_no_drift(self):
+        self.write(self.conf_dir, 'config.properties', 'a=b\n')
+        self.write(self.conf_dir, 'jvm.config', '-server\n')
+        self.write(self.conf_dir, 'node.properties', 'node.id=1\nx=y\n')
+        self.write(self.catalog_dir, 'tpch.properties', 'connector.name=tpch')
+        self.assertEqual((), configure_cmds.collect_drift(
+            self.rendered, {'tpch.properties': 'connector.name=tpch'}))
+
+    def test_collect_drift(self):
+        self.write(self.conf_dir, 'config.properties', 'a=c\n')
+        self.write(self.conf_dir, 'jvm.config', '-server\n')
+        self.write(self.conf_dir, 'node.properties', 'node.id=1\nz=y\n')
+        self.write(self.conf_dir, 'log.properties', 'l=1\n')
+        self.write(self.catalog_dir, 'tpch.properties', 'connector.name=tpch')
+        self.write(self.catalog_dir, 'jmx.properties', 'connector.name=jmx')
+        connectors = {'tpch.properties': 'connector.name=tpch',
+                      'hive.properties': 'connector.name=hive'}
+
+        drift = configure_cmds.collect_drift(self.rendered, connectors)
+
+        self.assertEqual(
+            ((os.path.join(self.catalog_dir, 'hive.properties'),
+              'connector.name=hive', None),
+             (os.path.join(self.catalog_dir, 'jmx.properties'),
+              None, 'connector.name=jmx'),
+             (os.path.join(self.conf_dir, 'config.properties'),
+              'a=b\n', 'a=c\n'),
+             (os.path.join(self.conf_dir, 'log.properties'), None, 'l=1\n'),
+             (os.path.join(self.conf_dir, 'node.properties'),
+              'x=y\n', 'z=y\n')),
+            drift)
+
+    def test_print_drift_groups_hosts(self):
+        drift = (('/etc/presto/config.properties', 'a=b\n', 'a=c\n'),)
+        results = {'master': (), 'slave1': drift, 'slave2': drift,
+                   'slave3': Exception('Timed out')}
+        configure_cmds.print_drift(['master', 'slave1', 'slave2', 'slave3'],
+                                   results)
+        self.assertEqual(
+            '1 of 4 hosts match the expected configuration\n'
+            '\n'
+            'slave1, slave2: 1 file differs from the expected configuration\n'
+            '/etc/presto/config.properties differs\n'
+            '--- expected /etc/presto/config.properties\n'
+            '+++ /etc/presto/config.properties\n'
+            '@@ -1 +1 @@\n'
+            '-a=b\n'
+            '+a=c\n',
+            self.test_stdout.getvalue())
+        self.assertTrue('Could not check the configuration of slave3: '
+                        'Timed out' in self.test_stderr.getvalue())
+
+    def test_fetch_contents(self):
+        self.write(self.conf_dir, 'jvm.config', '-server\n\n')
+        jvm = os.path.join(self.conf_dir, 'jvm.config')
+        log = os.path.join(self.conf_dir, 'log.properties')
+        self.assertEqual({jvm: '-server\n\n', log: None},
+                         configure_cmds.fetch_contents([jvm, log]))
@@ -15,6 +15,10 @@
 """
 tests for connector module
 """
+import os
+import shutil
+import tempfile
+
 import fabric.api
 from fabric.operations import _AttributeString
 from mock import patch
@@ -24,6 +28,7 @@ from prestoadmin.util import constants
 from prestoadmin.util.exception import ConfigurationError,\
     ConfigFileNotFoundError
 from tests.base_test_case import BaseTestCase
+from tests.unit.shell import quiet_shell
 
 
 class TestConnector(BaseTestCase):
@@ -144,15 +149,49 @@ class TestConnector(BaseTestCase):
         self.assertRaisesRegexp(OSError, 'Permission denied',
                                 connector.remove, 'tpch')
 
-    @patch('prestoadmin.connector.sudo')
-    @patch('prestoadmin.connector.put')
-    def test_deploy_files(self, put_mock, sudo_mock):
+    @patch('prestoadmin.connector.bandwidth.throttle')
+    @patch('prestoadmin.connector.RemoteBatch.run')
+    @patch('__builtin__.open')
+    def test_deploy_files(self, open_mock, run_mock, throttle_mock):
+        file_manager = open_mock.return_value.__enter__.return_value
+        file_manager.read.side_effect = ['contents of a', 'contents of b']
+        run_mock.return_value = ['', 'written', '']
         local_dir = '/my/local/dir'
         remote_dir = '/my/remote/dir'
-        connector.deploy_files(['a', 'b'], local_dir, remote_dir)
-        sudo_mock.assert_called_with('mkdir -p %s' % remote_dir)
-        put_mock.assert_any_call('/my/local/dir/a', remote_dir, use_sudo=True)
-        put_mock.assert_any_call('/my/local/dir/b', remote_dir, use_sudo=True)
+        written = connector.deploy_files(['a', 'b'], local_dir, remote_dir)
+        open_mock.assert_any_call('/my/local/dir/a')
+        open_mock.assert_any_call('/my/local/dir/b')
+        # One round trip creates the directory and writes both files
+        run_mock.assert_called_once_with(use_sudo=True)
+        self.assertEqual(26, throttle_mock.call_args[0][0])
+        self.assertEqual(['a'], written)
+
+    @patch('prestoadmin.util.remote_batch.sudo', quiet_shell)
+    @patch('prestoadmin.connector.bandwidth.throttle')
+    def test_deploy_files_only_changed(self, throttle_mock):
+        local_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local_dir)
+        remote_dir = os.path.join(local_dir, 'catalog')
+        os.mkdir(remote_dir)
+        for directory, name, content in [
+                (local_dir, 'a.properties', 'connector.name=a'),
+                (local_dir, 'b.properties', 'connector.name=b'),
+                (remote_dir, 'a.properties', 'connector.name=a'),
+                (remote_dir, 'b.properties', 'connector.name=x')]:
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(content)
+        self.assertEqual(['b.properties'],
+                         connector.deploy_files(
+                             ['a.properties', 'b.properties'], local_dir,
+                             remote_dir))
+        with open(os.path.join(remote_dir, 'b.properties')) as f:
+            self.assertEqual('connector.name=b', f.read())
+        mtime = os.path.getmtime(os.path.join(remote_dir, 'a.properties'))
+        self.assertEqual([], connector.deploy_files(
+            ['a.properties', 'b.properties'], local_dir, remote_dir))
+        self.assertEqual(mtime, os.path.getmtime(
+            os.path.join(remote_dir, 'a.properties')))
+        throttle_mock.assert_called_with(32)
 
     @patch('prestoadmin.connector.os.path.isfile')
     @patch("__builtin__.open")
@@ -171,3 +171,60 @@ class TestCoordinator(BaseTestCase):
                     }
 
         self.assertEqual(coordinator.get_conf(), expected)
+
+    def test_build_cluster_defaults(self):
+        nodes = [{'query.max-memory-per-node': '8GB',
+                  'task.max-worker-threads': '64'},
+                 {'query.max-memory-per-node': '4GB',
+                  'task.max-worker-threads': '32'},
+                 {'query.max-memory-per-node': '512MB',
+                  'task.max-worker-threads': '48'}]
+        self.assertEqual({'query.max-memory': '12800MB',
+                          'query.initial-hash-partitions': '3',
+                          'node-scheduler.max-splits-per-node': '64'},
+                         coordinator.build_cluster_defaults(nodes))
+        self.assertEqual({'query.max-memory': '2GB',
+                          'query.initial-hash-partitions': '2'},
+                         coordinator.build_cluster_defaults(
+                             [{'query.max-memory-per-node': '1GB'}] * 2))
+        self.assertEqual({}, coordinator.build_cluster_defaults([]))
+
+    def test_apply_cluster_defaults(self):
+        conf = {'config.properties': {'coordinator': 'true',
+                                      'query.max-memory': '50GB'}}
+        nodes = [{'query.max-memory-per-node': '1GB'}] * 3
+        result = coordinator.apply_cluster_defaults(conf, {}, nodes)
+        self.assertEqual({'coordinator': 'true',
+                          'query.max-memory': '3GB',
+                          'query.initial-hash-partitions': '3'},
+                         result['config.properties'])
+        self.assertEqual('50GB', conf['config.properties']['query.max-memory'])
+
+    def test_apply_cluster_defaults_local_settings_win(self):
+        self.capture_stdout_stderr()
+        conf = {'config.properties': {'coordinator': 'true',
+                                      'query.max-memory': '50GB'}}
+        local_conf = {'config.properties': {'query.max-memory': '50GB'}}
+        nodes = [{'query.max-memory-per-node': '1GB'}] * 3
+        result = coordinator.apply_cluster_defaults(conf, local_conf, nodes)
+        self.assertEqual('50GB',
+                         result['config.properties']['query.max-memory'])
+        self.assertTrue('query.max-memory of 50GB is more than the 3GB that '
+                        'the 3 nodes running tasks allow a query in total'
+                        in self.test_stderr.getvalue())
+
+    def test_cluster_defaults_invalid_data_size(self):
+        conf = {'config.properties': {'coordinator': 'true'}}
+        nodes = [{'query.max-memory-per-node': '1gb'}]
+        self.assertRaisesRegexp(ConfigurationError,
+                                'Invalid value for query.max-memory-per-node '
+                                'in config.properties: 1gb',
+                                coordinator.apply_cluster_defaults, conf, {},
+                                nodes)
+        conf['config.properties']['query.max-memory'] = '50 gigs'
+        self.assertRaisesRegexp(ConfigurationError,
+                                'Invalid value for query.max-memory in '
+                                'config.properties: 50 gigs',
+                                coordinator.check_cluster_memory,
+                                conf['config.properties'],
+                                [{'query.max-memory-per-node': '1GB'}])
@@ -15,11 +15,18 @@
 """
 Tests deploying the presto configuration
 """
+import os
+import shutil
+import tempfile
+
 from mock import patch
 
 from fabric.api import env
-from prestoadmin import deploy
+from prestoadmin import deploy, sizing
+from prestoadmin.util.remote_batch import RemoteBatch
+from prestoadmin.util.remote_digests import Summary
 from tests.base_test_case import BaseTestCase
+from tests.unit.shell import quiet_shell
 
 
 class TestDeploy(BaseTestCase):
@@ -40,46 +47,20 @@ class TestDeploy(BaseTestCase):
         conf = 1
         self.assertEqual(deploy.output_format(conf), str(conf))
 
-    @patch('prestoadmin.deploy.configure_presto')
-    @patch('prestoadmin.deploy.util.get_coordinator_role')
-    @patch('prestoadmin.deploy.env')
-    def test_worker_is_coordinator(self, env_mock, coord_mock, configure_mock):
-        env_mock.host = "my.host"
-        coord_mock.return_value = ["my.host"]
-        deploy.workers()
-        assert not configure_mock.called
+    def test_deploy(self):
+        files = {"jvm.config": "a=b"}
+        batch = RemoteBatch()
+        deploy.deploy(files, "/my/remote/dir", batch)
+        self.assertEqual(["mkdir -p /my/remote/dir",
+                          "printf %s 'a=b\n' > /my/remote/dir/jvm.config"],
+                         batch.commands())
 
-    @patch('prestoadmin.deploy.w.get_conf')
-    @patch('prestoadmin.deploy.configure_presto')
-    def test_worker_not_coordinator(self,  configure_mock, get_conf_mock):
-        env.host = "my.host1"
-        env.roledefs["worker"] = ["my.host1"]
-        env.roledefs["coordinator"] = ["my.host2"]
-        deploy.workers()
-        assert configure_mock.called
-
-    @patch('prestoadmin.deploy.configure_presto')
-    @patch('prestoadmin.deploy.coord.get_conf')
-    def test_coordinator(self, coord_mock, configure_mock):
-        env.roledefs['coordinator'] = ['master']
-        env.host = 'master'
-        coord_mock.return_value = {}
-        deploy.coordinator()
-        assert configure_mock.called
+    @patch('prestoadmin.deploy.RemoteBatch.run')
+    def test_deploy_runs_batch(self, run_mock):
+        deploy.deploy({"jvm.config": "a=b"}, "/my/remote/dir")
+        run_mock.assert_called_with(use_sudo=True)
 
-    @patch('prestoadmin.deploy.sudo')
-    def test_deploy(self, sudo_mock):
-        files = {"jvm.config": "a=b"}
-        deploy.deploy(files, "/my/remote/dir")
-        sudo_mock.assert_any_call("mkdir -p /my/remote/dir")
-        sudo_mock.assert_any_call("echo 'a=b' > /my/remote/dir/jvm.config")
-
-    @patch('__builtin__.open')
-    @patch('prestoadmin.deploy.files.append')
-    @patch('prestoadmin.deploy.sudo')
-    def test_deploy_node_properties(self, sudo_mock, append_mock, open_mock):
-        file_manager = open_mock.return_value.__enter__.return_value
-        file_manager.read.return_value = ("key=value")
+    def test_deploy_node_properties(self):
         command = (
             "if ! ( grep -q -s 'node.id' /my/remote/dir/node.properties ); "
             "then "
@@ -87,25 +68,314 @@ class TestDeploy(BaseTestCase):
             "echo node.id=$uuid >> /my/remote/dir/node.properties;"
             "fi; "
             "sed -i '/node.id/!d' /my/remote/dir/node.properties; ")
-        deploy.deploy_node_properties("key=value", "/my/remote/dir")
-        sudo_mock.assert_called_with(command)
-        append_mock.assert_called_with("/my/remote/dir/node.properties",
-                                       "key=value", True)
+        batch = RemoteBatch()
+        deploy.deploy_node_properties("key=value", "/my/remote/dir", batch)
+        self.assertEqual(
+            [command,
+             "grep -q -s -x -F -e 'key=value' /my/remote/dir/node.properties"
+             " || echo 'key=value' >> /my/remote/dir/node.properties"],
+            batch.commands())
+
+    @patch('prestoadmin.util.remote_batch.sudo', quiet_shell)
+    def test_configure_rendered_writes_changed_files(self):
+        env.host = 'localhost'
+        remote_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, remote_dir)
+        self.write(remote_dir, 'node.properties', 'node.id=abc\nold=1\n')
+        self.write(remote_dir, 'jvm.config', 'list\n')
+        self.write(remote_dir, 'config.properties', 'a=c\n')
+        self.write(remote_dir, 'log.properties', 'com.facebook=INFO\n')
+        self.write(remote_dir, 'other.properties', 'x=y\n')
+        conf = {'node.properties': {'key': 'value'}, 'jvm.config': ['list'],
+                'config.properties': {'a': 'b'}}
+
+        summary = deploy.configure_rendered(deploy.render_conf(conf),
+                                            remote_dir)
+
+        self.assertEqual(Summary(['config.properties', 'node.properties'],
+                                 ['jvm.config'], ['log.properties']),
+                         summary)
+        self.assertEqual('a=b\n', self.read(remote_dir, 'config.properties'))
+        self.assertEqual('node.id=abc\nkey=value\n',
+                         self.read(remote_dir, 'node.properties'))
+        # log.properties has no local copy, but is left on the host
+        self.assertEqual('com.facebook=INFO\n',
+                         self.read(remote_dir, 'log.properties'))
+        self.assertEqual(['config.properties', 'jvm.config',
+                          'log.properties', 'node.properties',
+                          'other.properties'],
+                         sorted(os.listdir(remote_dir)))
+
+    @patch('prestoadmin.util.remote_batch.sudo', quiet_shell)
+    @patch('prestoadmin.deploy.deploy_node_properties')
+    @patch('prestoadmin.deploy.deploy')
+    def test_configure_rendered_unchanged(self, deploy_mock, node_mock):
+        env.host = 'localhost'
+        remote_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, remote_dir)
+        self.write(remote_dir, 'node.properties', 'node.id=abc\nkey=value\n')
+        self.write(remote_dir, 'jvm.config', 'list\n')
+        conf = {'node.properties': {'key': 'value'}, 'jvm.config': ['list']}
+
+        summary = deploy.configure_rendered(deploy.render_conf(conf),
+                                            remote_dir)
 
+        self.assertEqual(Summary([], ['jvm.config', 'node.properties'], []),
+                         summary)
+        self.assertFalse(deploy_mock.called)
+        self.assertFalse(node_mock.called)
+
+    @patch('prestoadmin.deploy.RemoteBatch.run')
     @patch('prestoadmin.deploy.deploy')
     @patch('prestoadmin.deploy.deploy_node_properties')
-    def test_configure_presto(self, deploy_node_mock, deploy_mock):
+    def test_configure_rendered_new_node_id(self, deploy_node_mock,
+                                            deploy_mock, run_mock):
         env.host = 'localhost'
+        run_mock.return_value = ['', '']
         conf = {"node.properties": {"key": "value"}, "jvm.config": ["list"]}
         remote_dir = "/my/remote/dir"
-        deploy.configure_presto(conf, remote_dir)
-        deploy_mock.assert_called_with({"jvm.config": "list"}, remote_dir)
+        summary = deploy.configure_rendered(deploy.render_conf(conf),
+                                            remote_dir)
+        batch = deploy_mock.call_args[0][2]
+        deploy_mock.assert_called_with({"jvm.config": "list"}, remote_dir,
+                                       batch)
+        deploy_node_mock.assert_called_with("key=value", remote_dir, batch)
+        self.assertEqual(2, run_mock.call_count)
+        self.assertEqual(['jvm.config', 'node.properties'], summary.changed)
+
+    @patch('prestoadmin.deploy.warn')
+    def test_configure_hosts(self, warn_mock):
+        self.capture_stdout_stderr()
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['master', 'slave1']
+        remote_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, remote_dir)
+        self.write(remote_dir, 'node.properties', 'node.id=abc\n')
+        self.write(remote_dir, 'jvm.config', 'list\n')
+        rendered = {deploy.COORDINATOR: deploy.RenderedConf(
+            (('jvm.config', 'list'), ('config.properties', 'a=b')),
+            'key=value')}
+        rounds = []
+
+        def run_commands(commands, use_sudo=False):
+            rounds.append(sorted(commands))
+            return dict((host, quiet_shell(command))
+                        for host, command in commands.items())
+
+        with patch('prestoadmin.deploy.constants.REMOTE_CONF_DIR',
+                   remote_dir), \
+                patch('prestoadmin.util.remote_batch.fanout.run_commands',
+                      run_commands):
+            results = deploy.configure_hosts(rendered, ['master', 'slave1',
+                                                        'other'])
+            # Deploying again reads the digests and writes nothing
+            again = deploy.configure_hosts(rendered, ['master'])
+
+        self.assertEqual([['master'], ['master'], ['master']], rounds)
+        self.assertEqual(['master'], results.keys())
+        self.assertEqual(Summary(['config.properties', 'node.properties'],
+                                 ['jvm.config'], []), results['master'])
+        self.assertEqual(Summary([], ['config.properties', 'jvm.config',
+                                      'node.properties'], []),
+                         again['master'])
+        self.assertEqual('a=b\n', self.read(remote_dir, 'config.properties'))
+        self.assertEqual('node.id=abc\nkey=value\n',
+                         self.read(remote_dir, 'node.properties'))
+
+    @patch('prestoadmin.deploy.warn')
+    @patch('prestoadmin.deploy.run_batches')
+    def test_configure_hosts_unreachable(self, run_batches_mock, warn_mock):
+        self.capture_stdout_stderr()
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1']
+        rendered = {deploy.WORKERS: deploy.RenderedConf((), 'key=value')}
+        error = Exception('Timed out')
+        run_batches_mock.side_effect = [{'slave1': error}, {}]
+        results = deploy.configure_hosts(rendered, ['master', 'slave1'])
+        self.assertEqual({'slave1': error}, results)
+        warn_mock.assert_called_with('Could not deploy the configuration: '
+                                     'Timed out')
+        self.assertEqual('Deploying configuration on: slave1\n',
+                         self.test_stdout.getvalue())
+
+    def test_node_properties_content(self):
+        self.assertEqual('node.id=abc\na=b\nc=d\n',
+                         deploy.node_properties_content(
+                             ['node.id=abc'], 'a=b\nc=d\na=b'))
 
-    def test_escape_quotes_do_nothing(self):
-        text = 'basic_text'
-        self.assertEqual('basic_text', deploy.escape_single_quotes(text))
+    @staticmethod
+    def write(directory, name, content):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(content)
 
-    def test_escape_quotes_has_quote(self):
-        text = "A quote! ' A quote!"
-        self.assertEqual("A quote! '\\'' A quote!",
-                         deploy.escape_single_quotes(text))
+    @staticmethod
+    def read(directory, name):
+        with open(os.path.join(directory, name)) as f:
+            return f.read()
+
+    @patch('prestoadmin.deploy.w.get_conf')
+    @patch('prestoadmin.deploy.coord.get_local_conf')
+    @patch('prestoadmin.deploy.coord.get_conf')
+    def test_render_once_per_role(self, coord_mock, local_mock,
+                                  workers_mock):
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1', 'slave2']
+        coord_mock.return_value = {'node.properties': {'a': 'b'},
+                                   'jvm.config': ['-server'],
+                                   'config.properties': {}}
+        local_mock.return_value = {}
+        workers_mock.return_value = {
+            'node.properties': {'c': 'd'},
+            'jvm.config': ['-client'],
+            'config.properties': {'query.max-memory-per-node': '1GB'}}
+        rendered = deploy.render(['master', 'slave1', 'slave2'])
+        self.assertEqual(1, coord_mock.call_count)
+        self.assertEqual(1, workers_mock.call_count)
+        self.assertEqual(deploy.RenderedConf(
+            (('config.properties', 'query.initial-hash-partitions=2\n'
+                                   'query.max-memory=2GB'),
+             ('jvm.config', '-server')), 'a=b'), rendered['coordinator'])
+        self.assertEqual('c=d', rendered['workers'].node_properties)
+
+    @patch('prestoadmin.deploy.w.get_conf')
+    @patch('prestoadmin.deploy.coord.get_local_conf')
+    @patch('prestoadmin.deploy.coord.get_conf')
+    def test_render_only_roles_of_hosts(self, coord_mock, local_mock,
+                                        workers_mock):
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['master', 'slave1']
+        coord_mock.return_value = {
+            'node.properties': {}, 'jvm.config': [],
+            'config.properties': {
+                'node-scheduler.include-coordinator': 'true',
+                'query.max-memory-per-node': '1GB'}}
+        local_mock.return_value = {}
+        workers_mock.return_value = {
+            'config.properties': {'query.max-memory-per-node': '2GB'}}
+        rendered = deploy.render(['master'])
+        self.assertEqual(['coordinator'], rendered.keys())
+        # The workers are only read to derive the limits of the cluster
+        self.assertTrue('query.max-memory=3GB' in
+                        dict(rendered['coordinator'].files)[
+                            'config.properties'])
+        self.assertEqual({}, deploy.render(['slave1'], ['coordinator']))
+
+    @patch('prestoadmin.deploy.w.get_conf')
+    @patch('prestoadmin.deploy.coord.get_local_conf')
+    @patch('prestoadmin.deploy.coord.get_conf')
+    def test_render_cluster_limits_explicit(self, coord_mock, local_mock,
+                                            workers_mock):
+        self.capture_stdout_stderr()
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1', 'slave2']
+        coord_mock.return_value = {
+            'node.properties': {}, 'jvm.config': [],
+            'config.properties': {'query.max-memory': '50GB'}}
+        local_mock.return_value = {
+            'config.properties': {'query.max-memory': '50GB'}}
+        workers_mock.return_value = {
+            'config.properties': {'query.max-memory-per-node': '1GB'}}
+        rendered = deploy.render(['master'])
+        self.assertTrue('query.max-memory=50GB' in
+                        dict(rendered['coordinator'].files)[
+                            'config.properties'])
+        self.assertTrue('query.max-memory of 50GB is more than the 2GB' in
+                        self.test_stderr.getvalue())
+
+    @patch('prestoadmin.deploy.sizing.gather')
+    @patch('prestoadmin.deploy.w.get_local_conf')
+    @patch('prestoadmin.deploy.w.get_conf')
+    def test_render_sized(self, workers_mock, local_mock, gather_mock):
+        self.capture_stdout_stderr()
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1', 'slave2']
+        env.sizing = {}
+        workers_mock.return_value = {
+            'node.properties': {},
+            'jvm.config': ['-server', '-Xmx16G'],
+            'config.properties': {'coordinator': 'false',
+                                  'task.concurrency': '4'}}
+        local_mock.return_value = {
+            'config.properties': {'task.concurrency': '4'}}
+        gather_mock.return_value = {
+            'slave1': sizing.HostFacts(8 * sizing.GB, 4, 1)}
+        rendered = deploy.render(['slave1', 'slave2'], ['workers'])
+        gather_mock.assert_called_once_with(['slave1', 'slave2'])
+        self.assertEqual(['slave1'], rendered[deploy.HOSTS].keys())
+        files = dict(rendered[deploy.HOSTS]['slave1'].files)
+        self.assertEqual('-server\n-Xmx5G', files['jvm.config'])
+        self.assertEqual('coordinator=false\n'
+                         'query.max-memory-per-node=2560MB\n'
+                         'task.concurrency=4\n'
+                         'task.max-worker-threads=8',
+                         files['config.properties'])
+        self.assertTrue('Sizing slave1: 8 GB of memory, 4 cores, 1 NUMA '
+                        'node' in self.test_stdout.getvalue())
+
+    @patch('prestoadmin.deploy.sizing.gather')
+    @patch('prestoadmin.deploy.w.get_local_conf')
+    @patch('prestoadmin.deploy.w.get_conf')
+    @patch('prestoadmin.deploy.coord.get_local_conf')
+    @patch('prestoadmin.deploy.coord.get_conf')
+    def test_render_sized_coordinator(self, coord_mock, coord_local_mock,
+                                      workers_mock, workers_local_mock,
+                                      gather_mock):
+        self.capture_stdout_stderr()
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1', 'slave2']
+        env.sizing = {}
+        coord_mock.return_value = {
+            'node.properties': {},
+            'jvm.config': ['-server'],
+            'config.properties': {'coordinator': 'true',
+                                  'query.max-memory': '50GB'}}
+        coord_local_mock.return_value = {}
+        workers_mock.return_value = {
+            'node.properties': {},
+            'jvm.config': ['-server'],
+            'config.properties': {'coordinator': 'false',
+                                  'query.max-memory-per-node': '1GB'}}
+        workers_local_mock.return_value = {}
+        gather_mock.return_value = {
+            'master': sizing.HostFacts(8 * sizing.GB, 4, 1),
+            'slave1': sizing.HostFacts(15 * sizing.GB, 8, 1)}
+        rendered = deploy.render(['master'], ['coordinator'])
+        # The workers are sized to derive the limits of the coordinator,
+        # but their configuration is not rendered
+        gather_mock.assert_called_once_with(['master', 'slave1', 'slave2'])
+        self.assertEqual(['master'], rendered[deploy.HOSTS].keys())
+        files = dict(rendered[deploy.HOSTS]['master'].files)
+        # slave1 is sized to 5GB, slave2 keeps the 1GB of the workers
+        self.assertEqual('coordinator=true\n'
+                         'query.initial-hash-partitions=2\n'
+                         'query.max-memory-per-node=2560MB\n'
+                         'query.max-memory=6GB\n'
+                         'task.concurrency=4\n'
+                         'task.max-worker-threads=8',
+                         files['config.properties'])
+        self.assertTrue('Sizing master for 2 nodes running tasks: '
+                        'query.initial-hash-partitions=2, '
+                        'query.max-memory=6GB'
+                        in self.test_stdout.getvalue())
+        self.assertFalse('Sizing slave1' in self.test_stdout.getvalue())
+
+    def test_host_conf_sized(self):
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1', 'slave2']
+        rendered = {'workers': deploy.RenderedConf((), 'c=d'),
+                    deploy.HOSTS: {'slave1': deploy.RenderedConf((), 'e=f')}}
+        env.host = 'slave1'
+        self.assertEqual('e=f', deploy.host_conf(rendered).node_properties)
+        env.host = 'slave2'
+        self.assertEqual('c=d', deploy.host_conf(rendered).node_properties)
+
+    @patch('prestoadmin.deploy.configure_rendered')
+    def test_configure_host(self, configure_mock):
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1']
+        env.host = 'slave1'
+        rendered = {'coordinator': deploy.RenderedConf((), 'a=b'),
+                    'workers': deploy.RenderedConf((), 'c=d')}
+        deploy.configure_host(rendered)
+        configure_mock.assert_called_once_with(rendered['workers'],
+                                               '/etc/presto')
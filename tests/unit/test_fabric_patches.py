@@ -17,7 +17,7 @@ import logging
 from fabric import state
 from fabric.context_managers import hide, settings
 from fabric.decorators import hosts, parallel, roles, serial
-from fabric.exceptions import NetworkError
+from fabric.exceptions import CommandTimeout, NetworkError
 from fabric.tasks import Task
 from fudge import Fake, patched_context, with_fakes, clear_expectations
 from fabric.state import env
@@ -30,6 +30,7 @@ from tests.base_test_case import BaseTestCase
 
 from prestoadmin.util.application import Application
 from prestoadmin.fabric_patches import execute
+from prestoadmin.util import threadpool
 
 
 APPLICATION_NAME = 'foo'
@@ -431,6 +432,69 @@ class TestExecute(BaseTestCase):
         self.assertEqual(retval, {'127.0.0.1:2200': '2200',
                                   '127.0.0.1:2201': '2201'})
 
+    def test_parallel_return_values_thread_engine(self):
+        """
+        The thread engine should return values as in the process engine
+        """
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            return env.host_string.split(':')[1]
+        with settings(hide('everything'), engine='threads'):
+            retval = execute(task)
+        self.assertEqual(retval, {'127.0.0.1:2200': '2200',
+                                  '127.0.0.1:2201': '2201'})
+        # env is only thread-local while the threads run
+        self.assertFalse(isinstance(env, threadpool.ThreadLocalEnv))
+
+    def test_on_result_serial(self):
+        """
+        on_result should be called for each host and not passed to the task
+        """
+        streamed = []
+
+        @hosts('a', 'b')
+        def task():
+            return env.host_string
+
+        with hide('everything'):
+            retval = execute(task, on_result=lambda host, result:
+                             streamed.append((host, result)))
+        self.assertEqual(streamed, [('a', 'a'), ('b', 'b')])
+        self.assertEqual(retval, dict(streamed))
+
+    def test_on_result_parallel(self):
+        """
+        on_result should be called in the parent as each host finishes
+        """
+        streamed = []
+
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            return env.host_string.split(':')[1]
+        with settings(hide('everything'), engine='threads'):
+            execute(task, on_result=lambda host, result:
+                    streamed.append((host, result)))
+        self.assertEqual(sorted(streamed), [('127.0.0.1:2200', '2200'),
+                                            ('127.0.0.1:2201', '2201')])
+
+    @patch('prestoadmin.fabric_patches.tracing.record')
+    def test_task_traced(self, record_mock):
+        """
+        a span should be recorded for the task on each host
+        """
+        @hosts('a', 'b')
+        def task():
+            pass
+
+        with settings(hide('everything'), trace_file='trace.json'):
+            execute(task)
+        self.assertEqual(2, record_mock.call_count)
+        for args, kwargs in record_mock.call_args_list:
+            self.assertEqual('task', args[0])
+            self.assertEqual(0, kwargs['exit_code'])
+
     @with_fakes
     def test_should_work_with_Task_subclasses(self):
         """
@@ -482,6 +546,43 @@ class TestExecute(BaseTestCase):
         self.assertEqual(type(args[1]['exception']), type(value_error))
         self.assertEqual(args[1]['exception'].args, value_error.args)
 
+    @patch('prestoadmin.fabric_patches.error')
+    def test_timeout_fails_task(self, error_mock):
+        """
+        a host timing out should fail the task by default
+        """
+        fabric.state.env.warn_only = False
+
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            if env.host_string.endswith('2201'):
+                raise CommandTimeout(10)
+            return 'done'
+        with hide('everything'):
+            execute(task)
+        error_mock.assert_called_with(
+            'Timed out running task on 127.0.0.1:2201')
+
+    @patch('prestoadmin.fabric_patches.warn')
+    def test_timeout_policy_continue(self, warn_mock):
+        """
+        with the continue policy, the results of the other hosts should be
+        returned
+        """
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            if env.host_string.endswith('2201'):
+                raise CommandTimeout(10)
+            return 'done'
+        with settings(hide('everything'), timeout_policy='continue'):
+            results = execute(task)
+        warn_mock.assert_called_with(
+            'Timed out running task on 127.0.0.1:2201')
+        self.assertEqual('done', results['127.0.0.1:2200'])
+        self.assertTrue(isinstance(results['127.0.0.1:2201'], CommandTimeout))
+
     def test_abort_should_not_raise_error(self):
         """
         base exception should call error
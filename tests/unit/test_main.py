@@ -361,6 +361,15 @@ class TestMain(BaseTestCase):
                                           "local_path"])
         self.assertEqual(env.parallel, True)
 
+    def test_env_engine(self):
+        main.parse_and_validate_commands(['server', 'install',
+                                          "local_path"])
+        self.assertEqual(env.engine, 'processes')
+
+        main.parse_and_validate_commands(['server', 'install',
+                                          "local_path", "--engine=threads"])
+        self.assertEqual(env.engine, 'threads')
+
     def test_set_vars(self):
         main.parse_and_validate_commands(
             ['--set', 'skip_bad_hosts,shell=,hosts=m\,slave1\,slave2,'
@@ -12,26 +12,116 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
+
 from fabric.state import env
 from fabric.operations import _AttributeString
-from mock import patch
+from mock import Mock, patch
 from prestoadmin import package
 from prestoadmin.util import constants
 from tests.base_test_case import BaseTestCase
 
 
+def result(output='', failed=False):
+    out = _AttributeString(output)
+    out.failed = failed
+    out.succeeded = not failed
+    return out
+
+
 class TestPackage(BaseTestCase):
 
+    def setUp(self):
+        super(TestPackage, self).setUp()
+        sha256_patcher = patch('prestoadmin.package.sha256',
+                               return_value='0123abcd')
+        sha256_patcher.start()
+        self.addCleanup(sha256_patcher.stop)
+
+    @patch('prestoadmin.package.add_to_cache')
     @patch('prestoadmin.package.sudo')
-    @patch('prestoadmin.package.put')
-    def test_deploy_is_called(self, mock_put, mock_sudo):
+    @patch('prestoadmin.package.put_resumable')
+    def test_deploy_is_called(self, mock_put, mock_sudo, mock_add):
         env.host = 'any_host'
+        mock_sudo.return_value = result(failed=True)
         package.deploy('/any/path/rpm')
-        mock_sudo.assert_called_with('mkdir -p ' +
-                                     constants.REMOTE_PACKAGES_PATH)
+        mock_sudo.assert_called_with(
+            'mkdir -p /opt/prestoadmin/packages/sha256 && '
+            'test -f /opt/prestoadmin/packages/sha256/0123abcd && '
+            'ln -f /opt/prestoadmin/packages/sha256/0123abcd '
+            '/opt/prestoadmin/packages/rpm && '
+            'touch /opt/prestoadmin/packages/sha256/0123abcd', quiet=True)
         mock_put.assert_called_with('/any/path/rpm',
-                                    constants.REMOTE_PACKAGES_PATH,
+                                    '/opt/prestoadmin/packages/rpm',
                                     use_sudo=True)
+        mock_add.assert_called_with('/opt/prestoadmin/packages/rpm',
+                                    '0123abcd')
+
+    @patch('prestoadmin.package.add_to_cache')
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.put_resumable')
+    def test_deploy_from_cache(self, mock_put, mock_sudo, mock_add):
+        env.host = 'any_host'
+        mock_sudo.return_value = result()
+        package.deploy('/any/path/rpm')
+        self.assertFalse(mock_put.called)
+        self.assertFalse(mock_add.called)
+
+    @patch('prestoadmin.package.add_to_cache')
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.put_resumable')
+    def test_deploy_skipped_if_relayed(self, mock_put, mock_sudo, mock_add):
+        env.host = 'any_host'
+        env.host_string = 'any_host'
+        env.relayed_files = {
+            constants.REMOTE_PACKAGES_PATH + '/rpm': set(['any_host'])}
+        package.deploy('/any/path/rpm')
+        self.assertFalse(mock_put.called)
+        self.assertFalse(mock_sudo.called)
+        mock_add.assert_called_with('/opt/prestoadmin/packages/rpm',
+                                    '0123abcd')
+
+    @patch('prestoadmin.package.pull.fetch', return_value=True)
+    @patch('prestoadmin.package.pull.is_served', return_value=True)
+    @patch('prestoadmin.package.add_to_cache')
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.put_resumable')
+    def test_deploy_pulled(self, mock_put, mock_sudo, mock_add, *mocks):
+        env.host = 'any_host'
+        mock_sudo.return_value = result(failed=True)
+        package.deploy('/any/path/rpm')
+        self.assertFalse(mock_put.called)
+        mock_add.assert_called_with('/opt/prestoadmin/packages/rpm',
+                                    '0123abcd')
+
+    @patch('prestoadmin.package.pull.fetch', return_value=False)
+    @patch('prestoadmin.package.pull.is_served', return_value=True)
+    @patch('prestoadmin.package.add_to_cache')
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.put_resumable')
+    def test_deploy_uploaded_if_pull_fails(self, mock_put, mock_sudo,
+                                           mock_add, *mocks):
+        env.host = 'any_host'
+        mock_sudo.return_value = result(failed=True)
+        package.deploy('/any/path/rpm')
+        mock_put.assert_called_with('/any/path/rpm',
+                                    '/opt/prestoadmin/packages/rpm',
+                                    use_sudo=True)
+
+    @patch('prestoadmin.package.RemoteBatch.run')
+    def test_add_to_cache(self, mock_run):
+        env.host = 'any_host'
+        mock_run.return_value = [result(), result()]
+        package.add_to_cache('/opt/prestoadmin/packages/rpm', '0123abcd')
+        mock_run.assert_called_with(use_sudo=True)
+
+    @patch('prestoadmin.package.RemoteBatch.run')
+    def test_add_to_cache_digest_mismatch(self, mock_run):
+        env.host = 'any_host'
+        mock_run.return_value = [result(failed=True), result()]
+        self.assertRaises(SystemExit, package.add_to_cache,
+                          '/opt/prestoadmin/packages/rpm', '0123abcd')
 
     @patch('prestoadmin.package.sudo')
     def test_rpm_install(self, mock_sudo):
@@ -85,15 +175,48 @@ class TestPackage(BaseTestCase):
 
     @patch('prestoadmin.package.rpm_install')
     @patch('prestoadmin.package.deploy')
-    @patch('prestoadmin.package.check_if_valid_rpm')
-    def test_install(self, mock_chksum, mock_deploy, mock_install):
+    @patch('prestoadmin.package.preflight')
+    def test_install(self, mock_preflight, mock_deploy, mock_install):
         env.host = 'any_host'
+        env.hosts = ['any_host', 'other_host']
+        env.exclude_hosts = []
         self.remove_runs_once_flag(package.install)
         package.install('/any/path/rpm')
-        mock_chksum.assert_called_with('/any/path/rpm')
+        mock_preflight.assert_called_once_with('/any/path/rpm')
         mock_deploy.assert_called_with('/any/path/rpm')
         mock_install.assert_called_with('rpm')
 
+    @patch('prestoadmin.package.query_rpm')
+    @patch('prestoadmin.package.check_if_valid_rpm')
+    def test_preflight_once_per_file(self, mock_chksum, mock_query):
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        os.close(handle)
+        mock_query.return_value = ('presto-server-rpm', '0.130')
+        package.preflight(path)
+        rpm_info = package.preflight(path)
+        mock_chksum.assert_called_once_with(path)
+        self.assertEqual('presto-server-rpm', rpm_info.name)
+        self.assertEqual('0.130', rpm_info.version)
+        self.assertEqual('0123abcd', rpm_info.digest)
+
+    @patch('prestoadmin.package.local')
+    def test_query_rpm(self, mock_local):
+        mock_local.return_value = Mock(failed=False,
+                                       stdout='presto-server-rpm\t0.130\n',
+                                       stderr='')
+        self.assertEqual(('presto-server-rpm', '0.130'),
+                         package.query_rpm('/any/path/rpm'))
+
+    @patch('prestoadmin.package.sudo')
+    def test_rpm_upgrade_with_package_name(self, mock_sudo):
+        env.host = 'any_host'
+        env.nodeps = False
+        package.rpm_upgrade('test.rpm', 'presto-server-rpm')
+        mock_sudo.assert_any_call('rpm -e presto-server-rpm')
+        mock_sudo.assert_any_call('rpm -i /opt/prestoadmin/packages/test.rpm')
+        self.assertEqual(2, mock_sudo.call_count)
+
     @patch('prestoadmin.package.local')
     @patch('prestoadmin.package.abort')
     def test_check_rpm_checksum(self, mock_abort, mock_local):
@@ -120,14 +243,16 @@ class TestPackage(BaseTestCase):
         mock_abort.assert_called_with('Not an rpm package')
 
     @patch('prestoadmin.package.sudo')
-    @patch('prestoadmin.package.put')
-    def test_deploy_with_fallback_location(self, mock_put, mock_sudo):
+    @patch('prestoadmin.package.put_resumable')
+    @patch('prestoadmin.package.add_to_cache')
+    def test_deploy_with_fallback_location(self, mock_add, mock_put,
+                                           mock_sudo):
         env.host = 'any_host'
-        package.deploy('/any/path/rpm')
-        mock_put.return_value = lambda: None
-        setattr(mock_put.return_value, 'succeeded', False)
+        mock_sudo.return_value = result(failed=True)
+        mock_put.return_value = False
         package.deploy('/any/path/rpm')
         mock_put.assert_called_with('/any/path/rpm',
-                                    constants.REMOTE_PACKAGES_PATH,
+                                    '/opt/prestoadmin/packages/rpm',
                                     use_sudo=True,
                                     temp_dir='/tmp')
+        self.assertFalse(mock_add.called)
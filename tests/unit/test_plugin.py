@@ -15,21 +15,57 @@
 """
 unit tests for plugin module
 """
+from fabric.api import env
 from mock import patch
 from prestoadmin import plugin
 from tests.base_test_case import BaseTestCase
 
 
 class TestPlugin(BaseTestCase):
-    @patch('prestoadmin.plugin.write')
-    def test_add_jar(self, write_mock):
+    def setUp(self):
+        super(TestPlugin, self).setUp()
+        self.remove_runs_once_flag(plugin.add_jar)
+        env.hosts = ['master', 'slave1']
+        env.exclude_hosts = []
+
+    @patch('prestoadmin.plugin.sha256')
+    @patch('prestoadmin.plugin.execute')
+    def test_add_jar(self, execute_mock, sha256_mock):
         plugin.add_jar('/my/local/path.jar', 'hive-hadoop2')
-        write_mock.assert_called_with(
-            '/my/local/path.jar', '/usr/lib/presto/lib/plugin/hive-hadoop2')
+        execute_mock.assert_called_with(
+            plugin.deploy_jar, '/my/local/path.jar',
+            '/usr/lib/presto/lib/plugin/hive-hadoop2',
+            hosts=['master', 'slave1'])
+        sha256_mock.assert_called_with('/my/local/path.jar')
 
-    @patch('prestoadmin.plugin.write')
-    def test_add_jar_provide_dir(self, write_mock):
+    @patch('prestoadmin.plugin.sha256')
+    @patch('prestoadmin.plugin.execute')
+    def test_add_jar_provide_dir(self, execute_mock, sha256_mock):
         plugin.add_jar('/my/local/path.jar', 'hive-hadoop2',
                        '/etc/presto/plugin')
-        write_mock.assert_called_with('/my/local/path.jar',
-                                      '/etc/presto/plugin/hive-hadoop2')
+        execute_mock.assert_called_with(
+            plugin.deploy_jar, '/my/local/path.jar',
+            '/etc/presto/plugin/hive-hadoop2', hosts=['master', 'slave1'])
+
+    @patch('prestoadmin.plugin.put_resumable')
+    def test_write(self, put_mock):
+        env.host_string = 'master'
+        plugin.write('/my/local/path.jar', '/etc/presto/plugin/hive')
+        put_mock.assert_called_with('/my/local/path.jar',
+                                    '/etc/presto/plugin/hive/path.jar',
+                                    use_sudo=True)
+
+    @patch('prestoadmin.plugin.put_resumable', return_value=False)
+    def test_write_failed(self, put_mock):
+        env.host_string = 'master'
+        env.host = 'master'
+        self.assertRaises(SystemExit, plugin.write, '/my/local/path.jar',
+                          '/etc/presto/plugin/hive')
+
+    @patch('prestoadmin.plugin.put_resumable')
+    def test_write_skipped_if_relayed(self, put_mock):
+        env.host_string = 'master'
+        env.relayed_files = {'/etc/presto/plugin/hive/path.jar':
+                             set(['master'])}
+        plugin.write('/my/local/path.jar', '/etc/presto/plugin/hive')
+        self.assertFalse(put_mock.called)
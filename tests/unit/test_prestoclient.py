@@ -20,7 +20,8 @@ import socket
 from fabric.operations import _AttributeString
 from mock import patch, PropertyMock
 
-from prestoadmin.prestoclient import URL_TIMEOUT_MS, PrestoClient
+from prestoadmin.prestoclient import URL_TIMEOUT_MS, INFO_TIMEOUT, \
+    PrestoClient, get_server_info, is_started
 from prestoadmin.util.exception import InvalidArgumentError
 from tests.base_test_case import BaseTestCase
 
@@ -182,3 +183,26 @@ class TestPrestoClient(BaseTestCase):
         self.assertEqual(client.rows, [])
         self.assertEqual(client.next_uri, '')
         self.assertEqual(client.response_from_server, {})
+
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_get_server_info(self, conn_mock):
+        response = conn_mock.return_value.getresponse.return_value
+        response.status = 200
+        response.read.return_value = '{"starting": false, "uptime": "1m"}'
+        info = get_server_info('any_host', 8080)
+        conn_mock.assert_called_with('any_host', 8080, False, INFO_TIMEOUT)
+        conn_mock.return_value.request.assert_called_with('GET', '/v1/info')
+        self.assertEqual({'starting': False, 'uptime': '1m'}, info)
+        self.assertTrue(is_started(info))
+        self.assertFalse(is_started({'starting': True}))
+        self.assertTrue(conn_mock.return_value.close.called)
+
+    @patch('prestoadmin.prestoclient.HTTPConnection')
+    def test_get_server_info_not_up(self, conn_mock):
+        conn_mock.return_value.request.side_effect = \
+            socket.error('Connection refused')
+        self.assertEqual(None, get_server_info('any_host', 8080))
+        conn_mock.return_value.request.side_effect = None
+        conn_mock.return_value.getresponse.return_value.status = 503
+        self.assertEqual(None, get_server_info('any_host', 8080))
+        self.assertFalse(is_started(None))
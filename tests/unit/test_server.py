@@ -19,18 +19,64 @@ import os
 
 from fabric.api import env
 from fabric.operations import _AttributeString
-from mock import patch, call, MagicMock
+from mock import patch, MagicMock
 
 from prestoadmin.prestoclient import PrestoClient
 from prestoadmin import server
-from prestoadmin.server import INIT_SCRIPTS, SLEEP_INTERVAL, \
-    PRESTO_RPM_MIN_REQUIRED_VERSION
+from prestoadmin.server import INIT_SCRIPTS, PRESTO_RPM_MIN_REQUIRED_VERSION
 from prestoadmin.util import constants
-from prestoadmin.util.exception import ConfigFileNotFoundError, \
-    ConfigurationError
+from prestoadmin.util.exception import ConfigFileNotFoundError
 from tests.base_test_case import BaseTestCase
 
 
+def result(output, return_code=0):
+    out = _AttributeString(output)
+    out.return_code = return_code
+    out.succeeded = return_code == 0
+    out.failed = not out.succeeded
+    return out
+
+
+VERSION = result('0.116')
+# Results of the version check, the port lookup and the listening sockets
+PORT_FREE = [VERSION, result('', 1),
+             result('tcp 0 0 0.0.0.0:22 0.0.0.0:* LISTEN')]
+PORT_IN_USE = [VERSION, result('', 1),
+               result('tcp 0 0 0.0.0.0:8080 0.0.0.0:* LISTEN')]
+
+
+def mock_batches(batch_class_mock, *step_results):
+    """
+    Makes each RemoteBatch created by the code under test return the next
+    list of step_results from run().
+
+    Returns:
+        list of the batches created so far
+    """
+    batches = []
+
+    def new_batch():
+        batch = MagicMock()
+        batch.add.side_effect = lambda *args, **kwargs: \
+            batch.add.call_count - 1
+        batch.run.return_value = step_results[len(batches)]
+        batches.append(batch)
+        return batch
+    batch_class_mock.side_effect = new_batch
+    return batches
+
+
+def execute_on_hosts(task, *args, **kwargs):
+    """
+    Runs task on each of the hosts in turn, in place of execute()
+    """
+    results = {}
+    for host in kwargs['hosts']:
+        env.host = host
+        results[host] = task(*args)
+    return results
+
+
 class TestInstall(BaseTestCase):
     SERVER_FAIL_MSG = 'Server failed to start on: failed_node1' \
                       '\nPlease check ' \
@@ -38,14 +84,25 @@ class TestInstall(BaseTestCase):
 
     def setUp(self):
         self.remove_runs_once_flag(server.status)
+        self.remove_runs_once_flag(server.start)
+        self.remove_runs_once_flag(server.restart)
         self.maxDiff = None
         super(TestInstall, self).setUp(capture_output=True)
 
+    @patch('prestoadmin.server.deploy.render')
+    @patch('prestoadmin.server.package.preflight')
+    @patch('prestoadmin.server.package.distribute')
     @patch('prestoadmin.server.deploy_install_configure')
-    def test_install_server(self, mock_install):
+    def test_install_server(self, mock_install, mock_distribute,
+                            mock_preflight, mock_render):
         local_path = os.path.join("/any/path/rpm")
         server.install(local_path)
-        mock_install.assert_called_with(local_path)
+        mock_preflight.assert_called_once_with(local_path)
+        mock_install.assert_called_with(local_path,
+                                        mock_preflight.return_value,
+                                        mock_render.return_value)
+        self.assertEqual(1, mock_render.call_count)
+        self.assertTrue(mock_distribute.called)
 
     @patch('prestoadmin.server.package.deploy_install')
     @patch('prestoadmin.server.update_configs')
@@ -53,12 +110,26 @@ class TestInstall(BaseTestCase):
         local_path = "/any/path/rpm"
         env.hosts = []
         server.deploy_install_configure(local_path)
-        mock_install.assert_called_with(local_path)
-        mock_update.assert_called_with()
+        mock_install.assert_called_with(local_path, None)
+        mock_update.assert_called_with(None)
 
-    @patch('prestoadmin.server.check_presto_version')
+    @patch('prestoadmin.server.package.preflight')
+    @patch('prestoadmin.server.package.distribute')
+    @patch('prestoadmin.server.execute')
+    def test_upgrade_checks_rpm_once(self, mock_execute, mock_distribute,
+                                     mock_preflight):
+        env.hosts = ['master', 'slave1']
+        env.exclude_hosts = []
+        self.remove_runs_once_flag(server.upgrade)
+        server.upgrade('/any/path/rpm')
+        mock_preflight.assert_called_once_with('/any/path/rpm')
+        mock_execute.assert_called_with(
+            server.upgrade_host, '/any/path/rpm', None,
+            mock_preflight.return_value, hosts=['master', 'slave1'])
+
+    @patch('prestoadmin.server.stop')
     @patch('prestoadmin.server.sudo')
-    def test_uninstall_is_called(self, mock_sudo, mock_version_check):
+    def test_uninstall_is_called(self, mock_sudo, mock_stop):
         env.host = "any_host"
         output1 = _AttributeString()
         output1.succeeded = False
@@ -68,154 +139,199 @@ class TestInstall(BaseTestCase):
 
         server.uninstall()
 
-        mock_version_check.assert_called_with()
+        mock_stop.assert_called_with()
         mock_sudo.assert_any_call('rpm -e presto')
         mock_sudo.assert_called_with('rpm -e presto-server-rpm')
 
-    @patch('prestoadmin.server.run')
-    @patch('prestoadmin.server.sudo')
-    @patch.object(PrestoClient, 'execute_query')
-    @patch('prestoadmin.server.warn')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_start_fail(self, mock_port_in_use,
-                               mock_version_check, mock_warn,
-                               mock_execute, mock_sudo, mock_run):
-        old_retry_timeout = server.RETRY_TIMEOUT
-        server.RETRY_TIMEOUT = 1
-        mock_execute.return_value = False
-        env.host = "failed_node1"
-        mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 0
+    @patch('prestoadmin.server.execute', side_effect=execute_on_hosts)
+    @patch('prestoadmin.server.check_status_for_control_commands')
+    @patch('prestoadmin.server.RemoteBatch')
+    def test_server_start_fail(self, mock_batch, mock_check_status,
+                               mock_execute):
+        env.hosts = ['failed_node1']
+        batches = mock_batches(mock_batch, PORT_FREE, [result('', 1)])
         server.start()
-        mock_sudo.assert_called_with('set -m; ' + INIT_SCRIPTS + ' start')
-        mock_version_check.assert_called_with()
-        mock_warn.assert_called_with(self.SERVER_FAIL_MSG)
-        server.RETRY_TIMEOUT = old_retry_timeout
+        batches[1].add.assert_called_with('set -m; ' + INIT_SCRIPTS +
+                                          ' start', show_output=True)
+        batches[1].run.assert_called_with(use_sudo=True)
+        mock_check_status.assert_called_with([])
 
-    @patch('prestoadmin.server.sudo')
-    @patch.object(PrestoClient, 'execute_query')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_start(self, mock_port_in_use, mock_version_check,
-                          mock_execute, mock_sudo):
-        mock_execute.return_value = True
-        env.host = 'good_node'
-        mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 0
+    @patch('prestoadmin.server.execute', side_effect=execute_on_hosts)
+    @patch('prestoadmin.server.check_status_for_control_commands')
+    @patch('prestoadmin.server.RemoteBatch')
+    def test_server_start(self, mock_batch, mock_check_status, mock_execute):
+        env.hosts = ['good_node']
+        batches = mock_batches(mock_batch, PORT_FREE, [result('')])
         server.start()
-        mock_sudo.assert_called_with('set -m; ' + INIT_SCRIPTS + ' start')
-        mock_version_check.assert_called_with()
-        self.assertEqual('Waiting to make sure we can connect to the Presto '
-                         'server on good_node, please wait. This check will '
-                         'time out after 2 minutes if the server does not '
-                         'respond.\nServer started successfully on: '
-                         'good_node\n', self.test_stdout.getvalue())
-
-    @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_start_bad_presto_version(self, mock_port_in_use,
-                                             mock_version_check, mock_sudo):
-        env.host = "good_node"
-        mock_version_check.return_value = 'Presto not installed'
+        self.assertEqual(2, len(batches))
+        batches[1].add.assert_called_with('set -m; ' + INIT_SCRIPTS +
+                                          ' start', show_output=True)
+        mock_execute.assert_called_with(server.service, 'start',
+                                        hosts=['good_node'])
+        mock_check_status.assert_called_with(['good_node'])
+
+    @patch('prestoadmin.server.execute', side_effect=execute_on_hosts)
+    @patch('prestoadmin.server.check_status_for_control_commands')
+    @patch('prestoadmin.server.RemoteBatch')
+    @patch('prestoadmin.server.warn')
+    def test_server_start_bad_presto_version(self, mock_warn, mock_batch,
+                                             mock_check_status,
+                                             mock_execute):
+        env.hosts = ['good_node']
+        batches = mock_batches(mock_batch, [result('', 1), result('', 1),
+                                            result('')])
         server.start()
-        mock_version_check.assert_called_with()
-        self.assertEqual(False, mock_sudo.called)
+        mock_warn.assert_called_with('Presto is not installed.')
+        self.assertEqual(1, len(batches))
+        mock_check_status.assert_called_with([])
 
-    @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_start_port_in_use(self, mock_port_in_use,
-                                      mock_version_check, mock_sudo):
-        env.host = "good_node"
-        mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 1
+    @patch('prestoadmin.server.execute', side_effect=execute_on_hosts)
+    @patch('prestoadmin.server.check_status_for_control_commands')
+    @patch('prestoadmin.server.RemoteBatch')
+    @patch('prestoadmin.server.warn')
+    def test_server_start_port_in_use(self, mock_warn, mock_batch,
+                                      mock_check_status, mock_execute):
+        env.hosts = ['good_node']
+        batches = mock_batches(mock_batch, PORT_IN_USE)
         server.start()
-        mock_version_check.assert_called_with()
-        mock_port_in_use.assert_called_with('good_node')
-        self.assertEqual(False, mock_sudo.called)
+        mock_warn.assert_called_with('Server failed to start on good_node. '
+                                     'Port 8080 already in use')
+        self.assertEqual(1, len(batches))
+        mock_check_status.assert_called_with([])
 
-    @patch('prestoadmin.server.sudo')
+    @patch('prestoadmin.server.execute', side_effect=execute_on_hosts)
+    @patch('prestoadmin.server.RemoteBatch')
     @patch('prestoadmin.server.check_status_for_control_commands')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_restart_port_in_use(self, mock_port_in_use,
-                                        mock_version_check, mock_check_status,
-                                        mock_sudo):
-        env.host = "good_node"
-        mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 1
-        server.restart()
-        mock_sudo.assert_called_with('set -m; ' + INIT_SCRIPTS + ' stop')
-        mock_version_check.assert_called_with()
-        self.assertEqual(False, mock_check_status.called)
-
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    @patch('prestoadmin.server.sudo')
-    def test_server_stop(self, mock_sudo, mock_port_in_use,
-                         mock_version_check):
-        mock_version_check.return_value = ''
-        server.stop()
-        mock_version_check.assert_called_with()
-        self.assertEqual(False, mock_port_in_use.called)
-        mock_sudo.assert_called_with('set -m; ' + INIT_SCRIPTS + ' stop')
-
-    @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.check_server_status')
     @patch('prestoadmin.server.warn')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_restart_fail(self, mock_port_in_use, mock_version_check,
-                                 mock_warn, mock_status, mock_sudo):
-        mock_status.return_value = False
-        env.host = "failed_node1"
-        mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 0
+    def test_server_restart_port_in_use(self, mock_warn, mock_check_status,
+                                        mock_batch, mock_execute):
+        env.hosts = ['good_node']
+        batches = mock_batches(mock_batch, [VERSION],
+                               [result('')] + PORT_IN_USE[1:])
         server.restart()
-        mock_sudo.assert_any_call('set -m; ' + INIT_SCRIPTS + ' stop')
-        mock_sudo.assert_any_call('set -m; ' + INIT_SCRIPTS + ' start')
-        mock_version_check.assert_called_with()
-
-        mock_warn.assert_called_with(self.SERVER_FAIL_MSG)
-
-    @patch('prestoadmin.util.service_util.lookup_port')
-    @patch('prestoadmin.server.sudo')
-    @patch('prestoadmin.server.check_server_status')
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.is_port_in_use')
-    def test_server_restart(self, mock_port_in_use, mock_version_check,
-                            mock_status, mock_sudo, mock_lookup_host):
-        mock_status.return_value = True
-        env.host = 'good_node'
-        mock_version_check.return_value = ''
-        mock_port_in_use.return_value = 0
+        batches[1].add.assert_any_call('set -m; ' + INIT_SCRIPTS + ' stop',
+                                       show_output=True)
+        batches[1].run.assert_called_with(use_sudo=True)
+        self.assertEqual(2, len(batches))
+        mock_check_status.assert_called_with([], restarted=True)
+
+    @patch('prestoadmin.server.RemoteBatch')
+    def test_server_stop(self, mock_batch):
+        batches = mock_batches(mock_batch, [VERSION], [result('')])
+        server.stop()
+        # The port is only checked before starting the server
+        self.assertEqual(1, batches[0].add.call_count)
+        batches[1].add.assert_called_with('set -m; ' + INIT_SCRIPTS + ' stop',
+                                          show_output=True)
+        batches[1].run.assert_called_with(use_sudo=True)
+
+    @patch('prestoadmin.server.execute', side_effect=execute_on_hosts)
+    @patch('prestoadmin.server.RemoteBatch')
+    @patch('prestoadmin.server.check_status_for_control_commands')
+    def test_server_restart(self, mock_check_status, mock_batch,
+                            mock_execute):
+        env.hosts = ['good_node']
+        batches = mock_batches(mock_batch, [VERSION],
+                               [result('')] + PORT_FREE[1:], [result('')])
         server.restart()
-        mock_sudo.assert_any_call('set -m; ' + INIT_SCRIPTS + ' stop')
-        mock_sudo.assert_any_call('set -m; ' + INIT_SCRIPTS + ' start')
-        mock_version_check.assert_called_with()
+        batches[1].add.assert_any_call('set -m; ' + INIT_SCRIPTS + ' stop',
+                                       show_output=True)
+        batches[2].add.assert_called_with('set -m; ' + INIT_SCRIPTS +
+                                          ' start', show_output=True)
+        mock_check_status.assert_called_with(['good_node'], restarted=True)
+
+    @patch('prestoadmin.server.wait_for_nodes')
+    @patch('prestoadmin.server.get_server_nodes')
+    @patch('prestoadmin.server.warn')
+    def test_check_status_for_control_commands(self, mock_warn, mock_nodes,
+                                               mock_wait):
+        env.roledefs['coordinator'] = ['master']
+        nodes = {'master': server.ServerNode('master', 'master-id', 8081),
+                 'good_node': server.ServerNode('good_node', 'good-id', 8080),
+                 'failed_node1': server.ServerNode('failed_node1',
+                                                   'failed-id', 8080)}
+        mock_nodes.return_value = nodes
+        mock_wait.return_value = ['failed_node1']
+        server.check_status_for_control_commands(
+            ['master', 'good_node', 'failed_node1'])
+        mock_nodes.assert_called_with(['master', 'good_node',
+                                       'failed_node1'])
+        client, waiting = mock_wait.call_args[0]
+        self.assertEqual(('master', 8081), (client.server, client.port))
+        self.assertEqual([nodes['master'], nodes['good_node'],
+                          nodes['failed_node1']], waiting)
+        self.assertEqual({'check_started': False}, mock_wait.call_args[1])
         self.assertEqual('Waiting to make sure we can connect to the Presto '
-                         'server on good_node, please wait. This check will '
-                         'time out after 2 minutes if the server does not '
-                         'respond.\nServer started successfully on: '
-                         'good_node\n', self.test_stdout.getvalue())
+                         'servers on master, good_node, failed_node1, please '
+                         'wait. This check will time out after 2 minutes if '
+                         'the servers do not respond.\n'
+                         'Server started successfully on: master\n'
+                         'Server started successfully on: good_node\n',
+                         self.test_stdout.getvalue())
+        mock_warn.assert_called_once_with(self.SERVER_FAIL_MSG)
+
+    @patch('prestoadmin.server.get_server_info')
+    @patch('prestoadmin.server.wait_for_nodes')
+    @patch('prestoadmin.server.get_server_nodes')
+    @patch('prestoadmin.server.warn')
+    def test_check_status_after_restart(self, mock_warn, mock_nodes,
+                                        mock_wait, mock_info):
+        env.roledefs['coordinator'] = ['master']
+        nodes = {'master': server.ServerNode('master', 'master-id', 8080),
+                 'good_node': server.ServerNode('good_node', 'good-id', 8080)}
+        mock_nodes.return_value = nodes
+        mock_info.return_value = {'starting': False}
+        mock_wait.return_value = []
+        server.check_status_for_control_commands(
+            ['good_node', 'failed_node1'], restarted=True)
+        # The port of the coordinator is read along with the other nodes
+        mock_nodes.assert_called_with(['good_node', 'failed_node1',
+                                       'master'])
+        mock_info.assert_called_with('master', 8080)
+        client, waiting = mock_wait.call_args[0]
+        self.assertEqual('master', client.server)
+        # The node id of failed_node1 could not be read
+        self.assertEqual([nodes['good_node']], waiting)
+        # The coordinator was not restarted, so it may list old servers
+        self.assertEqual({'check_started': True}, mock_wait.call_args[1])
+        mock_warn.assert_called_once_with(self.SERVER_FAIL_MSG)
+
+    @patch('prestoadmin.server.get_server_info')
+    @patch('prestoadmin.server.wait_for_nodes')
+    @patch('prestoadmin.server.get_server_nodes')
+    def test_check_status_coordinator_down(self, mock_nodes, mock_wait,
+                                           mock_info):
+        env.roledefs['coordinator'] = ['master']
+        nodes = {'master': server.ServerNode('master', 'master-id', 8080),
+                 'good_node': server.ServerNode('good_node', 'good-id', 8080)}
+        mock_nodes.return_value = nodes
+        mock_info.return_value = None
+        mock_wait.return_value = []
+        server.check_status_for_control_commands(['good_node'])
+        mock_wait.assert_called_with(None, [nodes['good_node']],
+                                     check_started=False)
+        self.assertTrue('Server started successfully on: good_node'
+                        in self.test_stdout.getvalue())
 
     @patch('prestoadmin.server.connector')
-    @patch('prestoadmin.server.configure_cmds.deploy')
+    @patch('prestoadmin.server.deploy.configure_host')
+    @patch('prestoadmin.server.deploy.render')
     @patch('prestoadmin.server.os.path.exists')
     @patch('prestoadmin.server.os.makedirs')
     @patch('prestoadmin.server.util.filesystem.os.fdopen')
     @patch('prestoadmin.server.util.filesystem.os.open')
     def test_update_config(self, mock_open, mock_fdopen, mock_makedir,
-                           mock_path_exists, mock_config, mock_connector):
+                           mock_path_exists, mock_render, mock_config,
+                           mock_connector):
         e = ConfigFileNotFoundError
         mock_connector.add = e
         mock_path_exists.side_effect = [False, False]
 
+        env.host = 'master'
         server.update_configs()
 
-        mock_config.assert_called_with()
+        mock_render.assert_called_with(['master'])
+        mock_config.assert_called_with(mock_render.return_value)
         mock_makedir.assert_called_with(constants.CONNECTORS_DIR)
         mock_open.assert_called_with(os.path.join(constants.CONNECTORS_DIR,
                                                   'tpch.properties'),
@@ -223,24 +339,32 @@ class TestInstall(BaseTestCase):
         file_manager = mock_fdopen.return_value.__enter__.return_value
         file_manager.write.assert_called_with("connector.name=tpch")
 
-    @patch('prestoadmin.server.run')
-    def test_check_success_status(self, mock_sleep):
-        client_mock = MagicMock(PrestoClient)
-        client_mock.execute_query.side_effect = [False, True]
-        self.assertEqual(server.check_server_status(client_mock), True)
-
-    @patch('prestoadmin.server.run')
-    def test_check_success_fail(self,  mock_sleep):
-        old_retry_timeout = server.RETRY_TIMEOUT
-        server.RETRY_TIMEOUT = SLEEP_INTERVAL + 1
-        client_mock = MagicMock(PrestoClient)
-        client_mock.execute_query.side_effect = [False, False]
-        self.assertEqual(server.check_server_status(client_mock), False)
-        server.RETRY_TIMEOUT = old_retry_timeout
-
-    @patch('prestoadmin.server.execute')
+    @patch('prestoadmin.server.time.sleep')
+    def test_poll_with_backoff(self, mock_sleep):
+        probe = MagicMock(side_effect=[False, False, True])
+        self.assertEqual(True, server.poll_with_backoff(probe, 10))
+        # The interval between the probes doubles, starting under a second
+        self.assertEqual([server.PROBE_FIRST_INTERVAL,
+                          2 * server.PROBE_FIRST_INTERVAL],
+                         [args[0] for args, _ in mock_sleep.call_args_list])
+
+    @patch('prestoadmin.server.time')
+    def test_poll_with_backoff_timeout(self, mock_time):
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+        mock_time.time.side_effect = lambda: now[0]
+        mock_time.sleep.side_effect = sleep
+        probe = MagicMock(return_value=False)
+        self.assertEqual(False, server.poll_with_backoff(probe, 120))
+        intervals = [args[0] for args, _ in mock_time.sleep.call_args_list]
+        self.assertEqual(120, sum(intervals))
+        self.assertEqual(server.PROBE_MAX_INTERVAL, max(intervals))
+
+    @patch('prestoadmin.server.collect_node_information')
     @patch('prestoadmin.server.run_sql')
-    def test_status_from_each_node(self, mock_run_sql, mock_execute):
+    def test_status_from_each_node(self, mock_run_sql, mock_collect):
         env.roledefs = {
             'coordinator': ['Node1'],
             'worker': ['Node1', 'Node2', 'Node3', 'Node4'],
@@ -248,19 +372,26 @@ class TestInstall(BaseTestCase):
         }
         env.hosts = env.roledefs['all']
         mock_run_sql.side_effect = [
-            [['select * from system.runtime.nodes']],
-            [['hive'], ['system'], ['tpch']],
-            [['http://active/statement', 'presto-main:0.97-SNAPSHOT', True]],
-            [['http://inactive/stmt', 'presto-main:0.99-SNAPSHOT', False]],
-            [[]],
-            [['http://servrdown/statement', 'any', True]]
+            [['id1', 'http://ip1:8080/statement',
+              'presto-main:0.97-SNAPSHOT', True],
+             ['id2', 'http://ip2:8080/stmt', 'presto-main:0.99-SNAPSHOT',
+              False],
+             ['id5', 'http://ip5:8080/statement', 'any', True]],
+            [['hive'], ['system'], ['tpch']]
         ]
-        mock_execute.side_effect = [{
-            'Node1': ('IP1', True, ''),
-            'Node2': ('IP2', True, ''),
-            'Node3': ('IP3', True, ''),
-            'Node4': Exception('Timed out trying to connect to Node4')
-        }]
+        node_information = [
+            ('Node1', ('ip1', True, '')),
+            ('Node2', ('ip2', True, '')),
+            ('Node3', ('ip3', True, '')),
+            ('Node4', Exception('Timed out trying to connect to Node4'))
+        ]
+
+        def collect(nodes_by_id, hosts, on_result):
+            for host, information in node_information:
+                on_result(host, information)
+            return dict(node_information)
+
+        mock_collect.side_effect = collect
         env.host = 'Node1'
         server.status()
 
@@ -269,42 +400,81 @@ class TestInstall(BaseTestCase):
             expected.splitlines(),
             self.test_stdout.getvalue().splitlines()
         )
+        # One query for the nodes and one for the catalogs, however many
+        # hosts there are
+        self.assertEqual([server.NODES_SQL, server.CONNECTOR_INFO_SQL],
+                         [args[1] for args, _ in
+                          mock_run_sql.call_args_list])
+
+    @patch('prestoadmin.server.fanout.run_on_hosts')
+    def test_collect_node_information(self, mock_run_on_hosts):
+        network_error = Exception('Timed out trying to connect to Node5')
+        outputs = [
+            ('Node1', 'installed=true\nversion=0.116\nnode_id=id1\nstatus=0'),
+            ('Node2', 'installed=false\nnode_id=\nstatus=1'),
+            ('Node3', 'installed=true\nversion=0.116\nnode_id=id3\nstatus=3'),
+            ('Node4', 'installed=true\nversion=0.97\nnode_id=id4\nstatus=0'),
+            ('Node5', network_error)
+        ]
+
+        def run_on_hosts(command, hosts, use_sudo, on_result):
+            for host, output in outputs:
+                on_result(host, output)
+            return dict(outputs)
+
+        mock_run_on_hosts.side_effect = run_on_hosts
+        nodes_by_id, _ = server.index_nodes([
+            ['id1', 'http://ip1:8080/statement', '0.116', True],
+            ['id3', 'http://ip3:8080/statement', '0.116', True]])
+        hosts = ['Node1', 'Node2', 'Node3', 'Node4', 'Node5']
+        streamed = []
+
+        information = server.collect_node_information(
+            nodes_by_id, hosts,
+            on_result=lambda host, info: streamed.append(host))
+
+        self.assertEqual(hosts, streamed)
+        self.assertEqual(server.NODE_FACTS_SCRIPT,
+                         mock_run_on_hosts.call_args[0][0])
+        self.assertEqual(('ip1', True, ''), information['Node1'])
+        self.assertEqual(('Unknown', False, 'Presto is not installed.'),
+                         information['Node2'])
+        self.assertEqual(('ip3', False, ''), information['Node3'])
+        self.assertEqual(('Unknown', False, 'Presto version is 0.97, '
+                                            'version >= 0.103 required.'),
+                         information['Node4'])
+        self.assertEqual(network_error, information['Node5'])
+
+    def test_parse_node_facts(self):
+        self.assertEqual({'installed': 'true', 'version': '0.116',
+                          'node_id': 'a=b', 'status': '0'},
+                         server.parse_node_facts(
+                             'installed=true\nversion=0.116\n'
+                             'node_id=a=b\nstatus=0\n'))
+
+    def test_index_nodes(self):
+        rows = [['id1', 'http://ip1:8080/statement', '0.116', True],
+                ['id2', 'http://ip1:8081/statement', '0.116', False],
+                []]
+        nodes_by_id, nodes_by_host = server.index_nodes(rows)
+        self.assertEqual({'id1': [rows[0]], 'id2': [rows[1]]}, nodes_by_id)
+        self.assertEqual({'ip1': rows[:2]}, nodes_by_host)
+
+    def test_get_external_ip(self):
+        nodes_by_id, _ = server.index_nodes(
+            [['id1', 'http://ip1:8080/statement', '0.116', True]])
+        self.assertEqual('ip1', server.get_ext_ip_from_node_id(
+            nodes_by_id, 'id1', 'node'))
+        self.assertEqual('Unknown', server.get_ext_ip_from_node_id(
+            nodes_by_id, 'id2', 'node'))
 
-    @patch('prestoadmin.server.check_presto_version')
-    @patch('prestoadmin.server.service')
-    @patch('prestoadmin.server.get_ext_ip_of_node')
-    def test_collect_node_information(self, mock_ext_ip, mock_service,
-                                      mock_version):
-        env.roledefs = {
-            'coordinator': ['Node1'],
-            'all': ['Node1']
-        }
-        mock_ext_ip.side_effect = ['IP1', 'IP3', 'IP4']
-        mock_service.side_effect = [True, False, Exception('Not running')]
-        mock_version.side_effect = ['', 'Presto not installed', '', '']
-
-        self.assertEqual(('IP1', True, ''), server.collect_node_information())
-        self.assertEqual(('Unknown', False, 'Presto not installed'),
-                         server.collect_node_information())
-        self.assertEqual(('IP3', False, ''), server.collect_node_information())
-        self.assertEqual(('IP4', False, ''),
-                         server.collect_node_information())
-
-    @patch('prestoadmin.server.run')
-    def test_get_external_ip(self, mock_nodeuuid):
-        client_mock = MagicMock(PrestoClient)
-        client_mock.execute_query.return_value = True
-        client_mock.get_rows = lambda: [['IP']]
-        self.assertEqual(server.get_ext_ip_of_node(client_mock), 'IP')
-
-    @patch('prestoadmin.server.run')
     @patch('prestoadmin.server.warn')
-    def test_warn_external_ip(self, mock_warn, mock_nodeuuid):
-        env.host = 'node'
-        client_mock = MagicMock(PrestoClient)
-        client_mock.execute_query.return_value = True
-        client_mock.get_rows = lambda: [['IP1'], ['IP2']]
-        server.get_ext_ip_of_node(client_mock)
+    def test_warn_external_ip(self, mock_warn):
+        nodes_by_id, _ = server.index_nodes(
+            [['id1', 'http://ip1:8080/statement', '0.116', True],
+             ['id1', 'http://ip2:8080/statement', '0.116', True]])
+        self.assertEqual('', server.get_ext_ip_from_node_id(
+            nodes_by_id, 'id1', 'node'))
         mock_warn.assert_called_with("More than one external ip found for "
                                      "node. There could be multiple nodes "
                                      "associated with the same node.id")
@@ -317,7 +487,7 @@ class TestInstall(BaseTestCase):
         return file_content
 
     @patch('prestoadmin.server.run_sql')
-    @patch('prestoadmin.server.run')
+    @patch('prestoadmin.server.RemoteBatch.run')
     @patch('prestoadmin.server.warn')
     def test_warning_presto_version_wrong(self, mock_warn, mock_run,
                                           mock_run_sql):
@@ -330,14 +500,14 @@ class TestInstall(BaseTestCase):
         old_version = '0.97'
         output = _AttributeString(old_version)
         output.succeeded = True
-        mock_run.return_value = output
-        server.collect_node_information()
+        mock_run.return_value = [output]
+        server.check_presto_version()
         version_warning = 'Presto version is %s, version >= 0.%d required.'\
                           % (old_version, PRESTO_RPM_MIN_REQUIRED_VERSION)
         mock_warn.assert_called_with(version_warning)
 
     @patch('prestoadmin.server.run_sql')
-    @patch('prestoadmin.server.run')
+    @patch('prestoadmin.server.RemoteBatch.run')
     @patch('prestoadmin.server.warn')
     def test_warning_presto_version_not_installed(self, mock_warn, mock_run,
                                                   mock_run_sql):
@@ -348,57 +518,57 @@ class TestInstall(BaseTestCase):
         env.hosts = env.roledefs['all']
         output = _AttributeString('package presto is not installed')
         output.succeeded = False
-        mock_run.return_value = output
+        mock_run.return_value = [output]
         env.host = 'node1'
-        server.collect_node_information()
+        server.check_presto_version()
         installation_warning = 'Presto is not installed.'
         mock_warn.assert_called_with(installation_warning)
 
-    @patch('prestoadmin.server.run')
+    @patch('prestoadmin.server.RemoteBatch.run')
     def test_td_presto_version(self,  mock_run):
         td_version = '101t'
         output = _AttributeString(td_version)
         output.succeeded = True
-        mock_run.return_value = output
+        mock_run.return_value = [output]
         expected = server.check_presto_version()
         self.assertEqual(expected, '')
 
-    @patch('prestoadmin.server.run')
-    @patch('prestoadmin.server.lookup_port')
     @patch('prestoadmin.server.warn')
-    def test_warn_if_port_is_in_use(self, mock_warn, mock_port, mock_run):
-        mock_port.return_value = 1010
+    def test_warn_if_port_is_in_use(self, mock_warn):
         env.host = 'any_host'
-        mock_run.return_value = 'some_string'
-        server.is_port_in_use(env.host)
+        self.assertTrue(server.port_in_use(
+            env.host, result('http-server.http.port=1010'),
+            result('tcp 0 0 :::1010 :::* LISTEN')))
         mock_warn.assert_called_with('Server failed to start on any_host. '
                                      'Port 1010 already in use')
 
-    @patch('prestoadmin.server.run')
-    @patch('prestoadmin.server.lookup_port')
     @patch('prestoadmin.server.warn')
-    def test_no_warn_if_port_free(self, mock_warn, mock_port, mock_run):
-        mock_port.return_value = 1010
+    def test_no_warn_if_port_free(self, mock_warn):
         env.host = 'any_host'
-        mock_run.return_value = ''
-        server.is_port_in_use(env.host)
+        self.assertFalse(server.port_in_use(
+            env.host, result('http-server.http.port=1010'),
+            result('tcp 0 0 :::8080 :::* LISTEN')))
         self.assertEqual(False, mock_warn.called)
 
-    @patch('prestoadmin.server.lookup_port')
     @patch('prestoadmin.server.warn')
-    def test_no_warn_if_port_lookup_fail(self, mock_warn, mock_port):
-        e = ConfigurationError()
-        mock_port.side_effect = e
+    def test_no_warn_if_port_lookup_fail(self, mock_warn):
         env.host = 'any_host'
-        self.assertFalse(server.is_port_in_use(env.host))
+        # grep exits with 2 when config.properties does not exist
+        self.assertFalse(server.port_in_use(
+            env.host, result('', 2), result('tcp 0 0 :::8080 :::* LISTEN')))
         self.assertEqual(False, mock_warn.called)
 
-    @patch('prestoadmin.server.run')
+    def test_port_in_use_defaults_to_8080(self):
+        env.host = 'any_host'
+        self.assertTrue(server.port_in_use(
+            env.host, result('', 1), result('tcp 0 0 :::8080 :::* LISTEN')))
+
+    @patch('prestoadmin.server.RemoteBatch.run')
     def test_version_with_snapshot(self, mock_run):
         snapshot_version = '0.107.SNAPSHOT'
         output = _AttributeString(snapshot_version)
         output.succeeded = True
-        mock_run.return_value = output
+        mock_run.return_value = [output]
 
         expected = server.check_presto_version()
         self.assertEqual(expected, '')
@@ -406,36 +576,210 @@ class TestInstall(BaseTestCase):
         snapshot_version = '0.107.SNAPSHOT-1.x86_64'
         output = _AttributeString(snapshot_version)
         output.succeeded = True
-        mock_run.return_value = output
+        mock_run.return_value = [output]
         expected = server.check_presto_version()
         self.assertEqual(expected, '')
 
         snapshot_version = '0.107-SNAPSHOT'
         output = _AttributeString(snapshot_version)
         output.succeeded = True
-        mock_run.return_value = output
+        mock_run.return_value = [output]
         expected = server.check_presto_version()
         self.assertEqual(expected, '')
 
-    @patch('prestoadmin.server.run')
-    def test_multiple_version_rpms(self, mock_run):
-
-        output1 = _AttributeString('package presto is not installed')
-        output1.succeeded = False
-        output2 = _AttributeString('presto-server-rpm-0.115t-1.x86_64')
-        output2.succeeded = True
-        output3 = _AttributeString('Presto is not installed.')
-        output3.succeeded = False
-        output4 = _AttributeString('0.111.SNAPSHOT')
-        output4.succeeded = True
-
-        mock_run.side_effect = [output1, output2, output3, output4]
+    @patch('prestoadmin.server.RemoteBatch.add')
+    @patch('prestoadmin.server.RemoteBatch.run')
+    def test_multiple_version_rpms(self, mock_run, mock_add):
+        mock_add.return_value = 0
+        mock_run.return_value = [result('0.111.SNAPSHOT')]
 
         expected = server.check_presto_version()
-        mock_run.assert_has_calls([
-            call('rpm -q presto'),
-            call('rpm -q presto-server-rpm'),
-            call('rpm -q --qf \"%{VERSION}\\n\" presto'),
-            call('rpm -q --qf \"%{VERSION}\\n\" presto-server-rpm'),
-        ])
+        command = mock_add.call_args[0][0]
+        self.assertTrue("rpm -q --qf '%{VERSION}\\n' presto)" in command)
+        self.assertTrue("rpm -q --qf '%{VERSION}\\n' presto-server-rpm)"
+                        in command)
         self.assertEqual(expected, '')
+
+
+class TestRollingRestart(BaseTestCase):
+    def setUp(self):
+        super(TestRollingRestart, self).setUp(capture_output=True)
+        self.remove_runs_once_flag(server.rolling_restart)
+        env.roledefs = {
+            'coordinator': ['master'],
+            'worker': ['slave1', 'slave2', 'slave3'],
+            'all': ['master', 'slave1', 'slave2', 'slave3']
+        }
+        env.hosts = env.roledefs['all']
+        self.nodes = dict((host, server.ServerNode(host, host + '-id', 8080))
+                          for host in env.hosts)
+
+    @patch('prestoadmin.server.abort')
+    def test_rolling_group_size(self, abort_mock):
+        self.assertEqual(2, server.rolling_group_size('25%', 8))
+        self.assertEqual(1, server.rolling_group_size('25%', 3))
+        self.assertEqual(3, server.rolling_group_size('3', 8))
+        self.assertFalse(abort_mock.called)
+        for max_down in ['0', '150%', 'many']:
+            server.rolling_group_size(max_down, 8)
+            abort_mock.assert_called_with(
+                'Invalid value for max_down: %s. Use a number of workers or '
+                'a percentage of the workers, such as 25%%.' % max_down)
+
+    @patch('prestoadmin.server.restart_group')
+    @patch('prestoadmin.server.get_server_nodes')
+    def test_rolling_restart_coordinator_last(self, nodes_mock,
+                                              restart_mock):
+        nodes_mock.return_value = self.nodes
+        restart_mock.return_value = []
+        server.rolling_restart('2')
+        groups = [call[0][1] for call in restart_mock.call_args_list]
+        self.assertEqual([['slave1', 'slave2'], ['slave3'], ['master']],
+                         groups)
+        self.assertEqual([self.nodes['slave3']],
+                         restart_mock.call_args_list[1][0][2])
+        # The whole cluster has to rejoin a restarted coordinator
+        self.assertEqual([self.nodes[host] for host in env.hosts],
+                         restart_mock.call_args_list[2][0][2])
+
+    @patch('prestoadmin.server.restart_group')
+    @patch('prestoadmin.server.get_server_nodes')
+    def test_rolling_restart_coordinator_first(self, nodes_mock,
+                                               restart_mock):
+        nodes_mock.return_value = self.nodes
+        restart_mock.return_value = []
+        server.rolling_restart('50%', 'first')
+        groups = [call[0][1] for call in restart_mock.call_args_list]
+        self.assertEqual([['master'], ['slave1'], ['slave2'], ['slave3']],
+                         groups)
+
+    @patch('prestoadmin.server.abort', side_effect=SystemExit)
+    @patch('prestoadmin.server.restart_group')
+    @patch('prestoadmin.server.get_server_nodes')
+    def test_rolling_restart_stops_on_failure(self, nodes_mock,
+                                              restart_mock, abort_mock):
+        nodes_mock.return_value = self.nodes
+        restart_mock.return_value = ['slave1']
+        self.assertRaises(SystemExit, server.rolling_restart, '1')
+        abort_mock.assert_called_with('Stopped the rolling restart. '
+                                      'Not restarted: slave2, slave3, master')
+        self.assertEqual(1, restart_mock.call_count)
+
+    @patch('prestoadmin.server.abort', side_effect=SystemExit)
+    @patch('prestoadmin.server.restart_group')
+    @patch('prestoadmin.server.get_server_nodes')
+    def test_rolling_restart_last_group_fails(self, nodes_mock,
+                                              restart_mock, abort_mock):
+        nodes_mock.return_value = self.nodes
+        restart_mock.side_effect = [[], [], ['master']]
+        self.assertRaises(SystemExit, server.rolling_restart, '2')
+        abort_mock.assert_called_with('Rolling restart failed on master')
+        self.assertEqual(3, restart_mock.call_count)
+
+    @patch('prestoadmin.server.abort', side_effect=SystemExit)
+    @patch('prestoadmin.server.restart_group')
+    @patch('prestoadmin.server.get_server_nodes')
+    def test_rolling_restart_unknown_node(self, nodes_mock, restart_mock,
+                                          abort_mock):
+        del self.nodes['slave2']
+        nodes_mock.return_value = self.nodes
+        self.assertRaises(SystemExit, server.rolling_restart)
+        abort_mock.assert_called_with('Not restarting: could not read the '
+                                      'node id and port of the Presto server '
+                                      'on slave2')
+        self.assertFalse(restart_mock.called)
+
+    @patch('prestoadmin.server.abort', side_effect=SystemExit)
+    def test_rolling_restart_invalid_coordinator_policy(self, abort_mock):
+        self.assertRaises(SystemExit, server.rolling_restart, '25%',
+                          'middle')
+        abort_mock.assert_called_with('Invalid value for coordinator: '
+                                      'middle. Use first or last.')
+
+    @patch('prestoadmin.server.wait_for_nodes')
+    @patch('prestoadmin.server.execute')
+    @patch('prestoadmin.server.warn')
+    def test_restart_group(self, warn_mock, execute_mock, wait_mock):
+        execute_mock.return_value = {'slave1': True, 'slave2': False}
+        wait_mock.return_value = []
+        client = MagicMock(PrestoClient)
+        failed = server.restart_group(client, ['slave1', 'slave2'],
+                                      [self.nodes['slave1'],
+                                       self.nodes['slave2']])
+        self.assertEqual(['slave2'], failed)
+        execute_mock.assert_called_with(server.stop_and_start,
+                                        hosts=['slave1', 'slave2'])
+        wait_mock.assert_called_with(client, [self.nodes['slave1']])
+        self.assertTrue('Server started successfully on: slave1'
+                        in self.test_stdout.getvalue())
+        warn_mock.assert_called_with('Server failed to start on: slave2'
+                                     '\nPlease check ' +
+                                     constants.REMOTE_PRESTO_LOG_DIR +
+                                     '/server.log')
+
+    @patch('prestoadmin.server.fanout.run_on_hosts')
+    def test_get_server_nodes(self, run_mock):
+        run_mock.return_value = {
+            'master': result('node_id=master-id\nport=8081'),
+            'slave1': result('node_id=slave1-id\nport='),
+            'slave2': Exception('Timed out')}
+        self.assertEqual({'master': server.ServerNode('master', 'master-id',
+                                                      8081),
+                          'slave1': server.ServerNode('slave1', 'slave1-id',
+                                                      8080)},
+                         server.get_server_nodes(['master', 'slave1',
+                                                  'slave2']))
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.run_sql')
+    @patch('prestoadmin.server.get_server_info')
+    def test_wait_for_nodes(self, info_mock, sql_mock, sleep_mock):
+        # slave1 is still listed from before it was restarted
+        info_mock.side_effect = [{'starting': True}, {'starting': False},
+                                 {'starting': False}]
+        sql_mock.side_effect = [[['slave1-id', True], ['slave2-id', False]],
+                                [['slave1-id', True], ['slave2-id', True]]]
+        client = MagicMock(PrestoClient)
+        self.assertEqual([], server.wait_for_nodes(
+            client, [self.nodes['slave1'], self.nodes['slave2']]))
+        self.assertEqual(1, sleep_mock.call_count)
+        self.assertEqual(3, info_mock.call_count)
+        sql_mock.assert_called_with(client, server.NODE_STATE_SQL)
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.run_sql')
+    @patch('prestoadmin.server.get_server_info')
+    def test_wait_for_nodes_coordinator_only(self, info_mock, sql_mock,
+                                             sleep_mock):
+        sql_mock.side_effect = [[], [['slave1-id', True]],
+                                [['slave1-id', True], ['slave2-id', True]]]
+        self.assertEqual([], server.wait_for_nodes(
+            MagicMock(PrestoClient),
+            [self.nodes['slave1'], self.nodes['slave2']],
+            check_started=False))
+        # One query of the coordinator per interval, for all of the nodes
+        self.assertEqual(3, sql_mock.call_count)
+        self.assertFalse(info_mock.called)
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.run_sql')
+    @patch('prestoadmin.server.get_server_info')
+    def test_wait_for_nodes_without_coordinator(self, info_mock, sql_mock,
+                                                sleep_mock):
+        info_mock.side_effect = [None, {'starting': False},
+                                 {'starting': False}]
+        self.assertEqual([], server.wait_for_nodes(
+            None, [self.nodes['slave1'], self.nodes['slave2']],
+            check_started=False))
+        self.assertFalse(sql_mock.called)
+
+    @patch('prestoadmin.server.time.sleep')
+    @patch('prestoadmin.server.run_sql')
+    @patch('prestoadmin.server.get_server_info')
+    def test_wait_for_nodes_timeout(self, info_mock, sql_mock, sleep_mock):
+        sql_mock.return_value = [['slave1-id', True]]
+        info_mock.return_value = {'starting': True}
+        self.assertEqual(['slave1', 'slave2'], server.wait_for_nodes(
+            MagicMock(PrestoClient),
+            [self.nodes['slave2'], self.nodes['slave1']], timeout=0))
+        self.assertFalse(sleep_mock.called)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for sizing the configuration to the hardware of the hosts
+"""
+from fabric.api import env
+from mock import patch
+
+from prestoadmin import sizing
+from prestoadmin.sizing import GB, HostFacts
+from tests.base_test_case import BaseTestCase
+
+
+class TestSizing(BaseTestCase):
+
+    def test_parse_facts(self):
+        output = 'MemTotal:       263856968 kB\n64\n2'
+        self.assertEqual(HostFacts(263856968 * 1024, 64, 2),
+                         sizing.parse_facts(output))
+        self.assertEqual(HostFacts(1024, 1, 1),
+                         sizing.parse_facts('MemTotal: 1 kB\n1\n0'))
+        self.assertEqual(None, sizing.parse_facts('nproc: not found'))
+
+    def test_ratios(self):
+        env.sizing = {'heap_fraction': '0.8'}
+        self.assertEqual({'heap_fraction': 0.8,
+                          'query_memory_fraction': 0.5,
+                          'worker_threads_per_core': 2},
+                         sizing.ratios())
+
+    def test_size_large_host(self):
+        sized = sizing.size(HostFacts(256 * GB, 48, 2),
+                            sizing.DEFAULT_RATIOS)
+        self.assertEqual(['-Xmx179G', '-XX:G1HeapRegionSize=32M',
+                          '-XX:+UseNUMA'],
+                         sized['jvm.config'])
+        self.assertEqual({'query.max-memory-per-node': '91648MB',
+                          'task.concurrency': '32',
+                          'task.max-worker-threads': '96'},
+                         sized['config.properties'])
+
+    def test_size_small_host(self):
+        sized = sizing.size(HostFacts(GB, 1, 1), sizing.DEFAULT_RATIOS)
+        self.assertEqual(['-Xmx1G'], sized['jvm.config'])
+        self.assertEqual({'query.max-memory-per-node': '512MB',
+                          'task.concurrency': '1',
+                          'task.max-worker-threads': '2'},
+                         sized['config.properties'])
+
+    def test_parse_data_size(self):
+        self.assertEqual(50 * GB, sizing.parse_data_size('50GB'))
+        self.assertEqual(1536 * 1024 * 1024, sizing.parse_data_size('1.5GB'))
+        self.assertEqual(2048, sizing.parse_data_size('2kB'))
+        self.assertRaises(ValueError, sizing.parse_data_size, '50 gigs')
+
+    def test_apply_sizing(self):
+        conf = {'jvm.config': ['-server', '-Xmx16G', '-XX:+UseG1GC'],
+                'config.properties': {'coordinator': 'false',
+                                      'task.concurrency': '2'}}
+        sized = {'jvm.config': ['-Xmx40G', '-XX:G1HeapRegionSize=32M'],
+                 'config.properties': {'task.concurrency': '16',
+                                       'task.max-worker-threads': '32'}}
+        result = sizing.apply_sizing(conf, {}, sized)
+        self.assertEqual(['-server', '-Xmx40G', '-XX:+UseG1GC',
+                          '-XX:G1HeapRegionSize=32M'],
+                         result['jvm.config'])
+        self.assertEqual({'coordinator': 'false',
+                          'task.concurrency': '16',
+                          'task.max-worker-threads': '32'},
+                         result['config.properties'])
+        self.assertEqual(['-server', '-Xmx16G', '-XX:+UseG1GC'],
+                         conf['jvm.config'])
+
+    def test_apply_sizing_local_settings_win(self):
+        conf = {'jvm.config': ['-Xmx16G'],
+                'config.properties': {'task.concurrency': '2'}}
+        local_conf = {'jvm.config': ['-Xmx16G'],
+                      'config.properties': {'task.concurrency': '2'}}
+        sized = {'jvm.config': ['-Xmx40G'],
+                 'config.properties': {'task.concurrency': '16'}}
+        self.assertEqual(conf, sizing.apply_sizing(conf, local_conf, sized))
+
+    def test_merge_jvm_flags(self):
+        self.assertEqual(['-Xmx8G', '-XX:+UseNUMA', '-Dx=1'],
+                         sizing.merge_jvm_flags(['-Xmx2G', '-XX:-UseNUMA'],
+                                                ['-XX:+UseNUMA', '-Xmx8G',
+                                                 '-Dx=1']))
+
+    @patch('prestoadmin.sizing.execute')
+    def test_gather_warns_for_failed_hosts(self, execute_mock):
+        self.capture_stdout_stderr()
+        facts = HostFacts(GB, 1, 1)
+        execute_mock.return_value = {'master': facts,
+                                     'slave1': None,
+                                     'slave2': Exception('timed out')}
+        self.assertEqual({'master': facts},
+                         sizing.gather(['master', 'slave1', 'slave2']))
+        self.assertTrue('Could not read the memory and cores of slave1'
+                        in self.test_stderr.getvalue())
+        self.assertTrue('Could not read the memory and cores of slave2'
+                        in self.test_stderr.getvalue())
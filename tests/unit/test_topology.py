@@ -108,6 +108,54 @@ class TestTopologyConfig(BaseTestCase):
         topology.set_env_from_conf()
         self.assertEqual(topology.env.hosts, ['hello', 'a', 'b'])
 
+    @patch('prestoadmin.main.topology.get_conf')
+    def test_max_parallel_hosts_set(self, conf_mock):
+        conf_mock.return_value = {"username": "root", "port": "22",
+                                  "coordinator": "hello",
+                                  "workers": ["a", "b"],
+                                  "max_parallel_hosts": "100"}
+        topology.set_env_from_conf()
+        self.assertEqual(topology.env.max_parallel_hosts, 100)
+
+    @patch('prestoadmin.main.topology.get_conf')
+    def test_bandwidth_limits_set(self, conf_mock):
+        groups = {'rack1': {'hosts': ['a'], 'limit': 10}}
+        conf_mock.return_value = {"username": "root", "port": "22",
+                                  "coordinator": "hello",
+                                  "workers": ["a", "b"],
+                                  "bandwidth_limit": "100",
+                                  "bandwidth_groups": groups}
+        with patch('prestoadmin.topology.bandwidth.install') as install_mock:
+            topology.set_env_from_conf()
+        self.assertEqual(100.0, topology.env.bandwidth_limit)
+        self.assertEqual(groups, topology.env.bandwidth_groups)
+        self.assertTrue(install_mock.called)
+
+    @patch('prestoadmin.main.topology.get_conf')
+    def test_sizing_set(self, conf_mock):
+        conf_mock.return_value = {"username": "root", "port": "22",
+                                  "coordinator": "hello",
+                                  "workers": ["a", "b"],
+                                  "sizing": {"heap_fraction": 0.8}}
+        topology.set_env_from_conf()
+        self.assertEqual({"heap_fraction": 0.8}, topology.env.sizing)
+
+    def test_invalid_sizing(self):
+        conf = {"coordinator": "hello", "workers": ["a", "b"],
+                "sizing": {"heap_fraction": 2}}
+        self.assertRaisesRegexp(ConfigurationError,
+                                'heap_fraction must be a number greater '
+                                'than 0 and at most 1',
+                                topology.validate, conf)
+
+    def test_invalid_max_parallel_hosts(self):
+        conf = {"coordinator": "hello", "workers": ["a", "b"],
+                "max_parallel_hosts": "0"}
+        self.assertRaisesRegexp(ConfigurationError,
+                                'max_parallel_hosts must be a positive '
+                                'number',
+                                topology.validate, conf)
+
     def test_decorator_no_topology(self):
         env.topology_config_not_found = True
 
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for the bandwidth limits
+"""
+from fabric.api import env
+from mock import patch
+
+from prestoadmin.util import bandwidth
+from prestoadmin.util.bandwidth import MB, Scheduler, TokenBucket
+from tests.base_test_case import BaseTestCase
+
+
+@patch('prestoadmin.util.bandwidth.time')
+class TestBandwidth(BaseTestCase):
+
+    def setUp(self):
+        super(TestBandwidth, self).setUp(capture_output=True)
+        self.addCleanup(setattr, bandwidth, '_scheduler', None)
+
+    def test_bucket_allows_burst(self, time_mock):
+        time_mock.time.return_value = 100.0
+        bucket = TokenBucket(10)
+        self.assertEqual(0.0, bucket.reserve(10))
+
+    def test_bucket_waits_for_debt(self, time_mock):
+        time_mock.time.return_value = 100.0
+        bucket = TokenBucket(10)
+        self.assertEqual(0.0, bucket.reserve(5))
+        self.assertEqual(1.5, bucket.reserve(20))
+        # Tokens come back at the rate, up to the burst
+        time_mock.time.return_value = 102.0
+        self.assertEqual(0.0, bucket.reserve(5))
+        time_mock.time.return_value = 1000.0
+        self.assertEqual(1.0, bucket.reserve(20))
+
+    def test_group_limit(self, time_mock):
+        time_mock.time.return_value = 100.0
+        scheduler = Scheduler(100, {'rack1': {'hosts': ['slave1'],
+                                              'limit': 10}})
+        scheduler.throttle(20 * MB, 'slave1')
+        time_mock.sleep.assert_called_with(1.0)
+        time_mock.sleep.reset_mock()
+        scheduler.throttle(20 * MB, 'slave2')
+        self.assertFalse(time_mock.sleep.called)
+
+    def test_global_limit_shared_by_hosts(self, time_mock):
+        time_mock.time.return_value = 100.0
+        scheduler = Scheduler(10)
+        scheduler.throttle(10 * MB, 'slave1')
+        self.assertFalse(time_mock.sleep.called)
+        scheduler.throttle(5 * MB, 'slave2')
+        time_mock.sleep.assert_called_with(0.5)
+
+    def test_no_limits(self, time_mock):
+        self.assertEqual(None, bandwidth.install())
+        env.host = 'slave1'
+        bandwidth.throttle(100 * MB)
+        self.assertFalse(time_mock.sleep.called)
+
+    def test_install(self, time_mock):
+        time_mock.time.return_value = 100.0
+        env.bandwidth_limit = 1
+        env.host = 'slave1'
+        bandwidth.install()
+        bandwidth.throttle(3 * MB)
+        time_mock.sleep.assert_called_with(2.0)
+
+    def test_report(self, time_mock):
+        env.host = 'slave1'
+        bandwidth.report('presto.rpm', 50 * MB, 2.0)
+        self.assertEqual('Sent presto.rpm to slave1: 50.0 MB in 2.0 seconds '
+                         '(25.0 MB/s)\n', self.test_stdout.getvalue())
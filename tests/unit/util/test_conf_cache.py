@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for the cache of parsed configuration directories
+"""
+import os
+import shutil
+import tempfile
+
+from mock import patch, Mock
+
+from prestoadmin.presto_conf import get_presto_conf
+from prestoadmin.util import conf_cache
+from tests.base_test_case import BaseTestCase
+
+
+class TestConfCache(BaseTestCase):
+
+    def setUp(self):
+        super(TestConfCache, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.conf_dir = os.path.join(self.temp_dir, 'coordinator')
+        os.mkdir(self.conf_dir)
+        self.write('config.properties', 'coordinator=true\n')
+        self.write('jvm.config', '-server\n')
+        cache_patcher = patch('prestoadmin.util.conf_cache.constants.'
+                              'LOCAL_CONF_CACHE',
+                              os.path.join(self.temp_dir, 'cache.json'))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        self.parse = Mock(side_effect=get_presto_conf)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(TestConfCache, self).tearDown()
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.conf_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_parsed_once(self):
+        expected = {'config.properties': {'coordinator': 'true'},
+                    'jvm.config': ['-server']}
+        self.assertEqual(expected, conf_cache.load(self.conf_dir, self.parse))
+        conf = conf_cache.load(self.conf_dir, self.parse)
+        self.assertEqual(expected, conf)
+        self.assertEqual(1, self.parse.call_count)
+        self.assertTrue(isinstance(conf['jvm.config'][0], str))
+
+    def test_changed_file_parsed_again(self):
+        conf_cache.load(self.conf_dir, self.parse)
+        self.write('config.properties', 'coordinator=false\n')
+        conf = conf_cache.load(self.conf_dir, self.parse)
+        self.assertEqual({'coordinator': 'false'}, conf['config.properties'])
+        self.assertEqual(2, self.parse.call_count)
+
+    def test_same_size_and_mtime_checked_by_digest(self):
+        self.write('config.properties', 'coordinator=true\n', mtime=1000)
+        conf_cache.load(self.conf_dir, self.parse)
+        # Touching a file doesn't invalidate the cache, changing it does
+        self.write('config.properties', 'coordinator=true\n', mtime=2000)
+        conf_cache.load(self.conf_dir, self.parse)
+        self.assertEqual(1, self.parse.call_count)
+        self.write('config.properties', 'coordinator=xxxx\n', mtime=3000)
+        conf_cache.load(self.conf_dir, self.parse)
+        self.assertEqual(2, self.parse.call_count)
+
+    def test_added_file_parsed_again(self):
+        conf_cache.load(self.conf_dir, self.parse)
+        self.write('log.properties', 'com.facebook.presto=INFO\n')
+        conf = conf_cache.load(self.conf_dir, self.parse)
+        self.assertEqual({'com.facebook.presto': 'INFO'},
+                         conf['log.properties'])
+        self.assertEqual(2, self.parse.call_count)
+
+    def test_missing_directory_not_cached(self):
+        missing = os.path.join(self.temp_dir, 'workers')
+        conf_cache.load(missing, self.parse)
+        conf_cache.load(missing, self.parse)
+        self.assertEqual(2, self.parse.call_count)
+
+    def test_corrupt_cache_ignored(self):
+        with open(conf_cache.constants.LOCAL_CONF_CACHE, 'w') as f:
+            f.write('{not json')
+        conf = conf_cache.load(self.conf_dir, self.parse)
+        self.assertEqual(['-server'], conf['jvm.config'])
+        conf_cache.load(self.conf_dir, self.parse)
+        self.assertEqual(1, self.parse.call_count)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for the SSH connection pool
+"""
+from fabric import state
+from fabric.api import env, execute
+from mock import patch, MagicMock
+
+from prestoadmin.util import threadpool
+from prestoadmin.util.connection_pool import ConnectionPool
+from tests.base_test_case import BaseTestCase
+
+
+@patch('fabric.network.connect')
+class TestConnectionPool(BaseTestCase):
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.pool = ConnectionPool()
+
+    def test_pool_is_installed(self, connect_mock):
+        from prestoadmin import fabric_patches
+        import fabric.operations
+        self.assertTrue(isinstance(fabric_patches.state.connections,
+                                   ConnectionPool))
+        self.assertTrue(fabric.operations.connections is state.connections)
+
+    def test_connection_reused(self, connect_mock):
+        connect_mock.return_value = MagicMock()
+        first = self.pool['user@host:22']
+        second = self.pool['user@host:22']
+        self.assertTrue(first is second)
+        self.assertEqual(connect_mock.call_count, 1)
+        # Commands of the task that opened the connection don't reuse it
+        self.assertEqual(self.pool.stats(), {'opened': 1, 'reused': 0})
+
+    def test_connection_reused_by_later_tasks(self, connect_mock):
+        connect_mock.return_value = MagicMock()
+        with self.pool.task():
+            self.pool['user@host:22']
+            self.pool['user@host:22']
+        for _ in range(2):
+            with self.pool.task():
+                self.pool['user@host:22']
+                self.pool['user@host:22']
+        self.assertEqual(connect_mock.call_count, 1)
+        self.assertEqual(self.pool.stats(), {'opened': 1, 'reused': 2})
+
+    def test_connection_reused_across_execute_calls(self, connect_mock):
+        connect_mock.return_value = MagicMock()
+        env.parallel = False
+        self.assertEqual(threadpool.PROCESS_ENGINE,
+                         env.get('engine', threadpool.PROCESS_ENGINE))
+
+        def task():
+            return state.connections[env.host_string]
+
+        with patch.object(state, 'connections', self.pool):
+            first = execute(task, hosts=['user@host:22'])
+            second = execute(task, hosts=['user@host:22'])
+        self.assertTrue(first['user@host:22'] is second['user@host:22'])
+        self.assertEqual(connect_mock.call_count, 1)
+        self.assertEqual(self.pool.stats(), {'opened': 1, 'reused': 1})
+
+    def test_different_hosts_opened(self, connect_mock):
+        connect_mock.side_effect = [MagicMock(), MagicMock()]
+        self.pool['user@host1:22']
+        self.pool['user@host2:22']
+        self.assertEqual(self.pool.stats(), {'opened': 2, 'reused': 0})
+
+    def test_inactive_connection_replaced(self, connect_mock):
+        stale = MagicMock()
+        stale.get_transport.return_value.is_active.return_value = False
+        fresh = MagicMock()
+        connect_mock.side_effect = [stale, fresh]
+        self.pool['user@host:22']
+        self.assertTrue(self.pool['user@host:22'] is fresh)
+        self.assertEqual(self.pool.stats(), {'opened': 2, 'reused': 0})
+
+    @patch('prestoadmin.util.connection_pool.os.getpid')
+    def test_inherited_connection_replaced(self, getpid_mock, connect_mock):
+        parent = MagicMock()
+        child = MagicMock()
+        connect_mock.side_effect = [parent, child]
+        getpid_mock.return_value = 100
+        self.pool['user@host:22']
+        getpid_mock.return_value = 101
+        self.assertTrue(self.pool['user@host:22'] is child)
+        self.assertEqual(self.pool['user@host:22'], child)
+        self.assertEqual(self.pool.stats(), {'opened': 2, 'reused': 0})
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for running a command on many hosts from one event loop
+"""
+from fabric.api import env
+from fabric.exceptions import CommandTimeout, NetworkError
+from mock import patch, MagicMock
+
+from prestoadmin.util import fanout
+from tests.base_test_case import BaseTestCase
+
+
+def make_channel(stdout, exit_status, finished=True):
+    pending = [stdout]
+    channel = MagicMock()
+    channel.recv_ready.side_effect = lambda: bool(pending)
+    channel.recv.side_effect = lambda size: pending.pop()
+    channel.recv_stderr_ready.return_value = False
+    channel.exit_status_ready.return_value = finished
+    channel.recv_exit_status.return_value = exit_status
+    return channel
+
+
+class TestFanout(BaseTestCase):
+
+    def setUp(self):
+        super(TestFanout, self).setUp()
+        env.password = None
+        env.passwords = {}
+
+    def _connections(self, channels):
+        connections = {}
+        for host, channel in channels.items():
+            client = MagicMock()
+            client.get_transport.return_value.open_session.return_value = \
+                channel
+            connections[host] = client
+        return connections
+
+    def test_run_on_hosts(self):
+        channels = {'a': make_channel('out a', 0),
+                    'b': make_channel('out b', 1)}
+        with patch('fabric.state.connections', self._connections(channels)):
+            results = fanout.run_on_hosts('hostname', ['a', 'b'])
+
+        self.assertEqual(results['a'], 'out a')
+        self.assertTrue(results['a'].succeeded)
+        self.assertEqual(results['b'], 'out b')
+        self.assertTrue(results['b'].failed)
+        self.assertEqual(results['b'].return_code, 1)
+        self.assertEqual(results['a'].command, 'hostname')
+        channels['a'].exec_command.assert_called_with(
+            results['a'].real_command)
+
+    def test_run_commands(self):
+        channels = {'a': make_channel('out a', 0),
+                    'b': make_channel('out b', 0)}
+        with patch('fabric.state.connections', self._connections(channels)):
+            results = fanout.run_commands({'a': 'hostname', 'b': 'uptime'})
+
+        self.assertEqual('hostname', results['a'].command)
+        self.assertEqual('uptime', results['b'].command)
+
+    def test_on_result_as_hosts_finish(self):
+        channels = {'a': make_channel('out a', 0, finished=False),
+                    'b': make_channel('out b', 0)}
+        streamed = []
+
+        def on_result(host, result):
+            streamed.append((host, result))
+            channels['a'].exit_status_ready.return_value = True
+
+        with patch('fabric.state.connections', self._connections(channels)):
+            results = fanout.run_on_hosts('hostname', ['a', 'b'],
+                                          on_result=on_result)
+
+        self.assertEqual([('b', 'out b'), ('a', 'out a')], streamed)
+        self.assertEqual(dict(streamed), results)
+
+    def test_connection_error(self):
+        error = NetworkError('Timed out trying to connect to b')
+        connections = MagicMock()
+        connections.__getitem__.side_effect = error
+        with patch('fabric.state.connections', connections):
+            results = fanout.run_on_hosts('hostname', ['b'])
+        self.assertEqual(results, {'b': error})
+
+    def test_timeout(self):
+        channels = {'a': make_channel('', 0, finished=False)}
+        with patch('fabric.state.connections', self._connections(channels)):
+            results = fanout.run_on_hosts('sleep 100', ['a'], timeout=0.01)
+        self.assertTrue(isinstance(results['a'], CommandTimeout))
+        channels['a'].close.assert_called_with()
+
+    def test_sudo_password(self):
+        env.password = 'secret'
+        channel = make_channel(env.sudo_prompt, 0)
+        with patch('fabric.state.connections',
+                   self._connections({'a': channel})):
+            results = fanout.run_on_hosts('whoami', ['a'], use_sudo=True)
+        channel.sendall.assert_called_with('secret\n')
+        self.assertEqual(results['a'], '')
+        self.assertTrue(results['a'].real_command.startswith('sudo -S'))
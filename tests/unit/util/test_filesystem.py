@@ -13,6 +13,9 @@
 # limitations under the License.
 
 import errno
+import hashlib
+import os
+import tempfile
 from mock import patch
 from prestoadmin.util import filesystem
 from tests.base_test_case import BaseTestCase
@@ -42,3 +45,15 @@ class TestFilesystem(BaseTestCase):
         self.assertRaisesRegexp(OSError, 'message',
                                 filesystem.write_to_file_if_not_exists,
                                 'content', 'path/to/anyfile')
+
+    def test_sha256(self):
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as f:
+            f.write('rpm contents')
+        expected = hashlib.sha256('rpm contents').hexdigest()
+        self.assertEqual(expected, filesystem.sha256(path))
+        with patch('prestoadmin.util.filesystem.open', create=True) as \
+                open_mock:
+            self.assertEqual(expected, filesystem.sha256(path))
+            self.assertFalse(open_mock.called)
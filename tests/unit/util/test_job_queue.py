@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for the adaptive job queue
+"""
+import threading
+from Queue import Queue
+
+from mock import patch
+
+from prestoadmin.util import job_queue, threadpool
+from prestoadmin.util.exception import TaskTimeoutError
+from prestoadmin.util.job_queue import AdaptiveJobQueue, \
+    PoolSizeController, StreamingJobQueue, BASELINE_SAMPLES
+from tests.base_test_case import BaseTestCase
+
+
+class TestPoolSizeController(BaseTestCase):
+
+    def test_initial_pool_size_capped(self):
+        self.assertEqual(PoolSizeController(4).pool_size, 4)
+        self.assertEqual(PoolSizeController(100, 16).pool_size, 16)
+
+    def test_grows_while_healthy(self):
+        controller = PoolSizeController(100, 4)
+        for i in range(4):
+            controller.record(1, True)
+        self.assertEqual(controller.pool_size, 8)
+
+    def test_never_exceeds_max(self):
+        controller = PoolSizeController(6, 4)
+        for i in range(20):
+            controller.record(1, True)
+        self.assertEqual(controller.pool_size, 6)
+
+    def test_shrinks_on_latency(self):
+        controller = PoolSizeController(100, 1)
+        for i in range(BASELINE_SAMPLES):
+            controller.record(1, True)
+        size = controller.pool_size
+        controller.record(10, True)
+        self.assertEqual(controller.pool_size, size / 2)
+
+    def test_shrinks_on_failures(self):
+        controller = PoolSizeController(100, 2)
+        for i in range(2):
+            controller.record(1, True)
+        for i in range(3):
+            controller.record(1, False)
+        self.assertTrue(controller.pool_size < 4)
+
+    def test_never_below_one(self):
+        controller = PoolSizeController(100, 1)
+        for i in range(20):
+            controller.record(1, False)
+        self.assertEqual(controller.pool_size, 1)
+
+
+def append_jobs(jobs, comms_queue, names):
+    for name in names:
+        def target(name=name):
+            comms_queue.put({'name': name, 'result': name.upper()})
+        job = threadpool.Process(target=target)
+        job.name = name
+        jobs.append(job)
+    jobs.close()
+
+
+class TestStreamingJobQueue(BaseTestCase):
+
+    def test_on_result_called_per_job(self):
+        comms_queue = Queue()
+        streamed = []
+        jobs = StreamingJobQueue(
+            1, comms_queue,
+            on_result=lambda name, result: streamed.append((name, result)))
+        append_jobs(jobs, comms_queue, ['a', 'b', 'c'])
+        results = jobs.run()
+        self.assertEqual(sorted(streamed), [('a', 'A'), ('b', 'B'),
+                                            ('c', 'C')])
+        self.assertEqual(results['b'], {'exit_code': 0, 'results': 'B'})
+
+    def test_overdue_job_killed(self):
+        comms_queue = Queue()
+        streamed = []
+        released = threading.Event()
+        jobs = StreamingJobQueue(
+            2, comms_queue, timeout=0.2,
+            on_result=lambda name, result: streamed.append((name, result)))
+
+        def hang():
+            released.wait()
+            comms_queue.put({'name': 'hung', 'result': 'too late'})
+        hung = threadpool.Process(target=hang)
+        hung.name = 'hung'
+        jobs.append(hung)
+        append_jobs(jobs, comms_queue, ['a'])
+
+        with patch.object(job_queue, 'KILL_WAIT', 1):
+            with patch.object(hung, 'terminate',
+                              side_effect=released.set) as terminate_mock:
+                results = jobs.run()
+        self.assertTrue(terminate_mock.called)
+        self.assertEqual(results['a'], {'exit_code': 0, 'results': 'A'})
+        self.assertEqual(results['hung']['exit_code'], 1)
+        self.assertTrue(isinstance(results['hung']['results'],
+                                   TaskTimeoutError))
+        self.assertEqual(['a', 'hung'], sorted(name for name, _ in streamed))
+
+
+class TestAdaptiveJobQueue(BaseTestCase):
+
+    def test_run_returns_results(self):
+        comms_queue = Queue()
+        jobs = AdaptiveJobQueue(2, comms_queue)
+        append_jobs(jobs, comms_queue, ['a', 'b', 'c'])
+        results = jobs.run()
+        self.assertEqual(results, {
+            'a': {'exit_code': 0, 'results': 'A'},
+            'b': {'exit_code': 0, 'results': 'B'},
+            'c': {'exit_code': 0, 'results': 'C'}})
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for distributing files over HTTP, with the server and the hosts on
+the loopback interface
+"""
+import os
+import shutil
+import tempfile
+import urllib2
+
+from fabric.api import env
+from mock import patch
+
+from prestoadmin.util import pull
+from tests.base_test_case import BaseTestCase
+from tests.unit.shell import quiet_shell
+
+
+@patch('prestoadmin.util.pull.run', quiet_shell)
+@patch('prestoadmin.util.pull.sudo', quiet_shell)
+class TestPull(BaseTestCase):
+
+    def setUp(self):
+        super(TestPull, self).setUp(capture_output=True)
+        self.temp_dir = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.temp_dir, 'presto.rpm')
+        self.content = ''.join(chr(i % 256) for i in range(100000))
+        with open(self.local_path, 'wb') as f:
+            f.write(self.content)
+        self.remote_path = os.path.join(self.temp_dir, 'remote', 'presto.rpm')
+        env.pull = True
+        env.pull_address = '127.0.0.1'
+        env.host = 'localhost'
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(TestPull, self).tearDown()
+
+    def url(self, url_path=None):
+        if url_path is None:
+            url_path = pull._served[self.local_path][0]
+        return 'http://127.0.0.1:%d%s' % (pull._server.server_address[1],
+                                          url_path)
+
+    def get(self, url, headers=None):
+        return urllib2.urlopen(urllib2.Request(url, headers=headers or {}))
+
+    def test_disabled_by_default(self):
+        env.pull = False
+        with pull.serving(self.local_path):
+            self.assertFalse(pull.is_served(self.local_path))
+            self.assertEqual(None, pull._server)
+
+    def test_serve_file(self):
+        with pull.serving(self.local_path):
+            self.assertTrue(pull.is_served(self.local_path))
+            self.assertEqual(self.content, self.get(self.url()).read())
+        self.assertFalse(pull.is_served(self.local_path))
+        self.assertEqual(None, pull._server)
+
+    def test_serve_range(self):
+        with pull.serving(self.local_path):
+            response = self.get(self.url(), {'Range': 'bytes=10-19'})
+            self.assertEqual(206, response.getcode())
+            self.assertEqual('bytes 10-19/100000',
+                             response.info()['Content-Range'])
+            self.assertEqual(self.content[10:20], response.read())
+            response = self.get(self.url(), {'Range': 'bytes=99990-'})
+            self.assertEqual(self.content[99990:], response.read())
+
+    def test_range_not_satisfiable(self):
+        with pull.serving(self.local_path):
+            try:
+                self.get(self.url(), {'Range': 'bytes=100000-'})
+                self.fail('Expected HTTP error 416')
+            except urllib2.HTTPError, e:
+                self.assertEqual(416, e.code)
+
+    def test_only_served_files(self):
+        with pull.serving(self.local_path):
+            try:
+                self.get(self.url('/presto.rpm'))
+                self.fail('Expected HTTP error 404')
+            except urllib2.HTTPError, e:
+                self.assertEqual(404, e.code)
+
+    def test_fetch(self):
+        with pull.serving(self.local_path):
+            self.assertTrue(pull.fetch(self.local_path, self.remote_path))
+        with open(self.remote_path, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+        self.assertEqual(['presto.rpm'],
+                         os.listdir(os.path.dirname(self.remote_path)))
+        self.assertTrue('Sent presto.rpm to localhost' in
+                        self.test_stdout.getvalue())
+
+    def test_fetch_resumes_partial_file(self):
+        with pull.serving(self.local_path):
+            digest = pull._served[self.local_path][1]
+            partial = '%s.%s.part' % (self.remote_path, digest[:16])
+            os.mkdir(os.path.dirname(self.remote_path))
+            with open(partial, 'wb') as f:
+                f.write(self.content[:50000])
+            self.assertTrue(pull.fetch(self.local_path, self.remote_path))
+        with open(self.remote_path, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+        self.assertFalse(os.path.exists(partial))
+
+    def test_fetch_replaces_corrupt_file(self):
+        with pull.serving(self.local_path):
+            digest = pull._served[self.local_path][1]
+            partial = '%s.%s.part' % (self.remote_path, digest[:16])
+            os.mkdir(os.path.dirname(self.remote_path))
+            with open(partial, 'wb') as f:
+                f.write('x' * len(self.content))
+            self.assertTrue(pull.fetch(self.local_path, self.remote_path))
+        with open(self.remote_path, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+
+    @patch('prestoadmin.util.pull.FETCH_ATTEMPTS', 1)
+    def test_fetch_fails(self):
+        with pull.serving(self.local_path):
+            pull._served[self.local_path] = ('/missing', 'digest')
+            self.assertFalse(pull.fetch(self.local_path, self.remote_path))
+        self.assertFalse(os.path.exists(self.remote_path))
+
+    @patch('prestoadmin.util.pull.bandwidth.throttle')
+    def test_throttle_by_host_name(self, throttle):
+        env.bandwidth_groups = {'local': {'hosts': ['localhost'],
+                                          'limit': 1}}
+        with pull.serving(self.local_path):
+            self.get(self.url()).read()
+        self.assertTrue(throttle.call_args_list)
+        for args, kwargs in throttle.call_args_list:
+            self.assertEqual('localhost', args[1])
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for distributing files through relay hosts
+"""
+from fabric.api import env
+from mock import MagicMock, patch
+
+from prestoadmin.util import relay
+from tests.base_test_case import BaseTestCase
+
+HOSTS = ['h%d' % i for i in range(10)]
+
+
+def remote_result(failed=False):
+    result = MagicMock()
+    result.failed = failed
+    return result
+
+
+@patch('prestoadmin.util.relay.connect_all')
+@patch('prestoadmin.util.relay.sha256', return_value='checksum')
+@patch('prestoadmin.util.relay.os.path.getsize', return_value=1000)
+class TestRelay(BaseTestCase):
+
+    def setUp(self):
+        super(TestRelay, self).setUp(capture_output=True)
+
+    def test_children(self, *mocks):
+        self.assertEqual([0, 1], relay.children(-1, 10, 2))
+        self.assertEqual([2, 3], relay.children(0, 10, 2))
+        self.assertEqual([8, 9], relay.children(3, 10, 2))
+        self.assertEqual([], relay.children(4, 10, 2))
+        self.assertEqual([9], relay.children(2, 10, 3))
+
+    def test_disabled_by_default(self, *mocks):
+        self.assertFalse(relay.enabled(HOSTS))
+        self.assertEqual(set(), relay.distribute('/tmp/presto.rpm', '/opt',
+                                                 HOSTS))
+
+    def test_not_enabled_for_small_clusters(self, *mocks):
+        env.relay_fanout = 4
+        self.assertFalse(relay.enabled(HOSTS[:4]))
+        self.assertTrue(relay.enabled(HOSTS[:5]))
+
+    @patch('prestoadmin.util.relay._relay')
+    @patch('prestoadmin.util.relay._upload', return_value=[0, 1])
+    def test_distribute_through_tree(self, upload_mock, relay_mock, *mocks):
+        env.relay_fanout = 2
+        relay_mock.side_effect = lambda edges, path, checksum, size: \
+            set(child for parent, child in edges if child != 'h3')
+
+        staged = relay.distribute('/tmp/presto.rpm', '/opt/packages', HOSTS)
+
+        upload_mock.assert_called_with('/tmp/presto.rpm', '/opt/packages',
+                                       HOSTS, [0, 1])
+        rounds = [call[0][0] for call in relay_mock.call_args_list]
+        self.assertEqual([[('h0', 'h2'), ('h0', 'h3'), ('h1', 'h4'),
+                           ('h1', 'h5')],
+                          [('h2', 'h6'), ('h2', 'h7')]], rounds)
+        self.assertEqual(set(HOSTS) - set(['h3', 'h8', 'h9']), staged)
+        self.assertEqual('/opt/packages/presto.rpm',
+                         relay_mock.call_args[0][1])
+
+    @patch('prestoadmin.util.relay._relay', return_value=set())
+    @patch('prestoadmin.util.relay._upload', return_value=[1])
+    def test_is_staged(self, *mocks):
+        env.relay_fanout = 2
+        relay.distribute('/tmp/presto.rpm', '/opt/packages', HOSTS)
+        env.host_string = 'h1'
+        self.assertTrue(relay.is_staged('/tmp/presto.rpm', '/opt/packages'))
+        self.assertFalse(relay.is_staged('/tmp/other.rpm', '/opt/packages'))
+        env.host_string = 'h0'
+        self.assertFalse(relay.is_staged('/tmp/presto.rpm', '/opt/packages'))
+
+    @patch('prestoadmin.util.relay.put_resumable')
+    @patch('prestoadmin.util.relay.sudo')
+    def test_upload_is_resumable(self, sudo_mock, put_mock, *mocks):
+        sudo_mock.return_value = remote_result()
+        put_mock.side_effect = lambda local_path, remote_path, use_sudo: \
+            env.host != 'h1'
+        self.assertEqual([0, 2], relay._upload('/tmp/presto.rpm',
+                                               '/opt/packages', HOSTS,
+                                               [0, 1, 2]))
+        put_mock.assert_called_with('/tmp/presto.rpm',
+                                    '/opt/packages/presto.rpm',
+                                    use_sudo=True)
+
+    @patch('prestoadmin.util.relay.RemoteCommand')
+    def test_transfer_sender_done_before_receiver(self, command_mock,
+                                                  *mocks):
+        receiver = MagicMock()
+        receiver.stdout = ['port=1234\n']
+        receiver.poll.side_effect = [False, False, True]
+        receiver.result.return_value = remote_result()
+        sender = command_mock.return_value
+        sender.poll.side_effect = [False, True]
+        sender.result.return_value = remote_result()
+        transfer = relay._Transfer('h0', 'h1', receiver, '10.0.0.1',
+                                   'token')
+
+        self.assertFalse(transfer.poll('/opt/presto.rpm'))
+        self.assertFalse(transfer.poll('/opt/presto.rpm'))
+        self.assertTrue(transfer.poll('/opt/presto.rpm'))
+
+        self.assertTrue(transfer.succeeded())
+        self.assertEqual(2, sender.poll.call_count)
+        self.assertEqual(1, sender.close.call_count)
+        send = command_mock.call_args[0][1]
+        self.assertTrue(send.endswith(" '10.0.0.1' 1234 '/opt/presto.rpm' "
+                                      "%d token" % relay.RELAY_TIMEOUT))
+
+    @patch('prestoadmin.util.relay.RemoteCommand')
+    def test_transfer_sender_failed(self, command_mock, *mocks):
+        receiver = MagicMock()
+        receiver.stdout = ['port=1234\n']
+        receiver.poll.return_value = False
+        sender = command_mock.return_value
+        sender.poll.return_value = True
+        sender.result.return_value = remote_result(failed=True)
+        transfer = relay._Transfer('h0', 'h1', receiver, '10.0.0.1',
+                                   'token')
+
+        self.assertTrue(transfer.poll('/opt/presto.rpm'))
+
+        self.assertFalse(transfer.succeeded())
+        self.assertTrue(receiver.close.called)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for sending many remote commands in one round trip
+"""
+import os
+import shutil
+import tempfile
+
+from fabric.api import env
+from fabric.context_managers import settings
+from mock import patch
+
+from prestoadmin.util import remote_batch
+from prestoadmin.util.remote_batch import RemoteBatch, quote
+from tests.base_test_case import BaseTestCase
+from tests.unit.shell import local_shell, quiet_shell
+
+
+@patch('prestoadmin.util.remote_batch.run', local_shell)
+@patch('prestoadmin.util.remote_batch.sudo', local_shell)
+class TestRemoteBatch(BaseTestCase):
+
+    def setUp(self):
+        super(TestRemoteBatch, self).setUp(capture_output=True)
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(TestRemoteBatch, self).tearDown()
+
+    def test_results_per_step(self):
+        batch = RemoteBatch()
+        batch.add('echo one')
+        batch.add('echo two; exit 3', warn_only=True)
+        batch.add('printf three')
+        results = batch.run()
+        self.assertEqual(['one', 'two', 'three'], results)
+        self.assertEqual([0, 3, 0], [r.return_code for r in results])
+        self.assertTrue(results[1].failed)
+        self.assertEqual('printf three', results[2].command)
+
+    def test_stops_at_first_failure(self):
+        batch = RemoteBatch()
+        batch.add('echo one')
+        batch.add('exit 2')
+        batch.add('echo three')
+        with settings(warn_only=True):
+            with patch('prestoadmin.util.remote_batch.error') as error_mock:
+                results = batch.run(use_sudo=True)
+        self.assertEqual('one', results[0])
+        self.assertEqual(2, results[1].return_code)
+        self.assertEqual(None, results[2])
+        self.assertTrue('sudo() received nonzero return code 2'
+                        in error_mock.call_args[0][0])
+
+    def test_aborts_on_failure(self):
+        batch = RemoteBatch()
+        batch.add('exit 1')
+        self.assertRaises(SystemExit, batch.run)
+
+    def test_only_shown_output_is_printed(self):
+        batch = RemoteBatch()
+        batch.add('echo hidden')
+        batch.add('echo shown', show_output=True)
+        batch.run()
+        self.assertEqual('[host] out: shown\n', self.test_stdout.getvalue())
+
+    def test_write_file(self):
+        path = os.path.join(self.temp_dir, 'file')
+        content = "it's got 'quotes' and $dollars\nand lines\n"
+        batch = RemoteBatch()
+        batch.write_file(path, content)
+        batch.run()
+        with open(path) as f:
+            self.assertEqual(content, f.read())
+
+    def test_append_lines(self):
+        path = os.path.join(self.temp_dir, 'file')
+        with open(path, 'w') as f:
+            f.write('node.id=1\nkey=value\n')
+        batch = RemoteBatch()
+        batch.append_lines(path, 'key=value\nother=value')
+        batch.run()
+        with open(path) as f:
+            self.assertEqual('node.id=1\nkey=value\nother=value\n', f.read())
+
+    def test_split_into_scripts(self):
+        batch = RemoteBatch()
+        for i in range(5):
+            batch.add('echo %d' % i)
+        with patch.object(remote_batch, 'MAX_SCRIPT_SIZE', 200):
+            self.assertTrue(len(batch._scripts()) > 1)
+            results = batch.run()
+        self.assertEqual(['0', '1', '2', '3', '4'], results)
+
+    def test_run_batches(self):
+        def run_commands(commands, use_sudo=False):
+            return dict((host, Exception('Timed out') if host == 'c'
+                         else quiet_shell(command))
+                        for host, command in commands.items())
+
+        batches = {}
+        for host in ['a', 'b', 'c']:
+            batches[host] = RemoteBatch()
+            batches[host].add('echo %s 1' % host)
+            batches[host].add('exit 2' if host == 'b' else 'echo 2')
+            batches[host].add('echo %s 3' % host)
+        with patch.object(remote_batch, 'MAX_SCRIPT_SIZE', 200), \
+                patch('prestoadmin.util.remote_batch.fanout.run_commands',
+                      run_commands):
+            results = remote_batch.run_batches(batches)
+
+        self.assertEqual(['a 1', '2', 'a 3'], results['a'])
+        self.assertEqual('b 1', results['b'][0])
+        self.assertEqual(2, results['b'][1].return_code)
+        self.assertEqual(None, results['b'][2])
+        self.assertEqual('Timed out', str(results['c']))
+        self.assertEqual('', self.test_stdout.getvalue())
+
+    def test_sudo_prompt_passed_through(self):
+        batch = RemoteBatch()
+        stream = remote_batch._StepOutputFilter(batch.marker, batch.steps,
+                                                self.test_stdout)
+        stream.write('[host] out: ' + env.sudo_prompt)
+        self.assertEqual('[host] out: ' + env.sudo_prompt,
+                         self.test_stdout.getvalue())
+
+    def test_quote(self):
+        self.assertEqual("'basic_text'", quote('basic_text'))
+        self.assertEqual("'A quote! '\\'' A quote!'",
+                         quote("A quote! ' A quote!"))
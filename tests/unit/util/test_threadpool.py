@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for the thread based execution engine
+"""
+import sys
+import threading
+
+from fabric import state
+from fabric.context_managers import hide
+from fabric.state import env, output
+from fabric.utils import _AliasDict, _AttributeDict
+from mock import Mock, patch
+
+from prestoadmin.util import threadpool
+from tests.base_test_case import BaseTestCase
+
+
+class TestThreadPool(BaseTestCase):
+
+    def tearDown(self):
+        self.assertTrue(type(env) is _AttributeDict)
+        self.assertTrue(type(output) is _AliasDict)
+        super(TestThreadPool, self).tearDown()
+
+    def test_thread_starts_with_copy_of_env(self):
+        env.test_value = 'parent'
+        seen = []
+
+        def target():
+            seen.append(env.test_value)
+            env.test_value = 'child'
+            seen.append(env.test_value)
+
+        with threadpool.thread_local_state():
+            self.assertTrue(isinstance(env, threadpool.ThreadLocalEnv))
+            process = threadpool.Process(target=target)
+            process.start()
+            process.join()
+        self.assertEqual(seen, ['parent', 'child'])
+        self.assertEqual(env.test_value, 'parent')
+
+    def test_threads_are_isolated(self):
+        seen = {}
+
+        def target(name):
+            env.host_string = name
+            seen[name] = env.host_string
+
+        with threadpool.thread_local_state():
+            processes = [threadpool.Process(target=target,
+                                            kwargs={'name': n})
+                         for n in ['a', 'b', 'c']]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        self.assertEqual(seen, {'a': 'a', 'b': 'b', 'c': 'c'})
+
+    def test_threads_have_own_output(self):
+        hidden = threading.Event()
+        checked = threading.Event()
+        seen = []
+
+        def target():
+            with hide('everything'):
+                seen.append(output.running)
+                hidden.set()
+                checked.wait(10)
+            seen.append(output.running)
+
+        output.running = True
+        with threadpool.thread_local_state():
+            self.assertTrue(isinstance(output, threadpool.ThreadLocalOutput))
+            process = threadpool.Process(target=target)
+            process.start()
+            hidden.wait(10)
+            self.assertTrue(output.running)
+            checked.set()
+            process.join()
+        self.assertEqual(seen, [False, True])
+
+    def test_state_restored_after_last_thread(self):
+        released = threading.Event()
+        with threadpool.thread_local_state():
+            process = threadpool.Process(target=released.wait,
+                                         kwargs={'timeout': 10})
+            process.start()
+        # The thread outlived the block, so it keeps its own env
+        self.assertTrue(isinstance(env, threadpool.ThreadLocalEnv))
+        released.set()
+        process.join()
+
+    def test_process_outside_block_leaves_env_alone(self):
+        process = threadpool.Process(target=lambda: None)
+        process.start()
+        process.join()
+        self.assertEqual(0, process.exitcode)
+
+    def test_exit_code(self):
+        def succeed():
+            pass
+
+        def fail():
+            sys.exit(1)
+
+        def raise_error():
+            raise ValueError('error')
+
+        for target, exit_code in [(succeed, 0), (fail, 1), (raise_error, 1)]:
+            process = threadpool.Process(target=target)
+            process.start()
+            process.join()
+            self.assertEqual(process.exitcode, exit_code)
+
+    def test_terminate_closes_connection(self):
+        connection = Mock()
+        with patch.object(state, 'connections',
+                          {'user@master:22': connection}):
+            process = threadpool.Process(target=None)
+            process.name = 'user@master:22'
+            process.terminate()
+        connection.close.assert_called_with()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for the timing trace
+"""
+import os
+import shutil
+import tempfile
+
+from fabric.api import env
+from fabric.context_managers import settings
+
+from prestoadmin.util import tracing
+from tests.base_test_case import BaseTestCase
+
+
+def task_span(task, host, duration, start=0):
+    return {'kind': tracing.TASK, 'task': task, 'host': host,
+            'start': start, 'duration': duration}
+
+
+class TestTracing(BaseTestCase):
+
+    def setUp(self):
+        super(TestTracing, self).setUp(capture_output=True)
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'trace.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(TestTracing, self).tearDown()
+
+    def test_disabled_by_default(self):
+        self.assertFalse(tracing.enabled())
+        with tracing.span(tracing.COMMAND, command='uptime'):
+            pass
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_span_written(self):
+        tracing.start(self.path)
+        with settings(host_string='master', command='server.start'):
+            with tracing.span(tracing.COMMAND, command='uptime') as span:
+                span['exit_code'] = 0
+        spans = tracing.read_spans(self.path)
+        self.assertEqual(1, len(spans))
+        self.assertEqual('command', spans[0]['kind'])
+        self.assertEqual('master', spans[0]['host'])
+        self.assertEqual('server.start', spans[0]['task'])
+        self.assertEqual('uptime', spans[0]['command'])
+        self.assertEqual(0, spans[0]['exit_code'])
+        self.assertTrue(spans[0]['duration'] >= 0)
+
+    def test_span_written_on_error(self):
+        tracing.start(self.path)
+
+        def fail():
+            with tracing.span(tracing.TASK, exit_code=1):
+                raise Exception('failed')
+        self.assertRaises(Exception, fail)
+        spans = tracing.read_spans(self.path)
+        self.assertEqual(1, spans[0]['exit_code'])
+
+    def test_start_replaces_trace(self):
+        with open(self.path, 'w') as f:
+            f.write('old trace\n')
+        tracing.start(self.path)
+        self.assertEqual([], tracing.read_spans(self.path))
+        self.assertEqual(self.path, env.trace_file)
+
+    def test_percentile(self):
+        values = range(1, 21)
+        self.assertEqual(10, tracing.percentile(values, 0.5))
+        self.assertEqual(19, tracing.percentile(values, 0.95))
+        self.assertEqual(3, tracing.percentile([3], 0.95))
+
+    def test_summarize(self):
+        spans = [task_span('server.start', 'slave1', 2.0, start=1),
+                 task_span('server.start', 'slave2', 4.0, start=2),
+                 task_span('configuration.deploy', 'slave1', 1.0, start=0),
+                 {'kind': tracing.COMMAND, 'task': 'server.start',
+                  'host': 'slave1', 'start': 1, 'duration': 10.0}]
+        rows, slowest = tracing.summarize(spans)
+        self.assertEqual([('configuration.deploy', 1, 1.0, 1.0, 1.0),
+                          ('server.start', 2, 2.0, 4.0, 4.0)], rows)
+        self.assertEqual([(4.0, 'slave2', 'server.start'),
+                          (2.0, 'slave1', 'server.start'),
+                          (1.0, 'slave1', 'configuration.deploy')], slowest)
+
+    def test_slowest_hosts_limited(self):
+        spans = [task_span('server.start', 'slave%d' % i, i)
+                 for i in range(tracing.SLOWEST_HOSTS + 3)]
+        rows, slowest = tracing.summarize(spans)
+        self.assertEqual(tracing.SLOWEST_HOSTS, len(slowest))
+        self.assertEqual('slave%d' % (tracing.SLOWEST_HOSTS + 2),
+                         slowest[0][1])
+
+    def test_print_summary(self):
+        tracing.start(self.path)
+        with settings(host_string='slave1', command='server.start'):
+            tracing.record(tracing.TASK, 0, 1.5)
+        tracing.print_summary()
+        output = self.test_stdout.getvalue()
+        self.assertTrue('server.start' in output)
+        self.assertTrue('slave1' in output)
+        self.assertTrue('Trace written to: ' + self.path in output)
+
+    def test_print_summary_disabled(self):
+        tracing.print_summary()
+        self.assertEqual('', self.test_stdout.getvalue())
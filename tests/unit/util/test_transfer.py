@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests for resumable uploads
+"""
+import os
+import shutil
+import socket
+import tempfile
+
+from fabric.api import env
+from mock import patch
+
+from prestoadmin.util import filesystem, transfer
+from tests.base_test_case import BaseTestCase
+from tests.unit.shell import quiet_shell
+
+CHUNK_SIZE = 16
+
+
+class LocalFile(object):
+    """
+    Stand-in for a paramiko SFTPFile that can drop the connection after
+    a number of bytes have been written
+    """
+
+    def __init__(self, path, mode, fail_after):
+        self.file = open(path, mode + 'b')
+        self.fail_after = fail_after
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def seek(self, offset):
+        self.file.seek(offset)
+
+    def write(self, data):
+        if self.fail_after is not None:
+            if self.fail_after <= 0:
+                raise socket.error('Connection reset by peer')
+            self.fail_after -= len(data)
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+class LocalSftp(object):
+    """
+    Stand-in for a paramiko SFTPClient on the local file system
+    """
+
+    def __init__(self, home, fail_after=None):
+        self.home = home
+        self.fail_after = fail_after
+        self.opened = []
+
+    def normalize(self, path):
+        return self.home
+
+    def truncate(self, path, size):
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+    def open(self, path, mode):
+        self.opened.append((path, mode))
+        remote = LocalFile(path, mode, self.fail_after)
+        self.fail_after = None
+        return remote
+
+    def close(self):
+        pass
+
+
+@patch('prestoadmin.util.transfer.CHUNK_SIZE', CHUNK_SIZE)
+@patch('prestoadmin.util.transfer.run', quiet_shell)
+@patch('prestoadmin.util.transfer.sudo', quiet_shell)
+@patch('prestoadmin.util.transfer._disconnect')
+class TestTransfer(BaseTestCase):
+
+    def setUp(self):
+        super(TestTransfer, self).setUp(capture_output=True)
+        self.temp_dir = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.temp_dir, 'presto.rpm')
+        self.content = ''.join(chr(ord('a') + i % 26) for i in range(100))
+        with open(self.local_path, 'wb') as f:
+            f.write(self.content)
+        self.remote_dir = os.path.join(self.temp_dir, 'remote')
+        os.mkdir(self.remote_dir)
+        self.remote_path = os.path.join(self.remote_dir, 'presto.rpm')
+        env.host = 'master'
+        filesystem._digests.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(TestTransfer, self).tearDown()
+
+    def put(self, sftp, use_sudo=False):
+        with patch('prestoadmin.util.transfer._sftp', return_value=sftp):
+            return transfer.put_resumable(self.local_path, self.remote_path,
+                                          use_sudo=use_sudo)
+
+    def remote_content(self):
+        with open(self.remote_path, 'rb') as f:
+            return f.read()
+
+    def partial_files(self, directory):
+        return [name for name in os.listdir(directory)
+                if name.endswith(transfer.PARTIAL_SUFFIX)]
+
+    def test_chunk_digests(self, *mocks):
+        chunks, digest = filesystem.chunk_digests(self.local_path,
+                                                  transfer.CHUNK_SIZE)
+        self.assertEqual(7, len(chunks))
+        self.assertEqual(64, len(digest))
+
+    def test_digests_shared_with_sha256(self, *mocks):
+        with patch('prestoadmin.util.transfer.CHUNK_SIZE',
+                   filesystem.CHUNK_SIZE):
+            filesystem.sha256(self.local_path)
+            with patch('prestoadmin.util.filesystem.open', create=True) as \
+                    open_mock:
+                self.assertTrue(self.put(LocalSftp(self.temp_dir)))
+                self.assertFalse(open_mock.called)
+
+    def test_put(self, *mocks):
+        sftp = LocalSftp(self.temp_dir)
+        self.assertTrue(self.put(sftp))
+        self.assertEqual(self.content, self.remote_content())
+        self.assertEqual([], self.partial_files(self.remote_dir))
+        self.assertEqual('w', sftp.opened[0][1])
+
+    def test_put_with_sudo_stages_in_home(self, *mocks):
+        sftp = LocalSftp(self.temp_dir)
+        self.assertTrue(self.put(sftp, use_sudo=True))
+        self.assertEqual(self.temp_dir, os.path.dirname(sftp.opened[0][0]))
+        self.assertEqual(self.content, self.remote_content())
+        self.assertEqual([], self.partial_files(self.temp_dir))
+        self.assertEqual([], self.partial_files(self.remote_dir))
+
+    def test_resume_after_dropped_connection(self, disconnect_mock, *mocks):
+        sftp = LocalSftp(self.temp_dir, fail_after=40)
+        self.assertTrue(self.put(sftp))
+        self.assertTrue(disconnect_mock.called)
+        self.assertEqual(self.content, self.remote_content())
+        # 48 bytes were written before the connection dropped, so the
+        # upload resumes after the third chunk
+        self.assertEqual('r+', sftp.opened[1][1])
+
+    def test_resume_skips_verified_chunks(self, *mocks):
+        _, digest = filesystem.chunk_digests(self.local_path,
+                                             transfer.CHUNK_SIZE)
+        partial = os.path.join(self.remote_dir, '.presto.rpm.%s.part' %
+                               digest[:16])
+        # The first chunk is good, the second is corrupt
+        with open(partial, 'wb') as f:
+            f.write(self.content[:16] + 'x' * 16)
+        chunks = filesystem.chunk_digests(self.local_path,
+                                          transfer.CHUNK_SIZE)[0]
+        self.assertEqual(16, transfer.verified_offset(partial, chunks))
+        self.assertTrue(self.put(LocalSftp(self.temp_dir)))
+        self.assertEqual(self.content, self.remote_content())
+        self.assertFalse(os.path.exists(partial))
+
+    def test_destination_untouched_on_failure(self, *mocks):
+        with open(self.remote_path, 'w') as f:
+            f.write('old')
+        sftp = LocalSftp(self.temp_dir, fail_after=0)
+        with patch('prestoadmin.util.transfer.MAX_ATTEMPTS', 1):
+            self.assertFalse(self.put(sftp))
+        self.assertEqual('old', self.remote_content())
@@ -33,6 +33,72 @@ class TestValidators(BaseTestCase):
         ipv6 = "FE80::0202:B3FF:FE1E:8329"
         self.assertEqual(validators.validate_host(ipv6), ipv6)
 
+    def test_valid_max_parallel_hosts(self):
+        self.assertEqual(validators.validate_max_parallel_hosts('20'), 20)
+        self.assertEqual(validators.validate_max_parallel_hosts(20), 20)
+
+    def test_invalid_max_parallel_hosts(self):
+        for value in ['0', -1, 'many', None]:
+            self.assertRaisesRegexp(ConfigurationError,
+                                    'max_parallel_hosts must be a positive '
+                                    'number',
+                                    validators.validate_max_parallel_hosts,
+                                    value)
+
+    def test_valid_bandwidth_limit(self):
+        self.assertEqual(validators.validate_bandwidth_limit('12.5'), 12.5)
+
+    def test_invalid_bandwidth_limit(self):
+        for value in ['0', -1, 'fast', None]:
+            self.assertRaisesRegexp(ConfigurationError,
+                                    'bandwidth_limit must be a positive '
+                                    'number',
+                                    validators.validate_bandwidth_limit,
+                                    value)
+
+    def test_valid_bandwidth_groups(self):
+        groups = {'rack1': {'hosts': ['slave1', 'slave2'], 'limit': 40}}
+        self.assertEqual(validators.validate_bandwidth_groups(groups),
+                         groups)
+
+    def test_invalid_bandwidth_groups(self):
+        self.assertRaisesRegexp(ConfigurationError,
+                                'Bandwidth group rack1 must have a list of '
+                                'hosts and a limit',
+                                validators.validate_bandwidth_groups,
+                                {'rack1': {'hosts': 'slave1', 'limit': 40}})
+        self.assertRaisesRegexp(ConfigurationError,
+                                'the limit of bandwidth group rack1 must be',
+                                validators.validate_bandwidth_groups,
+                                {'rack1': {'hosts': ['slave1'], 'limit': 0}})
+
+    def test_valid_sizing(self):
+        sizing = {'heap_fraction': '0.8', 'worker_threads_per_core': 4}
+        self.assertEqual(validators.validate_sizing(
+            sizing, ['heap_fraction', 'worker_threads_per_core']), sizing)
+
+    def test_invalid_sizing(self):
+        names = ['heap_fraction', 'worker_threads_per_core']
+        self.assertRaisesRegexp(ConfigurationError,
+                                'Invalid sizing ratio heap. Possible ratios: '
+                                'heap_fraction, worker_threads_per_core',
+                                validators.validate_sizing,
+                                {'heap': 0.5}, names)
+        for value in ['1.5', 0, 'half']:
+            self.assertRaisesRegexp(ConfigurationError,
+                                    'heap_fraction must be a number greater '
+                                    'than 0 and at most 1',
+                                    validators.validate_sizing,
+                                    {'heap_fraction': value}, names)
+        self.assertRaisesRegexp(ConfigurationError,
+                                'worker_threads_per_core must be a positive '
+                                'number',
+                                validators.validate_sizing,
+                                {'worker_threads_per_core': -1}, names)
+        self.assertRaisesRegexp(ConfigurationError,
+                                'sizing must be an object',
+                                validators.validate_sizing, 'yes', names)
+
     def test_valid_hostname(self):
         host = "master"
         self.assertEqual(validators.validate_host(host), host)